@@ -0,0 +1,50 @@
+'''
+Clients for the Sentinel, Graph, Monitor and Log Analytics APIs
+
+The clients are exposed lazily: importing the package is cheap and each
+client module, with its dependencies, is only imported when one of its
+names is first accessed, e.g.
+
+    from azure_api_clients import SentinelClient
+'''
+
+import importlib
+
+# Public name to the submodule defining it
+_LAZY = {'SentinelClient': 'sentinel_client',
+         'GraphClient': 'graph_client',
+         'MonitorClient': 'monitor_client',
+         'AsyncSentinelClient': 'async_clients',
+         'AsyncGraphClient': 'async_clients',
+         'QueryEngine': 'law_query',
+         'QueryCache': 'query_cache',
+         'HttpCache': 'http_cache',
+         'SentinelIncident': 'models',
+         'SentinelAlert': 'models',
+         'GraphIncident': 'models',
+         'GraphAlert': 'models',
+         'ColumnStore': 'models',
+         'TokenProvider': 'api_auth',
+         'StaticTokenProvider': 'api_auth',
+         'get_token_provider': 'api_auth',
+         'get_session': 'transport',
+         'PageError': 'pagination',
+         'execute_query': 'law_query',
+         'execute_batch': 'law_query'}
+
+__all__ = sorted(_LAZY)
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(
+            f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    # Later lookups skip __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
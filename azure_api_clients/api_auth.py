@@ -2,8 +2,180 @@
 Used to create different authentication headers for APIs
 '''
 
-from azure.identity import AzureCliCredential
-from azure.identity import ClientSecretCredential
+import hashlib
+import threading
+import time
+
+from . import messages
+
+MANAGEMENT_SCOPE = 'https://management.azure.com'
+GRAPH_SCOPE = 'https://graph.microsoft.com/.default'
+
+# Tokens closer than this to expiry are refreshed in the background
+REFRESH_MARGIN = 300
+# Tokens closer than this to expiry are refreshed before being handed out
+BLOCKING_MARGIN = 60
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+class TokenProvider:
+    '''
+    Thread-safe, expiry-aware cache around a single azure-identity credential
+
+    The credential is built once, on first use. Tokens are handed out from
+    cache until they get within REFRESH_MARGIN seconds of expiry, at which
+    point a background refresh is started while the still valid token keeps
+    being served. Callers only block when there is no token yet or the
+    cached one is about to expire.
+
+    Argments
+    credential_factory:callable     builds the azure-identity credential
+    scope:string                    scope/resource to request a token for
+    '''
+    def __init__(self, credential_factory, scope,
+                 refresh_margin=REFRESH_MARGIN,
+                 blocking_margin=BLOCKING_MARGIN):
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self.blocking_margin = blocking_margin
+        self._credential_factory = credential_factory
+        self._credential = None
+        self._token = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def credential(self):
+        """
+         The underlying credential, built on first access and reused after.
+        """
+        if self._credential is None:
+            with self._lock:
+                if self._credential is None:
+                    self._credential = self._credential_factory()
+        return self._credential
+
+    def _expires_in(self, token):
+        return token.expires_on - time.time()
+
+    def _refresh(self):
+        # Called with _lock held, so the credential is built here directly
+        # rather than through the credential property, which takes it too
+        if self._credential is None:
+            self._credential = self._credential_factory()
+        token = self._credential.get_token(self.scope)
+        self._token = token
+        return token
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                token = self._token
+                if token is None or \
+                        self._expires_in(token) <= self.refresh_margin:
+                    self._refresh()
+        except Exception as err:
+            # The cached token is still valid, the next call will retry
+            messages.error(f'Background token refresh failed: {err}')
+        finally:
+            self._refreshing = False
+
+    def get_token(self):
+        """
+         Get a valid access token, refreshing it if required.
+
+         Returns:
+            str: raw bearer token
+        """
+        token = self._token
+        if token is None or self._expires_in(token) <= self.blocking_margin:
+            with self._lock:
+                token = self._token
+                if token is None or \
+                        self._expires_in(token) <= self.blocking_margin:
+                    token = self._refresh()
+            return token.token
+        if self._expires_in(token) <= self.refresh_margin and \
+                not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._background_refresh,
+                             daemon=True).start()
+        return token.token
+
+    def headers(self):
+        """
+         Build minimal headers for a REST API request with a current token.
+
+         Returns:
+            dict: JSON formatted headers for HTTP request
+        """
+        header_token_value = "Bearer {}".format(self.get_token())
+        return {"Authorization": header_token_value,
+                "content-type": "application/json"}
+
+
+class StaticTokenProvider:
+    '''
+    Hands out a fixed, already acquired token. Useful for tokens obtained
+        elsewhere and for running clients against mock_server.
+
+    Argments
+    token:string            raw bearer token
+    '''
+    def __init__(self, token):
+        self.token = token
+
+    def get_token(self):
+        return self.token
+
+    def headers(self):
+        return {"Authorization": "Bearer {}".format(self.token),
+                "content-type": "application/json"}
+
+
+def get_token_provider(credential_type, scope, tenant_id=None,
+                       client_id=None, client_secret=None):
+    '''
+    Gets the shared TokenProvider for a credential type and scope, creating
+        it on first use. Providers are shared process wide so every client
+        reuses the same credential and token cache.
+
+    Args:
+        credential_type: 'cli' for AzureCliCredential or 'client_secret' for
+            ClientSecretCredential
+        scope: scope/resource to request a token for
+        tenant_id, client_id, client_secret: registered app details, only
+            used for 'client_secret'
+
+    Returns:
+        TokenProvider: shared provider for the given key
+    '''
+    # A rotated secret gets a new credential, only its digest is kept here
+    secret = hashlib.sha256(client_secret.encode()).hexdigest() \
+        if client_secret else None
+    key = (credential_type, scope, tenant_id, client_id, secret)
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            # azure.identity is only imported once a token is needed
+            if credential_type == 'cli':
+                def factory():
+                    from azure.identity import AzureCliCredential
+                    return AzureCliCredential()
+            elif credential_type == 'client_secret':
+                def factory():
+                    from azure.identity import ClientSecretCredential
+                    return ClientSecretCredential(tenant_id,
+                                                  client_id,
+                                                  client_secret)
+            else:
+                raise ValueError(
+                    f'Unknown credential type: {credential_type}')
+            provider = TokenProvider(factory, scope)
+            _providers[key] = provider
+    return provider
 
 
 def get_headers():
@@ -14,11 +186,7 @@ def get_headers():
     Returns:
         dict: JSON formatted headers for HTTP request
     '''
-    token = AzureCliCredential().get_token('https://management.azure.com')
-    header_token_value = "Bearer {}".format(token.token)
-    headers = {"Authorization": header_token_value,
-               "content-type": "application/json"}
-    return headers
+    return get_token_provider('cli', MANAGEMENT_SCOPE).headers()
 
 
 def get_graph_headers(tenant_id, client_id, client_secret):
@@ -31,12 +199,6 @@ def get_graph_headers(tenant_id, client_id, client_secret):
     '''
     # TODO make env variable
 
-    credential = ClientSecretCredential(tenant_id,
-                                        client_id,
-                                        client_secret)
-    scopes = 'https://graph.microsoft.com/.default'
-    token = credential.get_token(scopes)
-    header_token_value = "Bearer {}".format(token.token)
-    headers = {"Authorization": header_token_value,
-               "content-type": "application/json"}
-    return headers
+    provider = get_token_provider('client_secret', GRAPH_SCOPE, tenant_id,
+                                  client_id, client_secret)
+    return provider.headers()
@@ -0,0 +1,305 @@
+'''
+Creates asyncio native Sentinel and Graph API Clients for bulk lookups
+'''
+
+import asyncio
+import random
+import time
+
+import aiohttp
+
+from . import api_auth as aa
+from . import graph_client
+from . import instrumentation
+from . import json_backend
+from . import messages
+from . import rate_governor
+from . import response_check
+from . import transport
+
+CONCURRENCY = 16
+
+
+def _json_serialize(obj):
+    return json_backend.dumps(obj).decode()
+
+
+class _AsyncClient:
+    '''
+    Shared plumbing for the async clients: a lazily created pooled aiohttp
+        session, token handling and bounded fan-out helpers.
+    '''
+    def __init__(self, token_provider, pool_size=transport.POOL_SIZE,
+                 retries=transport.RETRIES, governor=None):
+        self.token_provider = token_provider
+        self.governor = governor or rate_governor.get_governor()
+        self.pool_size = pool_size
+        self.retries = retries
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """
+         Close the underlying aiohttp session and its pooled connections.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(
+                connector=connector, json_serialize=_json_serialize)
+        return self._session
+
+    async def _headers(self):
+        # Token acquisition may shell out or hit the network on a cache miss
+        return await asyncio.to_thread(self.token_provider.headers)
+
+    async def _request(self, method, url, **kwargs):
+        """
+         Send a request, retrying 429s after Retry-After and 5xx and
+            connection errors with backoff and jitter, and decode the JSON
+            body.
+
+         Returns:
+            dict of the JSON response or False if error
+        """
+        session = self._get_session()
+        for attempt in range(self.retries + 1):
+            delay = None
+            try:
+                headers = await self._headers()
+                tenant = rate_governor.tenant_of(headers)
+                throttle_wait = self.governor.reserve_slot(method, url,
+                                                           tenant)
+                await asyncio.sleep(throttle_wait)
+                start = time.perf_counter()
+                async with session.request(method, url, headers=headers,
+                                           **kwargs) as response:
+                    self.governor.observe(method, url, response.status,
+                                          response.headers, tenant)
+                    instrumentation.record(method, url, response.status,
+                                           time.perf_counter() - start,
+                                           bytes_in=response.content_length,
+                                           retries=attempt,
+                                           throttle_wait=throttle_wait)
+                    if response.status == 429 and attempt < self.retries:
+                        await response.read()
+                        delay = response_check.retry_after(response.headers,
+                                                           attempt + 1)
+                    elif response.status in transport.RETRY_STATUSES and \
+                            attempt < self.retries:
+                        await response.read()
+                    elif response.status > 399:
+                        messages.error(f'{response.status}')
+                        messages.error(await response.text())
+                        return False
+                    else:
+                        return await response.json(
+                            loads=json_backend.loads, content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+            if delay is None:
+                delay = transport.BACKOFF_FACTOR * (2 ** attempt) + \
+                    random.uniform(0, transport.BACKOFF_JITTER)
+            await asyncio.sleep(delay)
+
+    async def _fan_out(self, fetch, ids, concurrency):
+        """
+         Run fetch for every id with at most concurrency requests in flight
+            and yield (id, result) tuples as they complete.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(id):
+            async with semaphore:
+                return id, await fetch(id)
+
+        tasks = [asyncio.ensure_future(run(id)) for id in ids]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class AsyncSentinelClient(_AsyncClient):
+    '''
+    An asyncio Class to interact with MSFT Sentinel REST API
+
+    Argments
+    sub:string              subscription id
+    rg:string               resource group name
+    ws:string               workspace name
+    '''
+    def __init__(self, sub, rg, ws, api_version,
+                 resource=aa.MANAGEMENT_SCOPE, token_provider=None, **kwargs):
+        """
+         An asyncio Class to interact with MSFT Sentinel REST API.
+
+         Args:
+            sub: The id of the subscription to use
+            rg: The resource group name to use ( REQUIRED ).
+            ws: The workspace name to use ( REQUIRED ).
+            api_version
+            resource: ( optional ) ARM endpoint, e.g. a mock_server url
+            token_provider: ( optional ) provider of request headers
+        """
+        super().__init__(token_provider or
+                         aa.get_token_provider('cli', aa.MANAGEMENT_SCOPE),
+                         **kwargs)
+        self.sub = sub
+        self.rg = rg
+        self.ws = ws
+        self.resource = resource
+        self.api_base = self.resource + '/subscriptions/' + \
+            self.sub + '/resourceGroups/' + self.rg + \
+            '/providers/Microsoft.OperationalInsights/workspaces/' + self.ws +\
+            '/providers/Microsoft.SecurityInsights/'
+        self.api_version = f'?api-version={api_version}'
+
+    @instrumentation.operation
+    async def get_inc(self, id):
+        """
+         Get an incident's information from Sentinel
+
+         Args:
+            id: id of the incident to retrieve
+
+         Returns:
+            dict of incident information or False if not found or error
+        """
+        request_url = self.api_base + 'incidents/' + id + self.api_version
+        return await self._request('GET', request_url)
+
+    @instrumentation.operation
+    async def get_alert(self, id):
+        """
+         Get information about an incident's alerts from Sentinel
+
+         Args:
+            id: incident's unique identifier
+
+         Returns:
+            dict with information about the incident's alerts or False if
+                error
+        """
+        request_url = self.api_base + 'incidents/' + id + '/alerts' + \
+            self.api_version
+        return await self._request('POST', request_url)
+
+    def get_incs(self, ids, concurrency=CONCURRENCY):
+        """
+         Get many incidents with bounded concurrency.
+
+         Args:
+            ids: iterable of incident ids
+            concurrency: max requests in flight
+
+         Returns:
+            async generator of (id, incident or False) in completion order
+        """
+        return self._fan_out(self.get_inc, ids, concurrency)
+
+    def get_alerts(self, ids, concurrency=CONCURRENCY):
+        """
+         Get the alerts of many incidents with bounded concurrency.
+
+         Args:
+            ids: iterable of incident ids
+            concurrency: max requests in flight
+
+         Returns:
+            async generator of (id, alerts or False) in completion order
+        """
+        return self._fan_out(self.get_alert, ids, concurrency)
+
+
+class AsyncGraphClient(_AsyncClient):
+    '''
+    An asyncio Class to interact with MSFT Graph API security endpoints
+
+    Argments
+    tenant_id:string        tenant of the registered app
+    client_id:string        id of registered app with Graph API perms
+    client_secret:string    registered app secret
+    resource:string         (optional) Graph endpoint, e.g. a mock_server url
+    token_provider:object   (optional) provider of request headers
+    '''
+    def __init__(self, tenant_id, client_id, client_secret,
+                 resource=graph_client.GRAPH_URL, token_provider=None,
+                 **kwargs):
+        super().__init__(token_provider or
+                         aa.get_token_provider('client_secret',
+                                               aa.GRAPH_SCOPE, tenant_id,
+                                               client_id, client_secret),
+                         **kwargs)
+        self.resource = resource
+        self.api_base = self.resource + '/v1.0'
+
+    @instrumentation.operation
+    async def get_inc(self, id):
+        '''
+        Pull a particular incident's information from M365 Defender
+
+        Arguments
+        id:string           id of incident in M365 Defender
+        '''
+        request_url = self.api_base + '/security/incidents/' + id
+        return await self._request('GET', request_url)
+
+    @instrumentation.operation
+    async def get_inc_and_alerts(self, id):
+        '''
+        Pull an incident's information and it's alerts information
+
+        Arguments
+        id:string           id of incident in M365 Defender
+        '''
+        request_url = self.api_base + '/security/incidents/' + id + \
+            '?$expand=alerts'
+        return await self._request('GET', request_url)
+
+    @instrumentation.operation
+    async def get_alert(self, id):
+        '''
+        Pull a particular alert's information from M365 Defender
+
+        Arguments
+        id:string           id of alert in M365 Defender
+        '''
+        request_url = self.api_base + '/security/alerts_v2/' + id
+        return await self._request('GET', request_url)
+
+    def get_incs(self, ids, concurrency=CONCURRENCY, expand_alerts=False):
+        '''
+        Pull many incidents with bounded concurrency, yielding
+            (id, incident or False) as each completes
+
+        Arguments
+        ids:iterable        ids of incidents in M365 Defender
+        concurrency:int     max requests in flight
+        expand_alerts:bool  whether to include each incident's alerts
+        '''
+        fetch = self.get_inc_and_alerts if expand_alerts else self.get_inc
+        return self._fan_out(fetch, ids, concurrency)
+
+    def get_alerts(self, ids, concurrency=CONCURRENCY):
+        '''
+        Pull many alerts with bounded concurrency, yielding
+            (id, alert or False) as each completes
+
+        Arguments
+        ids:iterable        ids of alerts in M365 Defender
+        concurrency:int     max requests in flight
+        '''
+        return self._fan_out(self.get_alert, ids, concurrency)
@@ -0,0 +1,190 @@
+'''
+    Bulk incident updates over a bounded worker pool
+'''
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import graph_client
+from . import instrumentation
+from . import json_backend
+from . import response_check
+
+WORKERS = 8
+MAX_ATTEMPTS = 6
+
+
+def _report(id, status, attempts, throttle_wait, error=None):
+    return {'id': id,
+            'ok': status is not None and status < 400,
+            'status': status,
+            'attempts': attempts,
+            'throttle_wait': throttle_wait,
+            'error': error}
+
+
+@instrumentation.operation
+def update_sentinel_inc(client, id, patch, max_attempts=MAX_ATTEMPTS):
+    """
+     Apply a patch to one Sentinel incident without losing concurrent
+        changes. The incident is read, the patch merged into its properties
+        and written back with If-Match on the etag that was read. A 412
+        means someone else changed it in between, so it is read and merged
+        again. 429s are retried after Retry-After.
+
+     Args:
+        client: SentinelClient of the incident's workspace
+        id: incident id
+        patch: dict of incident properties to change, e.g.
+            {'status': 'Closed', 'classification': 'FalsePositive'}
+        max_attempts: max throttled reads and PUTs before giving up
+
+     Returns:
+        dict report with id, ok, status, attempts, throttle_wait and error
+    """
+    url = client.api_base + 'incidents/' + id + client.api_version
+    throttle_wait = 0
+    attempts = 0
+    current = None
+    while attempts < max_attempts:
+        if current is None:
+            response = client.session.get(url, headers=client.headers)
+            if response.status_code == 429:
+                attempts += 1
+                wait = response_check.retry_after(response.headers, attempts)
+                throttle_wait += wait
+                time.sleep(wait)
+                continue
+            if response.status_code > 399:
+                return _report(id, response.status_code, attempts,
+                               throttle_wait,
+                               response_check.error_detail(response))
+            current = json_backend.parse(response)
+
+        attempts += 1
+        body = {'etag': current.get('etag'),
+                'properties': {**current['properties'], **patch}}
+        headers = client.headers
+        if current.get('etag'):
+            headers['If-Match'] = current['etag']
+        response = client.session.put(url, json=body, headers=headers)
+        if response.status_code == 429:
+            wait = response_check.retry_after(response.headers, attempts)
+            throttle_wait += wait
+            time.sleep(wait)
+        elif response.status_code in (409, 412):
+            # Changed since it was read, merge onto the latest version
+            current = None
+        elif response.status_code > 399:
+            return _report(id, response.status_code, attempts,
+                           throttle_wait,
+                           response_check.error_detail(response))
+        else:
+            return _report(id, response.status_code, attempts,
+                           throttle_wait)
+    return _report(id, response.status_code, attempts, throttle_wait,
+                   response_check.error_detail(response))
+
+
+def update_sentinel_incs(client, updates, workers=WORKERS,
+                         max_attempts=MAX_ATTEMPTS):
+    """
+     Apply many incident patches in parallel, see update_sentinel_inc.
+
+     Args:
+        client: SentinelClient of the incidents' workspace
+        updates: iterable of (id, patch) pairs
+        workers: max updates in flight
+        max_attempts: max PUTs per incident
+
+     Returns:
+        list of reports in the same order as updates
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(update_sentinel_inc, client, id, patch,
+                               max_attempts)
+                   for id, patch in updates]
+        return [future.result() for future in futures]
+
+
+def _batch_error(result):
+    body = result['body']
+    if isinstance(body, dict) and 'error' in body:
+        return body['error']
+    return body
+
+
+@instrumentation.operation
+def update_graph_chunk(client, chunk, max_attempts=MAX_ATTEMPTS):
+    """
+     Apply up to BATCH_LIMIT M365 Defender incident updates without losing
+        concurrent changes. The incidents are read through one $batch for
+        their @odata.etag and patched through another with If-Match on it.
+        Incidents that changed in between ( 412 ) are read and patched
+        again. Throttled sub-requests are retried by GraphClient.batch after
+        Retry-After.
+
+     Args:
+        client: GraphClient
+        chunk: list of (id, body) pairs, body as in update_inc
+        max_attempts: max PATCHes per incident
+
+     Returns:
+        list of reports in the same order as chunk
+    """
+    reports = [None] * len(chunk)
+    attempts = [0] * len(chunk)
+    throttle_wait = [0] * len(chunk)
+    pending = list(range(len(chunk)))
+    while pending:
+        reads = client.batch([{'method': 'GET',
+                               'url': '/security/incidents/' + chunk[i][0]}
+                              for i in pending])
+        etags = []
+        for i, read in zip(pending, reads):
+            throttle_wait[i] += read['throttle_wait']
+            if read['status'] > 399:
+                reports[i] = _report(chunk[i][0], read['status'],
+                                     attempts[i], throttle_wait[i],
+                                     _batch_error(read))
+            else:
+                etags.append((i, (read['body'] or {}).get('@odata.etag')))
+
+        results = client.update_incs([(chunk[i][0], chunk[i][1], etag)
+                                      for i, etag in etags])
+        pending = []
+        for (i, _), result in zip(etags, results):
+            attempts[i] += result['attempts']
+            throttle_wait[i] += result['throttle_wait']
+            if result['status'] == 412 and attempts[i] < max_attempts:
+                # Changed since it was read, patch the latest version
+                pending.append(i)
+                continue
+            error = _batch_error(result) if result['status'] > 399 else None
+            reports[i] = _report(chunk[i][0], result['status'], attempts[i],
+                                 throttle_wait[i], error)
+    return reports
+
+
+def update_graph_incs(client, updates, workers=WORKERS,
+                      max_attempts=MAX_ATTEMPTS):
+    """
+     Apply many M365 Defender incident updates, BATCH_LIMIT per chunk with
+        chunks running in parallel, see update_graph_chunk.
+
+     Args:
+        client: GraphClient
+        updates: iterable of (id, body) pairs, body as in update_inc
+        workers: max chunks in flight
+        max_attempts: max PATCHes per incident
+
+     Returns:
+        list of reports in the same order as updates
+    """
+    updates = list(updates)
+    size = graph_client.BATCH_LIMIT
+    chunks = [updates[i:i + size] for i in range(0, len(updates), size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda chunk: update_graph_chunk(
+            client, chunk, max_attempts), chunks)
+        return [report for reports in results for report in reports]
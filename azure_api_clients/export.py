@@ -0,0 +1,156 @@
+'''
+    Streams API responses to files without buffering whole bodies
+'''
+
+import contextlib
+import gzip
+import os
+
+from . import json_backend
+
+CHUNK_SIZE = 64 * 1024
+COMPRESSIONS = (None, 'gzip', 'zstd')
+SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def resolve(out, default, compression=None):
+    """
+     Pick the destination for an out argument.
+
+     Args:
+        out: True for the default file name, else a path or binary file
+            object chosen by the caller
+        default: file name in the current directory used when out is True
+        compression: compression in use, adds its suffix to default
+
+     Returns:
+        path or file object to write to
+    """
+    if out is True:
+        return default + SUFFIXES[compression]
+    return out
+
+
+@contextlib.contextmanager
+def open_sink(dest, compression=None):
+    """
+     Open a binary sink, optionally compressing what is written to it.
+
+     Args:
+        dest: path or binary file object. File objects are left open.
+        compression: None, 'gzip' or 'zstd' ( needs the zstandard package )
+
+     Returns:
+        context manager yielding a binary file object
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression: {compression}')
+
+    with contextlib.ExitStack() as stack:
+        if isinstance(dest, (str, os.PathLike)):
+            fd = stack.enter_context(open(dest, 'wb'))
+        else:
+            fd = dest
+        if compression == 'gzip':
+            fd = stack.enter_context(gzip.GzipFile(fileobj=fd, mode='wb'))
+        elif compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError as err:
+                raise ImportError("compression='zstd' needs the zstandard "
+                                  "package, install the zstd extra") from err
+            fd = stack.enter_context(
+                zstandard.ZstdCompressor().stream_writer(fd, closefd=False))
+        yield fd
+
+
+def write_response(response, out, compression=None, default='response.json',
+                   chunk_size=CHUNK_SIZE):
+    """
+     Write a response body to out chunk by chunk. The request should be sent
+        with stream=True so the body is never held in memory as a whole.
+
+     Args:
+        response: response from requests package
+        out: True, path or binary file object, see resolve
+        compression: None, 'gzip' or 'zstd'
+        default: file name used when out is True
+        chunk_size: bytes read from the connection at a time
+
+     Returns:
+        int: bytes of body written
+    """
+    written = 0
+    with open_sink(resolve(out, default, compression), compression) as fd:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            fd.write(chunk)
+            written += len(chunk)
+    return written
+
+
+class Written:
+    '''
+    What a client method returns in place of the response when out is set
+        and the body was streamed to out. The body is not kept in memory, so
+        read it back from destination rather than from response.
+
+    Argments
+    response:Response       the streamed response, its body already consumed
+    destination:object      path or binary file object the body went to
+    size:int                bytes of body written, before compression
+    '''
+    def __init__(self, response, destination, size):
+        self.response = response
+        self.destination = destination
+        self.size = size
+
+    @property
+    def status_code(self):
+        return self.response.status_code
+
+    @property
+    def ok(self):
+        return self.response.ok
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    def __repr__(self):
+        return (f'<Written [{self.status_code}] {self.size} bytes to '
+                f'{self.destination!r}>')
+
+
+def save(response, out, compression=None, default='response.json'):
+    """
+     Stream a response body to out, see write_response.
+
+     Returns:
+        Written with the destination and bytes written
+    """
+    destination = resolve(out, default, compression)
+    return Written(response, destination,
+                   write_response(response, destination, compression))
+
+
+def write_ndjson(items, out, compression=None, default='response.ndjson'):
+    """
+     Write items as newline delimited JSON, one item per line. Items are
+        consumed lazily so a paginated iterator keeps memory flat.
+
+     Args:
+        items: iterable of JSON serializable items
+        out: True, path or binary file object, see resolve
+        compression: None, 'gzip' or 'zstd'
+        default: file name used when out is True
+
+     Returns:
+        int: number of items written
+    """
+    count = 0
+    with open_sink(resolve(out, default, compression), compression) as fd:
+        for item in items:
+            fd.write(json_backend.dumps(item))
+            fd.write(b'\n')
+            count += 1
+    return count
@@ -0,0 +1,194 @@
+'''
+    Runs SentinelClient operations across many workspaces in parallel
+'''
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import api_auth
+from . import export
+from . import json_backend
+from . import messages
+from . import response_check
+from . import transport
+from .sentinel_client import SentinelClient
+
+CONCURRENCY = 8
+# Items buffered between the workers and the consumer of iter_items
+QUEUE_SIZE = 1000
+
+
+def _target(target):
+    if isinstance(target, dict):
+        return target['sub'], target['rg'], target['ws']
+    sub, rg, ws = target
+    return sub, rg, ws
+
+
+def _name(operation):
+    return getattr(operation, '__name__', operation)
+
+
+def _result(result):
+    """
+     Normalize what a client method returned into (ok, result). Responses
+        are decoded, the False and None error conventions of the clients are
+        not ok and iterators are drained into lists. A body streamed to out
+        is left there.
+    """
+    if result is False or result is None:
+        # The client already printed the error
+        return False, 'Request failed'
+    if isinstance(result, export.Written):
+        return True, result
+    if hasattr(result, 'status_code'):
+        if result.status_code > 399:
+            return False, response_check.error_detail(result)
+        return True, json_backend.parse_or_none(result)
+    if hasattr(result, '__next__'):
+        return True, list(result)
+    return True, result
+
+
+class Fleet:
+    '''
+    Many Sentinel workspaces behind one shared session and token provider.
+        Operations run on every workspace in parallel, capped at
+        concurrency, and a failing workspace never stops the others.
+
+    Argments
+    targets:list            (sub, rg, ws) tuples or dicts with those keys
+    api_version:string      Sentinel api version
+    concurrency:int         max workspaces worked on at once
+    session:ClientSession   (optional) defaults to the shared pooled session
+    token_provider:object   (optional) defaults to the shared Azure CLI
+                                provider
+    resource:string         (optional) ARM endpoint, e.g. a mock_server url
+    '''
+    def __init__(self, targets, api_version, concurrency=CONCURRENCY,
+                 session=None, token_provider=None,
+                 resource=api_auth.MANAGEMENT_SCOPE):
+        self.concurrency = concurrency
+        self.session = session or transport.get_session()
+        self.token_provider = token_provider or api_auth.get_token_provider(
+            'cli', api_auth.MANAGEMENT_SCOPE)
+        self.clients = {}
+        for target in targets:
+            sub, rg, ws = _target(target)
+            self.clients[f'{sub}/{rg}/{ws}'] = SentinelClient(
+                sub, rg, ws, api_version, session=self.session,
+                resource=resource, token_provider=self.token_provider)
+        # workspace key to error of the last iter_items run
+        self.errors = {}
+
+    def _call(self, client, operation, args, kwargs):
+        if callable(operation):
+            return operation(client, *args, **kwargs)
+        return getattr(client, operation)(*args, **kwargs)
+
+    def _run_one(self, key, operation, args, kwargs):
+        start = time.perf_counter()
+        try:
+            ok, result = _result(self._call(self.clients[key], operation,
+                                            args, kwargs))
+            error = None if ok else result
+        except Exception as err:
+            ok, result, error = False, None, f'{type(err).__name__}: {err}'
+        return {'workspace': key,
+                'ok': ok,
+                'result': result if ok else None,
+                'error': error,
+                'seconds': time.perf_counter() - start}
+
+    def run(self, operation, *args, **kwargs):
+        """
+         Run an operation on every workspace, yielding each workspace's
+            report as soon as it finishes. Closing the generator early
+            cancels the workspaces not started yet.
+
+         Args:
+            operation: name of a SentinelClient method, e.g.
+                'get_alertrules', or a callable taking the client first
+            args, kwargs: passed on to the operation
+
+         Returns:
+            generator of dicts with workspace ( 'sub/rg/ws' ), ok, result,
+                error and seconds. Responses are decoded into result and
+                iterators drained into lists.
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(self._run_one, key, operation, args,
+                                   kwargs)
+                       for key in self.clients]
+            try:
+                for future in as_completed(futures):
+                    report = future.result()
+                    if not report['ok']:
+                        messages.error(f'{_name(operation)} failed on '
+                                       f'{report["workspace"]}: '
+                                       f'{report["error"]}')
+                    yield report
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def collect(self, operation, *args, **kwargs):
+        """
+         Run an operation on every workspace and wait for all of them.
+
+         Returns:
+            dict of workspace key to report, see run
+        """
+        return {report['workspace']: report
+                for report in self.run(operation, *args, **kwargs)}
+
+    def iter_items(self, operation, *args, **kwargs):
+        """
+         Run an iterating operation, e.g. 'iter_incs' or 'iter_alertrules',
+            on every workspace and stream the items of all of them as they
+            arrive. At most QUEUE_SIZE items are buffered, and closing the
+            generator early stops the workers. Workspaces that fail are
+            reported and left in errors.
+
+         Returns:
+            generator of (workspace key, item) tuples
+        """
+        self.errors = {}
+        items = queue.Queue(maxsize=QUEUE_SIZE)
+        stop = threading.Event()
+
+        def work(key):
+            if stop.is_set():
+                return
+            try:
+                for item in self._call(self.clients[key], operation, args,
+                                       kwargs):
+                    while not stop.is_set():
+                        try:
+                            items.put((key, item), timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            except Exception as err:
+                self.errors[key] = f'{type(err).__name__}: {err}'
+                messages.error(f'{_name(operation)} failed on {key}: '
+                               f'{err}')
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(work, key) for key in self.clients]
+            try:
+                while True:
+                    try:
+                        yield items.get(timeout=0.1)
+                    except queue.Empty:
+                        if all(future.done() for future in futures) and \
+                                items.empty():
+                            return
+            finally:
+                stop.set()
+                for future in futures:
+                    future.cancel()
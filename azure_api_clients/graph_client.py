@@ -2,11 +2,26 @@
 Creates Graph API Client
 '''
 
-import requests
+import base64
+import time
+
 from . import api_auth as aa
+from . import export
+from . import instrumentation
+from . import json_backend
+from . import messages
 
 # Will use when fixed
 from . import response_check
+from . import transport
+
+GRAPH_URL = 'https://graph.microsoft.com'
+# Max sub-requests Graph accepts in a single $batch
+BATCH_LIMIT = 20
+BATCH_RETRIES = 3
+# Sub-request statuses worth retrying. 424 means a dependency failed, the
+# dependent is only resent when that dependency is resent too.
+BATCH_RETRY_STATUSES = (424, 429, 500, 502, 503, 504)
 
 
 class GraphClient:
@@ -18,53 +33,85 @@ class GraphClient:
     client_secret:string    registered app secret
     auth:string             authority to login
                                 (Example: https://login.microsoftonline.com)
+    session:ClientSession   (optional) transport session to send requests
+                                with, defaults to the shared pooled session
+    resource:string         (optional) Graph endpoint, e.g. a mock_server url
+    token_provider:object   (optional) provider of request headers, defaults
+                                to the shared provider of the app
 
     '''
-    def __init__(self, tenant_id, client_id, client_secret):
-        self.resource = "https://graph.microsoft.com"
-        self.api_base = 'https://graph.microsoft.com/v1.0'
+    def __init__(self, tenant_id, client_id, client_secret, session=None,
+                 resource=GRAPH_URL, token_provider=None):
+        self.session = session or transport.get_session()
+        self.resource = resource
+        self.api_base = self.resource + '/v1.0'
         # self.tenant_id = tenant_id
         # self.client_id = client_id
         # self.client_secret = client_secret
-        self.headers = aa.get_graph_headers(tenant_id, client_id,
-                                            client_secret)
+        self.token_provider = token_provider or \
+            aa.get_token_provider('client_secret', aa.GRAPH_SCOPE, tenant_id,
+                                  client_id, client_secret)
+
+    @property
+    def headers(self):
+        '''
+        Request headers with a current token from the shared provider.
+        '''
+        return self.token_provider.headers()
 
 # TODO Fix to remove out and use rc
-    def get_inc(self, id, out=False):
+    @instrumentation.operation
+    def get_inc(self, id, out=False, compression=None):
         '''
         Pull a particular incident's information from M365 Defender
 
         Arguments
         id:string           id of incident in M365 Defender
-        out:boolean         whether to write output to file
+        out:boolean         whether to write output to file, or a path or
+                                binary file object to stream it to
+        compression:string  None, 'gzip' or 'zstd' to compress the output
+
+        Returns
+        the response, or an export.Written ( destination, size ) when out is
+            set and the request succeeded, as the body went to out
         '''
         incident_endpoint = '/security/incidents/' + id
         request_url = self.api_base + incident_endpoint
-        response = requests.get(request_url, headers=self.headers)
-        if out:
-            with open('graph_inc.json', 'wb') as fd:
-                fd.write(response.content)
+        response = self.session.get(request_url, headers=self.headers,
+                                    stream=bool(out))
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='graph_inc.json')
         return response
 
 # TODO Fix to remove out and use rc
-    def get_inc_and_alerts(self, id, out=False):
+    @instrumentation.operation
+    def get_inc_and_alerts(self, id, out=False, compression=None):
         '''
         Pull an incident's information and it's alerts information
 
         Arguments
         id:string           id of incident in M365 Defender
-        out:boolean         whether to write output to file
+        out:boolean         whether to write output to file, or a path or
+                                binary file object to stream it to
+        compression:string  None, 'gzip' or 'zstd' to compress the output
+
+        Returns
+        the response, or an export.Written ( destination, size ) when out is
+            set and the request succeeded, as the body went to out
         '''
         incident_endpoint = '/security/incidents/' + id + '?$expand=alerts'
         request_url = self.api_base + incident_endpoint
-        response = requests.get(request_url, headers=self.headers)
-        if out:
-            with open('graph_inc_alerts.json', 'wb') as fd:
-                fd.write(response.content)
+        response = self.session.get(request_url, headers=self.headers,
+                                    stream=bool(out))
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='graph_inc_alerts.json')
         return response
 
 # TODO Fix to remove out and use rc
-    def update_inc(self, id, body):
+    @instrumentation.operation
+    def update_inc(self, id, body, etag=None):
         '''
         Update an incident's information
 
@@ -74,14 +121,21 @@ class GraphClient:
                                 Example at https://learn.microsoft.com/
                                     en-us/graph/api/security-incident-update
                                     ?view=graph-rest-beta&tabs=http#request-body
-        out:boolean         whether to write output to file
+        etag:string         (optional) @odata.etag the incident was read
+                                with, sent as If-Match so the update fails
+                                with 412 if it changed since
         '''
         update_endpoint = '/security/incidents/' + id
         request_url = self.api_base + update_endpoint
-        response = requests.patch(request_url, json=body, headers=self.headers)
+        headers = self.headers
+        if etag:
+            headers['If-Match'] = etag
+        response = self.session.patch(request_url, json=body,
+                                      headers=headers)
         return response
 
 # TODO Fix to remove out and use rc
+    @instrumentation.operation
     def get_alert(self, id):
         '''
         Update an incident's information
@@ -96,22 +150,257 @@ class GraphClient:
         '''
         update_endpoint = '/security/alerts_v2/' + id
         request_url = self.api_base + update_endpoint
-        response = requests.get(request_url, headers=self.headers)
+        response = self.session.get(request_url, headers=self.headers)
         return response
 
 # TODO Fix to remove out and use rc
-    def get_user_photo(self, id, out=False):
+    @instrumentation.operation
+    def get_user_photo(self, id, out=False, compression=None):
         '''
-        Pull an incident's information and it's alerts information
+        Pull a user's photo
 
         Arguments
-        id:string           id of incident in M365 Defender
-        out:boolean         whether to write output to file
+        id:string           id or userPrincipalName of the user
+        out:boolean         whether to write output to file, or a path or
+                                binary file object to stream it to
+        compression:string  None, 'gzip' or 'zstd' to compress the output
+
+        Returns
+        the response, or an export.Written ( destination, size ) when out is
+            set and the request succeeded, as the body went to out
         '''
         photo_endpoint = '/users/' + id + '/photo/$value'
         request_url = self.api_base + photo_endpoint
-        response = requests.get(request_url, headers=self.headers)
-        if out:
-            with open('graph_inc_alerts.json', 'wb') as fd:
-                fd.write(response.content)
+        response = self.session.get(request_url, headers=self.headers,
+                                    stream=bool(out))
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='graph_user_photo.jpg')
         return response
+
+    @instrumentation.operation
+    def get_user_photo_meta(self, id):
+        '''
+        Pull the metadata of a user's photo, whose @odata.mediaEtag changes
+            whenever the photo does
+
+        Arguments
+        id:string           id or userPrincipalName of the user
+        '''
+        photo_endpoint = '/users/' + id + '/photo'
+        request_url = self.api_base + photo_endpoint
+        response = self.session.get(request_url, headers=self.headers)
+        return response
+
+    @instrumentation.operation
+    def batch(self, sub_requests, retries=BATCH_RETRIES):
+        '''
+        Send many requests through Graph's JSON $batch endpoint, packing up
+            to BATCH_LIMIT sub-requests per round trip. Sub-requests that
+            fail with a throttling or server status are retried on their
+            own, honoring Retry-After. A sub-request that failed with 424
+            because of a dependency is retried along with it, unless the
+            dependency failed for good, in which case it keeps its 424.
+
+        Arguments
+        sub_requests:list   dicts with 'method' and 'url' (relative to
+                                the API version, e.g. /users/{id}) and
+                                optionally 'body', 'headers' and 'dependsOn'
+                                (list of indexes into sub_requests). Requests
+                                that depend on each other are always sent in
+                                the same batch.
+        retries:int         times to resend failed sub-requests
+
+        Returns
+        list of dicts with 'status', 'headers' and 'body' for each
+            sub-request, in the same order as sub_requests, along with
+            'attempts', the times it was sent, and 'throttle_wait', the
+            seconds waited before resending it
+        '''
+        results = [None] * len(sub_requests)
+        waited = [0] * len(sub_requests)
+        pending = list(range(len(sub_requests)))
+        for attempt in range(retries + 1):
+            for chunk in self._batch_chunks(sub_requests, pending):
+                for index, result in self._send_batch(sub_requests,
+                                                      chunk).items():
+                    results[index] = {**result, 'attempts': attempt + 1,
+                                      'throttle_wait': waited[index]}
+            pending = self._retryable(sub_requests, results, pending)
+            if not pending or attempt == retries:
+                break
+            # The longest Retry-After asked for, backoff when none was sent
+            waits = [response_check.retry_after(results[i]['headers'],
+                                                default=None)
+                     for i in pending]
+            waits = [wait for wait in waits if wait is not None]
+            wait = max(waits) if waits else 2 ** attempt
+            for i in pending:
+                waited[i] += wait
+            time.sleep(wait)
+        return results
+
+    def _retryable(self, sub_requests, results, pending):
+        '''
+        The pending indexes worth resending. A 424 is only resent along
+            with one of its dependencies, so a dependent never runs after a
+            dependency that failed for good.
+        '''
+        retry = {i for i in pending
+                 if results[i]['status'] in BATCH_RETRY_STATUSES and
+                 results[i]['status'] != 424}
+        changed = True
+        while changed:
+            changed = False
+            for i in pending:
+                if i not in retry and results[i]['status'] == 424 and \
+                        any(dep in retry
+                            for dep in sub_requests[i].get('dependsOn', [])):
+                    retry.add(i)
+                    changed = True
+        return [i for i in pending if i in retry]
+
+    def _batch_chunks(self, sub_requests, pending):
+        '''
+        Split pending indexes into chunks of at most BATCH_LIMIT, keeping
+            every dependsOn chain within one chunk.
+        '''
+        pending_set = set(pending)
+        group_of = {i: i for i in pending}
+
+        def find(i):
+            while group_of[i] != i:
+                group_of[i] = group_of[group_of[i]]
+                i = group_of[i]
+            return i
+
+        for i in pending:
+            for dep in sub_requests[i].get('dependsOn', []):
+                if dep in pending_set:
+                    group_of[find(i)] = find(dep)
+        groups = {}
+        for i in pending:
+            groups.setdefault(find(i), []).append(i)
+
+        chunk = []
+        for group in groups.values():
+            if len(group) > BATCH_LIMIT:
+                raise ValueError(f'dependsOn chain longer than {BATCH_LIMIT}')
+            if len(chunk) + len(group) > BATCH_LIMIT:
+                yield chunk
+                chunk = []
+            chunk.extend(group)
+        if chunk:
+            yield chunk
+
+    def _send_batch(self, sub_requests, chunk):
+        '''
+        POST one $batch and map its responses back to input indexes.
+        '''
+        in_chunk = set(chunk)
+        payload = []
+        for i in chunk:
+            sub = sub_requests[i]
+            item = {'id': str(i), 'method': sub['method'], 'url': sub['url']}
+            if 'body' in sub:
+                item['body'] = sub['body']
+                item['headers'] = {'Content-Type': 'application/json'}
+            if 'headers' in sub:
+                item['headers'] = {**item.get('headers', {}),
+                                   **sub['headers']}
+            # Dependencies that already succeeded are not resent
+            depends_on = [str(d) for d in sub.get('dependsOn', [])
+                          if d in in_chunk]
+            if depends_on:
+                item['dependsOn'] = depends_on
+            payload.append(item)
+
+        response = self.session.post(self.api_base + '/$batch',
+                                     json={'requests': payload},
+                                     headers=self.headers)
+        if not response_check.response_check(response):
+            failed = {'status': response.status_code,
+                      'headers': dict(response.headers), 'body': None}
+            return {i: failed for i in chunk}
+        results = {}
+        for item in json_backend.parse(response)['responses']:
+            results[int(item['id'])] = {'status': item['status'],
+                                        'headers': item.get('headers', {}),
+                                        'body': item.get('body')}
+        return results
+
+    def _batch_bodies(self, urls):
+        results = self.batch([{'method': 'GET', 'url': url} for url in urls])
+        bodies = []
+        for result in results:
+            if result['status'] > 399:
+                messages.error(f'{result["status"]}')
+                bodies.append(False)
+            else:
+                bodies.append(result['body'])
+        return bodies
+
+    @instrumentation.operation
+    def get_incs(self, ids):
+        '''
+        Pull many incidents from M365 Defender through $batch
+
+        Arguments
+        ids:list            ids of incidents in M365 Defender
+
+        Returns
+        list of incident dicts, or False for failed ids, in order of ids
+        '''
+        return self._batch_bodies(['/security/incidents/' + id
+                                   for id in ids])
+
+    @instrumentation.operation
+    def get_alerts(self, ids):
+        '''
+        Pull many alerts from M365 Defender through $batch
+
+        Arguments
+        ids:list            ids of alerts in M365 Defender
+
+        Returns
+        list of alert dicts, or False for failed ids, in order of ids
+        '''
+        return self._batch_bodies(['/security/alerts_v2/' + id for id in ids])
+
+    @instrumentation.operation
+    def get_user_photos(self, ids):
+        '''
+        Pull many users' photos through $batch
+
+        Arguments
+        ids:list            ids or userPrincipalNames of users
+
+        Returns
+        list of photo bytes, or False for failed ids, in order of ids
+        '''
+        bodies = self._batch_bodies(['/users/' + id + '/photo/$value'
+                                     for id in ids])
+        # Binary sub-responses come back base64 encoded
+        return [base64.b64decode(body) if body else body for body in bodies]
+
+    @instrumentation.operation
+    def update_incs(self, updates):
+        '''
+        Update many incidents through $batch
+
+        Arguments
+        updates:iterable    (id, body) pairs, body as in update_inc, or
+                                (id, body, etag) to send If-Match
+
+        Returns
+        list of dicts as in batch for each update, in the same order as
+            updates
+        '''
+        sub_requests = []
+        for id, body, *etag in updates:
+            sub = {'method': 'PATCH', 'url': '/security/incidents/' + id,
+                   'body': body}
+            if etag and etag[0]:
+                sub['headers'] = {'If-Match': etag[0]}
+            sub_requests.append(sub)
+        return self.batch(sub_requests)
@@ -0,0 +1,143 @@
+'''
+    Persistent conditional-request (ETag / Last-Modified) cache for GETs
+'''
+
+import fnmatch
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import instrumentation
+
+CHUNK_SIZE = 64 * 1024
+# Response headers kept with a cached body
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+class HttpCache:
+    '''
+    A directory backed HTTP cache for large, rarely changing GETs such as
+        the template catalogs. Within an endpoint's max-age the stored body
+        is served without a request. After that the request is revalidated
+        with If-None-Match / If-Modified-Since and a 304 serves the body
+        from disk again.
+
+    Argments
+    path:string             directory to keep cached bodies in
+    max_age:dict            (optional) fnmatch pattern over the endpoint
+                                template ( see
+                                instrumentation.endpoint_template ) to
+                                seconds served without revalidating, e.g.
+                                {'*/alertRuleTemplates*': 3600}
+    default_max_age:int     seconds for endpoints matching no pattern
+    '''
+    def __init__(self, path, max_age=None, default_max_age=0):
+        self.path = path
+        self.max_age = max_age or {}
+        self.default_max_age = default_max_age
+        os.makedirs(path, exist_ok=True)
+
+    def _files(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.path, key)
+        return base + '.json', base + '.body'
+
+    def _max_age(self, url):
+        endpoint = instrumentation.endpoint_template(url)
+        for pattern, seconds in self.max_age.items():
+            if fnmatch.fnmatch(endpoint, pattern):
+                return seconds
+        return self.default_max_age
+
+    def _load(self, meta_file):
+        try:
+            with open(meta_file) as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, meta_file, meta):
+        tmp = f'{meta_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump(meta, fd)
+        os.replace(tmp, meta_file)
+
+    def _cached_response(self, url, meta, body_file):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response.encoding = 'utf-8'
+        with open(body_file, 'rb') as fd:
+            response._content = fd.read()
+        response.from_cache = True
+        return response
+
+    def get(self, session, url, headers):
+        """
+         GET url through the cache.
+
+         Args:
+            session: requests Session to send requests with
+            url: url to get
+            headers: request headers
+
+         Returns:
+            requests Response. Responses served from disk have from_cache
+                set to True. Errors are returned as they came and never
+                cached.
+        """
+        meta_file, body_file = self._files(url)
+        meta = self._load(meta_file)
+        if meta is not None and not os.path.exists(body_file):
+            meta = None
+
+        if meta is not None and \
+                time.time() - meta['stored_at'] < self._max_age(url):
+            return self._cached_response(url, meta, body_file)
+
+        headers = dict(headers)
+        if meta is not None:
+            if meta['headers'].get('ETag'):
+                headers['If-None-Match'] = meta['headers']['ETag']
+            if meta['headers'].get('Last-Modified'):
+                headers['If-Modified-Since'] = \
+                    meta['headers']['Last-Modified']
+
+        response = session.get(url, headers=headers, stream=True)
+        if response.status_code == 304 and meta is not None:
+            response.close()
+            meta['stored_at'] = time.time()
+            self._save_meta(meta_file, meta)
+            return self._cached_response(url, meta, body_file)
+        if response.status_code != 200:
+            return response
+
+        # Stream to disk so the cached copy is never half written
+        tmp = f'{body_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as fd:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                fd.write(chunk)
+        os.replace(tmp, body_file)
+        meta = {'url': url,
+                'stored_at': time.time(),
+                'headers': {name: response.headers[name]
+                            for name in KEPT_HEADERS
+                            if name in response.headers}}
+        self._save_meta(meta_file, meta)
+        cached = self._cached_response(url, meta, body_file)
+        cached.from_cache = False
+        return cached
+
+    def clear(self):
+        """
+         Remove every cached body.
+        """
+        for name in os.listdir(self.path):
+            if name.endswith(('.json', '.body')):
+                os.remove(os.path.join(self.path, name))
@@ -0,0 +1,295 @@
+'''
+    Delta-sync of Sentinel incidents into a local, indexed SQLite store
+'''
+
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from . import instrumentation
+from . import messages
+
+WORKERS = 8
+# Incidents written per transaction
+BATCH_SIZE = 500
+# Rescanned slack before the checkpoint, for late or out of order writes
+OVERLAP = timedelta(minutes=5)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS incidents (
+    workspace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    number INTEGER,
+    title TEXT,
+    severity TEXT,
+    status TEXT,
+    owner TEXT,
+    created TEXT,
+    modified TEXT,
+    incident TEXT NOT NULL,
+    alerts TEXT,
+    PRIMARY KEY (workspace, name)
+);
+CREATE INDEX IF NOT EXISTS incidents_severity
+    ON incidents (workspace, severity);
+CREATE INDEX IF NOT EXISTS incidents_status ON incidents (workspace, status);
+CREATE INDEX IF NOT EXISTS incidents_owner ON incidents (workspace, owner);
+CREATE INDEX IF NOT EXISTS incidents_created ON incidents (workspace, created);
+CREATE INDEX IF NOT EXISTS incidents_modified
+    ON incidents (workspace, modified);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    workspace TEXT PRIMARY KEY,
+    modified TEXT NOT NULL
+);
+'''
+
+_UPSERT = '''
+INSERT INTO incidents (workspace, name, number, title, severity, status,
+                       owner, created, modified, incident, alerts)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (workspace, name) DO UPDATE SET
+    number = excluded.number, title = excluded.title,
+    severity = excluded.severity, status = excluded.status,
+    owner = excluded.owner, created = excluded.created,
+    modified = excluded.modified, incident = excluded.incident,
+    alerts = COALESCE(excluded.alerts, incidents.alerts)
+'''
+
+
+def workspace_key(client):
+    """
+     Key a SentinelClient's incidents are stored under.
+    """
+    return f'{client.sub}/{client.rg}/{client.ws}'.lower()
+
+
+def _owner(properties):
+    owner = properties.get('owner') or {}
+    return owner.get('assignedTo') or owner.get('userPrincipalName') or \
+        owner.get('email')
+
+
+def _row(workspace, incident, alerts):
+    properties = incident.get('properties', {})
+    return (workspace,
+            incident['name'],
+            properties.get('incidentNumber'),
+            properties.get('title'),
+            properties.get('severity'),
+            properties.get('status'),
+            _owner(properties),
+            properties.get('createdTimeUtc'),
+            properties.get('lastModifiedTimeUtc'),
+            json.dumps(incident),
+            None if alerts is None else json.dumps(alerts))
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class IncidentStore:
+    '''
+    SQLite store of incidents from one or more workspaces, indexed on
+        severity, status, owner and created / modified time, with a sync
+        checkpoint per workspace. Safe to share between threads.
+
+    Argments
+    path:string             database file, ':memory:' for a private store
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            if path != ':memory:':
+                self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def checkpoint(self, workspace):
+        """
+         lastModifiedTimeUtc of the newest incident synced for a workspace,
+            or None before the first sync.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT modified FROM checkpoints WHERE workspace = ?',
+                (workspace,)).fetchone()
+        return row['modified'] if row else None
+
+    def upsert(self, workspace, incidents, checkpoint=None):
+        """
+         Insert or replace incidents in one transaction, optionally moving
+            the workspace checkpoint forward in the same transaction.
+
+         Args:
+            workspace: key from workspace_key
+            incidents: iterable of (incident dict, alerts or None) pairs.
+                None keeps the alerts already stored.
+            checkpoint: ( optional ) new checkpoint for the workspace
+        """
+        rows = [_row(workspace, incident, alerts)
+                for incident, alerts in incidents]
+        with self._lock, self._db:
+            self._db.executemany(_UPSERT, rows)
+            if checkpoint is not None:
+                self._db.execute(
+                    'INSERT INTO checkpoints (workspace, modified) '
+                    'VALUES (?, ?) ON CONFLICT (workspace) DO UPDATE SET '
+                    'modified = MAX(modified, excluded.modified)',
+                    (workspace, checkpoint))
+
+    def get(self, workspace, name):
+        """
+         Get one stored incident.
+
+         Returns:
+            incident dict, with its alerts under 'alerts' when they were
+                synced, or None if not stored
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT incident, alerts FROM incidents '
+                'WHERE workspace = ? AND name = ?',
+                (workspace, name)).fetchone()
+        return self._incident(row) if row else None
+
+    def query(self, workspace, severity=None, status=None, owner=None,
+              since=None, until=None, limit=None):
+        """
+         List stored incidents, newest modification first. Every filter is
+            optional and answered from an index.
+
+         Args:
+            workspace: key from workspace_key
+            severity: a severity or list of severities, e.g. 'High'
+            status: a status or list of statuses, e.g. ['New', 'Active']
+            owner: assignedTo of the owner
+            since, until: bounds on lastModifiedTimeUtc, as datetimes or
+                ISO strings
+            limit: max incidents returned
+
+         Returns:
+            list of incident dicts
+        """
+        clauses = ['workspace = ?']
+        params = [workspace]
+        for column, value in (('severity', severity), ('status', status),
+                              ('owner', owner)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            clauses.append(f'{column} IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+        for op, value in (('>=', since), ('<', until)):
+            if value is None:
+                continue
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            clauses.append(f'modified {op} ?')
+            params.append(value)
+        sql = 'SELECT incident, alerts FROM incidents WHERE ' + \
+            ' AND '.join(clauses) + ' ORDER BY modified DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [self._incident(row) for row in rows]
+
+    def count(self, workspace):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM incidents WHERE workspace = ?',
+                (workspace,)).fetchone()[0]
+
+    def _incident(self, row):
+        incident = json.loads(row['incident'])
+        if row['alerts'] is not None:
+            incident['alerts'] = json.loads(row['alerts'])
+        return incident
+
+
+class IncidentSync:
+    '''
+    Pulls the incidents of a workspace modified since the last sync into an
+        IncidentStore. Incidents are listed oldest modification first, so
+        the checkpoint only moves past incidents that were stored and an
+        interrupted sync resumes where it stopped.
+
+    Argments
+    client:SentinelClient   client of the workspace to sync
+    store:IncidentStore     store to sync into
+    alerts:bool             also fetch each changed incident's alerts
+    workers:int             max alert requests in flight
+    overlap:timedelta       rescanned slack before the checkpoint
+    '''
+    def __init__(self, client, store, alerts=False, workers=WORKERS,
+                 overlap=OVERLAP):
+        self.client = client
+        self.store = store
+        self.alerts = alerts
+        self.workers = workers
+        self.overlap = overlap
+        self.workspace = workspace_key(client)
+
+    def _filter(self):
+        checkpoint = self.store.checkpoint(self.workspace)
+        if checkpoint is None:
+            return None
+        since = _parse_time(checkpoint) - self.overlap
+        return 'properties/lastModifiedTimeUtc ge ' + \
+            since.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    def _alerts(self, incident):
+        alerts = self.client.get_alert(incident['name'])
+        return alerts.get('value', []) if alerts else None
+
+    def _write(self, pool, batch):
+        if pool is None:
+            pairs = [(incident, None) for incident in batch]
+        else:
+            pairs = list(zip(batch, pool.map(self._alerts, batch)))
+        checkpoint = max((incident['properties'].get('lastModifiedTimeUtc')
+                          for incident in batch), default=None)
+        self.store.upsert(self.workspace, pairs, checkpoint)
+
+    @instrumentation.operation
+    def sync(self):
+        """
+         Pull incidents modified since the checkpoint and upsert them.
+            When a page fails to load pagination.PageError is raised; the
+            batches stored before it moved the checkpoint, so the next sync
+            resumes from there.
+
+         Returns:
+            int: number of incidents written
+        """
+        incidents = self.client.iter_incs(
+            filter=self._filter(),
+            orderby='properties/lastModifiedTimeUtc asc')
+        pool = ThreadPoolExecutor(max_workers=self.workers) \
+            if self.alerts else None
+        written = 0
+        batch = []
+        try:
+            for incident in incidents:
+                batch.append(incident)
+                if len(batch) >= BATCH_SIZE:
+                    self._write(pool, batch)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                self._write(pool, batch)
+                written += len(batch)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        messages.success(f'Synced {written} incidents of {self.workspace}')
+        return written
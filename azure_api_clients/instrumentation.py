@@ -0,0 +1,242 @@
+'''
+    Per-request instrumentation hooks and in-process latency histograms
+'''
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import math
+import threading
+from urllib.parse import urlsplit
+
+from . import messages
+
+# Latency histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           math.inf)
+# Path segments followed by a resource name or id in endpoint templates
+_NAMED_SEGMENTS = {'subscriptions', 'resourcegroups', 'workspaces',
+                   'incidents', 'alerts_v2', 'alertrules',
+                   'alertruletemplates', 'dataconnectors',
+                   'contentproducttemplates', 'datacollectionrules',
+                   'tables', 'users', 'operations', 'operationstatuses',
+                   'locations'}
+
+_operation = contextvars.ContextVar('operation', default=None)
+_hooks = []
+
+
+def add_hook(hook):
+    """
+     Register a callable to receive every request event. Events are dicts
+        with operation, http_method, endpoint, status, latency, bytes_out,
+        bytes_in, retries and throttle_wait.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+     Unregister a callable added with add_hook.
+    """
+    _hooks.remove(hook)
+
+
+@contextlib.contextmanager
+def named(name):
+    """
+     Name the requests made inside the block in instrumentation events.
+        An outer name wins, so requests keep the name of the public method
+        that was called.
+    """
+    if name is None or _operation.get() is not None:
+        yield
+        return
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def operation(func):
+    """
+     Decorator naming the requests made inside a client method after it
+        ( e.g. SentinelClient.get_inc ) in instrumentation events.
+    """
+    name = func.__qualname__
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with named(name):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with named(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def current_operation():
+    """
+     Name of the client method currently making requests, or None.
+    """
+    return _operation.get()
+
+
+def endpoint_template(url):
+    """
+     Reduce a url to its endpoint template by replacing resource names and
+        ids, so requests to the same endpoint are grouped together.
+
+     Returns:
+        str: e.g. management.azure.com/subscriptions/{}/.../incidents/{}
+    """
+    parts = urlsplit(url)
+    segments = parts.path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1].lower() in _NAMED_SEGMENTS:
+            segments[i] = '{}'
+    return (parts.hostname or '') + '/'.join(segments)
+
+
+class Histogram:
+    '''
+    Cumulative-bucket histogram in the Prometheus style
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    '''
+    In-process aggregates of request events, labelled by operation,
+        endpoint template and status
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.latency = {}
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        labels = (event['operation'] or '', event['endpoint'],
+                  str(event['status']))
+        with self._lock:
+            histogram = self.latency.get(labels)
+            if histogram is None:
+                histogram = self.latency[labels] = Histogram(self.buckets)
+            histogram.observe(event['latency'])
+            totals = self.totals.setdefault(labels, [0, 0, 0, 0.0])
+            totals[0] += event['bytes_in'] or 0
+            totals[1] += event['bytes_out'] or 0
+            totals[2] += event['retries'] or 0
+            totals[3] += event['throttle_wait'] or 0.0
+
+    def reset(self):
+        with self._lock:
+            self.latency.clear()
+            self.totals.clear()
+
+    def prometheus_text(self):
+        """
+         Export the aggregates in the Prometheus text exposition format.
+
+         Returns:
+            str
+        """
+        def fmt(labels, extra=''):
+            values = zip(('operation', 'endpoint', 'status'), labels)
+            pairs = [f'{name}="{_escape(value)}"' for name, value in values]
+            return '{' + ','.join(pairs) + extra + '}'
+
+        lines = ['# HELP azure_api_request_duration_seconds '
+                 'Request latency.',
+                 '# TYPE azure_api_request_duration_seconds histogram']
+        with self._lock:
+            for labels, histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    le = ',le="' + le + '"'
+                    lines.append('azure_api_request_duration_seconds_bucket'
+                                 f'{fmt(labels, le)} {cumulative}')
+                lines.append('azure_api_request_duration_seconds_sum'
+                             f'{fmt(labels)} {histogram.sum}')
+                lines.append('azure_api_request_duration_seconds_count'
+                             f'{fmt(labels)} {histogram.count}')
+            counters = (('azure_api_response_bytes_total',
+                         'Response bytes received.'),
+                        ('azure_api_request_bytes_total',
+                         'Request bytes sent.'),
+                        ('azure_api_retries_total',
+                         'Transport level retries.'),
+                        ('azure_api_throttle_wait_seconds_total',
+                         'Seconds spent waiting on the rate governor.'))
+            for i, (name, help) in enumerate(counters):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} counter')
+                for labels, totals in sorted(self.totals.items()):
+                    lines.append(f'{name}{fmt(labels)} {totals[i]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def record(http_method, url, status, latency, bytes_out=None, bytes_in=None,
+           retries=0, throttle_wait=0.0, endpoint=None):
+    """
+     Record one request in the registry and hand it to every hook. Hook
+        errors are reported and never break the request.
+
+     Returns:
+        dict: the event
+    """
+    event = {'operation': _operation.get(),
+             'http_method': http_method,
+             'endpoint': endpoint or endpoint_template(url),
+             'status': status,
+             'latency': latency,
+             'bytes_out': bytes_out,
+             'bytes_in': bytes_in,
+             'retries': retries,
+             'throttle_wait': throttle_wait}
+    registry.record(event)
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as err:
+            messages.error(f'Instrumentation hook failed: {err}')
+    return event
+
+
+def prometheus_text():
+    """
+     Export the default registry in the Prometheus text exposition format.
+
+     Returns:
+        str
+    """
+    return registry.prometheus_text()
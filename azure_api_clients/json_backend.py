@@ -0,0 +1,131 @@
+'''
+    Pluggable JSON encoding and decoding, and single-parse response bodies
+'''
+
+import json
+
+# Preferred backends, the first one installed is used
+BACKENDS = ('orjson', 'msgspec', 'json')
+
+_backend = None
+_loads = None
+_dumps = None
+# Marks a response whose body was parsed and is not JSON
+_INVALID = object()
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def set_backend(name=None):
+    """
+     Select the JSON backend, by default the first of BACKENDS installed.
+
+     Args:
+        name: ( optional ) 'orjson', 'msgspec' or 'json'
+
+     Returns:
+        str: name of the backend selected
+    """
+    global _backend, _loads, _dumps
+    for candidate in (name,) if name else BACKENDS:
+        if candidate == 'orjson':
+            try:
+                import orjson
+            except ImportError:
+                if name:
+                    raise
+                continue
+            _loads, _dumps = orjson.loads, orjson.dumps
+        elif candidate == 'msgspec':
+            try:
+                import msgspec
+            except ImportError:
+                if name:
+                    raise
+                continue
+            decoder = msgspec.json.Decoder()
+            _loads, _dumps = decoder.decode, msgspec.json.encode
+        elif candidate == 'json':
+            _loads, _dumps = json.loads, _stdlib_dumps
+        else:
+            raise ValueError(f'Unknown JSON backend: {candidate}')
+        _backend = candidate
+        return _backend
+
+
+def backend():
+    """
+     Name of the JSON backend in use, selecting it on first call.
+    """
+    if _backend is None:
+        set_backend()
+    return _backend
+
+
+def loads(data):
+    """
+     Decode JSON from bytes or str.
+
+     Raises:
+        ValueError: data is not valid JSON, whatever the backend
+    """
+    if _loads is None:
+        set_backend()
+    try:
+        return _loads(data)
+    except ValueError:
+        raise
+    except Exception as err:
+        # msgspec.DecodeError is not a ValueError
+        raise ValueError(str(err)) from err
+
+
+def dumps(obj):
+    """
+     Encode obj as compact JSON.
+
+     Returns:
+        bytes
+    """
+    if _dumps is None:
+        set_backend()
+    return _dumps(obj)
+
+
+def parse(response):
+    """
+     Decode the JSON body of a response at most once. The result is kept
+        on the response, so response_check and the caller share one parse.
+
+     Args:
+        response: response from requests package
+
+     Returns:
+        the decoded body
+
+     Raises:
+        ValueError: the body is empty or not JSON
+    """
+    body = response.__dict__.get('_json_body')
+    if body is None:
+        try:
+            body = loads(response.content)
+        except ValueError:
+            body = _INVALID
+        response._json_body = body
+    if body is _INVALID:
+        raise ValueError(f'Response body is not JSON: {response.url}')
+    return body
+
+
+def parse_or_none(response):
+    """
+     Decode the JSON body of a response like parse, or None if the body is
+        empty or not JSON.
+    """
+    try:
+        return parse(response)
+    except ValueError:
+        return None
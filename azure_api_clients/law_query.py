@@ -2,64 +2,521 @@
 Executes queries against a log analytics workspace
 '''
 
-import pandas as pd
-from datetime import timedelta
-from azure.monitor.query import LogsQueryClient, LogsQueryStatus
-from azure.identity import DefaultAzureCredential
-from azure.core.exceptions import HttpResponseError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import json
+import os
+import threading
+import time
 
+from . import instrumentation
+from . import query_cache
 
-def execute_query(ws_id: str, query: str, timespan: tuple) -> dict:
+# pandas, azure-monitor-query and azure-identity are imported on first use
+# rather than here, as together they dominate the import time of the
+# package.
+
+# 'json' is the original behaviour: the first table only, as records that
+# went through a DataFrame JSON round trip. Every other mode returns a list
+# with one entry per result table.
+RESULT_MODES = ('json', 'records', 'rows', 'columns', 'dataframe', 'arrow')
+# Max queries LogsQueryClient.query_batch accepts per request
+BATCH_LIMIT = 100
+# Sliced queries stop bisecting PARTIAL windows below this size
+MIN_SLICE = timedelta(minutes=1)
+SLICE_CONCURRENCY = 4
+QUERY_ENDPOINT = 'api.loganalytics.io/v1/workspaces/{}/query'
+BATCH_ENDPOINT = 'api.loganalytics.io/v1/$batch'
+
+
+def _table_columns(table):
     """
-    Executes KQL query against LAW and returns results.
+     Transpose a result table into a column oriented dict of lists.
+    """
+    if table.rows:
+        values = zip(*table.rows)
+    else:
+        values = ([] for _ in table.columns)
+    return {name: list(column) for name, column in zip(table.columns, values)}
 
-    Args:
-        ws_id: id of the workspace to query.
-        query: query to be executed.
-            Should be a string that contains the SQL query
-        timespan: ~datetime.timedelta or tuple[~datetime.datetime,
-            ~datetime.timedelta] or tuple[~datetime.datetime,
-            ~datetime.datetime] or None
 
-    Returns:
-        dictionary representation of query results
+def _convert_table(table, mode):
+    """
+     Convert a LogsTable to the requested result mode without copying
+        through JSON.
+
+     Args:
+        table: LogsTable from the query response
+        mode: one of RESULT_MODES other than 'json'
+
+     Returns:
+        rows: tuple of (column names, list of row tuples)
+        records: list of dicts keyed by column name
+        columns: dict of column name to list of values
+        dataframe: pandas DataFrame
+        arrow: pyarrow Table
     """
+    if mode == 'rows':
+        return list(table.columns), [tuple(row) for row in table.rows]
+    if mode == 'records':
+        columns = table.columns
+        return [dict(zip(columns, row)) for row in table.rows]
+    if mode == 'columns':
+        return _table_columns(table)
+    if mode == 'dataframe':
+        import pandas as pd
+        return pd.DataFrame(data=table.rows, columns=table.columns)
+    if mode == 'arrow':
+        try:
+            import pyarrow as pa
+        except ImportError as err:
+            raise ImportError("mode='arrow' needs the pyarrow package, "
+                              "install the arrow extra") from err
+        return pa.table(_table_columns(table))
+    raise ValueError(f'Unknown result mode: {mode}')
+
+
+def _resolve_timespan(timespan):
+    """
+     Turn any timespan accepted by LogsQueryClient into absolute
+        (start, end) datetimes.
+    """
+    if isinstance(timespan, timedelta):
+        end = datetime.now(timezone.utc)
+        return end - timespan, end
+    start, end = timespan
+    if isinstance(end, timedelta):
+        end = start + end
+    return start, end
+
+
+class QueryEngine:
+    '''
+    A long lived Log Analytics query engine. The credential and
+        LogsQueryClient are created once and reused for every query, so the
+        credential chain is only walked on the first token request.
 
-    credential = DefaultAzureCredential()
-    client = LogsQueryClient(credential)
+    Argments
+    credential:TokenCredential  (optional) credential to authenticate with,
+                                    defaults to DefaultAzureCredential
+    cache:QueryCache            (optional) cache for successful results
+    query_kwargs:dict           (optional) passed to every query call, e.g.
+                                    {'enforce_https': False} for mock_server
+    client_kwargs               passed through to LogsQueryClient
+    '''
+    def __init__(self, credential=None, cache=None, query_kwargs=None,
+                 **client_kwargs):
+        from azure.monitor.query import LogsQueryClient
+        if credential is None:
+            from azure.identity import DefaultAzureCredential
+            credential = DefaultAzureCredential()
+        self.credential = credential
+        self.cache = cache
+        self.query_kwargs = query_kwargs or {}
+        self.client = LogsQueryClient(self.credential, **client_kwargs)
 
-    try:
-        response = client.query_workspace(
-            workspace_id=ws_id,
-            query=query,
-            timespan=timespan
-            )
+    def _query(self, ws_id, query, timespan):
+        """
+         Run one query_workspace call and record it with instrumentation.
+        """
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.client.query_workspace(workspace_id=ws_id,
+                                                   query=query,
+                                                   timespan=timespan,
+                                                   **self.query_kwargs)
+            status = response.status.name
+            return response
+        finally:
+            instrumentation.record('POST', None, status,
+                                   time.perf_counter() - start,
+                                   endpoint=QUERY_ENDPOINT)
+
+    def _convert(self, response, mode):
+        """
+         Convert a query response to the requested result mode, printing
+            the error of partial results.
+        """
+        from azure.monitor.query import LogsQueryStatus
         if response.status == LogsQueryStatus.PARTIAL:
             error = response.partial_error
             data = response.partial_data
             print(error)
         elif response.status == LogsQueryStatus.SUCCESS:
             data = response.tables
+        else:
+            print(response)
+            return None
+        if mode != 'json':
+            return [_convert_table(table, mode) for table in data]
+        import pandas as pd
         for table in data:
             df = pd.DataFrame(data=table.rows, columns=table.columns)
             return json.loads(df.to_json(orient="records"))
-    except HttpResponseError as err:
-        print("something fatal happened")
-        print(err)
 
+    @instrumentation.operation
+    def execute(self, ws_id: str, query: str, timespan: tuple,
+                mode: str = 'json', slice_size: timedelta = None,
+                concurrency: int = SLICE_CONCURRENCY) -> dict:
+        """
+        Executes KQL query against LAW and returns results.
+
+        Args:
+            ws_id: id of the workspace to query.
+            query: query to be executed.
+            timespan: ~datetime.timedelta or tuple[~datetime.datetime,
+                ~datetime.timedelta] or tuple[~datetime.datetime,
+                ~datetime.datetime] or None
+            mode: shape of the results, one of RESULT_MODES
+            slice_size: ( optional ) split timespan into windows of this
+                size, see query_sliced. mode is ignored when slicing.
+            concurrency: max windows queried in parallel when slicing
+
+        Returns:
+            query results in the requested mode or None if error, or a
+                generator of records when slice_size is set
+        """
+        from azure.core.exceptions import HttpResponseError
+        from azure.monitor.query import LogsQueryStatus
+        if slice_size is not None:
+            return self.query_sliced(ws_id, query, timespan, slice_size,
+                                     concurrency)
+        if mode not in RESULT_MODES:
+            raise ValueError(f'Unknown result mode: {mode}')
+
+        if self.cache is not None:
+            key = query_cache.make_key(ws_id, query, timespan, mode)
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+
+        try:
+            response = self._query(ws_id, query, timespan)
+            result = self._convert(response, mode)
+            # Partial results are never cached
+            if self.cache is not None and \
+                    response.status == LogsQueryStatus.SUCCESS:
+                self.cache.set(key, result)
+            return result
+        except HttpResponseError as err:
+            print("something fatal happened")
+            print(err)
+
+    def _query_window(self, ws_id, query, start, end, min_window):
+        """
+         Query one window, bisecting it while LAW returns PARTIAL results.
+
+         Returns:
+            (column names, list of rows) of the first table
+        """
+        from azure.monitor.query import LogsQueryStatus
+        with instrumentation.named('QueryEngine.query_sliced'):
+            response = self._query(ws_id, query, (start, end))
+        if response.status == LogsQueryStatus.PARTIAL:
+            if end - start > min_window:
+                middle = start + (end - start) / 2
+                columns, rows = self._query_window(ws_id, query, start,
+                                                   middle, min_window)
+                _, later = self._query_window(ws_id, query, middle, end,
+                                              min_window)
+                rows.extend(later)
+                return columns, rows
+            print(response.partial_error)
+            data = response.partial_data
+        else:
+            data = response.tables
+        if not data:
+            return [], []
+        return list(data[0].columns), [list(row) for row in data[0].rows]
+
+    def query_sliced(self, ws_id: str, query: str, timespan: tuple,
+                     slice_size: timedelta,
+                     concurrency: int = SLICE_CONCURRENCY,
+                     min_window: timedelta = MIN_SLICE):
+        """
+        Executes KQL query over a wide timespan by splitting it into windows
+            of slice_size that run in parallel. A window that comes back
+            PARTIAL (row or size limits) is bisected until it completes or
+            gets smaller than min_window. Results are streamed in window
+            order, with at most concurrency windows held in memory.
+
+        Args:
+            ws_id: id of the workspace to query.
+            query: query to be executed. Should not aggregate across the
+                whole timespan, as each window is queried on its own.
+            timespan: any timespan accepted by execute
+            slice_size: size of each window
+            concurrency: max windows queried in parallel
+            min_window: smallest window to bisect down to
+
+        Returns:
+            generator of dicts, one per row of the first result table.
+                HttpResponseError is raised if a window fails.
+        """
+        start, end = _resolve_timespan(timespan)
+        windows = []
+        while start < end:
+            windows.append((start, min(start + slice_size, end)))
+            start += slice_size
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            pending = deque(pool.submit(self._query_window, ws_id, query,
+                                        *window, min_window)
+                            for window in windows[:concurrency])
+            remaining = iter(windows[concurrency:])
+            while pending:
+                columns, rows = pending.popleft().result()
+                window = next(remaining, None)
+                if window is not None:
+                    pending.append(pool.submit(self._query_window, ws_id,
+                                               query, *window, min_window))
+                for row in rows:
+                    yield dict(zip(columns, row))
+
+    @instrumentation.operation
+    def execute_batch(self, jobs, mode: str = 'json') -> list:
+        """
+        Executes many KQL queries, possibly against different workspaces,
+            through LogsQueryClient.query_batch. Jobs are sent
+            BATCH_LIMIT at a time.
+
+        Args:
+            jobs: iterable of (ws_id, query, timespan) tuples
+            mode: shape of each job's results, one of RESULT_MODES
+
+        Returns:
+            list of results in the same order as jobs, None for failed jobs
+        """
+        from azure.core.exceptions import HttpResponseError
+        from azure.monitor.query import LogsBatchQuery
+        if mode not in RESULT_MODES:
+            raise ValueError(f'Unknown result mode: {mode}')
+
+        batch = [LogsBatchQuery(workspace_id=ws_id, query=query,
+                                timespan=timespan)
+                 for ws_id, query, timespan in jobs]
+        results = []
+        for i in range(0, len(batch), BATCH_LIMIT):
+            start = time.perf_counter()
+            try:
+                responses = self.client.query_batch(batch[i:i + BATCH_LIMIT],
+                                                    **self.query_kwargs)
+                instrumentation.record('POST', None, 'SUCCESS',
+                                       time.perf_counter() - start,
+                                       endpoint=BATCH_ENDPOINT)
+            except HttpResponseError as err:
+                instrumentation.record('POST', None, 'error',
+                                       time.perf_counter() - start,
+                                       endpoint=BATCH_ENDPOINT)
+                print("something fatal happened")
+                print(err)
+                results.extend([None] * len(batch[i:i + BATCH_LIMIT]))
+                continue
+            results.extend(self._convert(response, mode)
+                           for response in responses)
+        return results
+
+
+_engine = None
+
+
+def get_engine() -> QueryEngine:
+    """
+    Gets the shared QueryEngine used by the module level functions, creating
+        it on first use.
+
+    Returns:
+        QueryEngine
+    """
+    global _engine
+    if _engine is None:
+        _engine = QueryEngine()
+    return _engine
+
+
+def set_engine(engine: QueryEngine):
+    """
+    Replaces the shared QueryEngine, e.g. with one that has a QueryCache.
+
+    Args:
+        engine: QueryEngine used by the module level functions from now on
+    """
+    global _engine
+    _engine = engine
+
+
+def execute_query(ws_id: str, query: str, timespan: tuple,
+                  mode: str = 'json', slice_size: timedelta = None,
+                  concurrency: int = SLICE_CONCURRENCY) -> dict:
+    """
+    Executes KQL query against LAW and returns results.
+
+    Args:
+        ws_id: id of the workspace to query.
+        query: query to be executed.
+            Should be a string that contains the SQL query
+        timespan: ~datetime.timedelta or tuple[~datetime.datetime,
+            ~datetime.timedelta] or tuple[~datetime.datetime,
+            ~datetime.datetime] or None
+        mode: shape of the results, one of RESULT_MODES. Defaults to 'json'
+            for the first table as records. Other modes skip the JSON round
+            trip and return one entry per table.
+        slice_size: ( optional ) opt in to time slicing. The timespan is
+            split into windows of this size that run in parallel, PARTIAL
+            windows are bisected, and rows are streamed back in order.
+        concurrency: max windows queried in parallel when slicing
+
+    Returns:
+        dictionary representation of query results, or a generator of
+            records when slice_size is set
+    """
+    return get_engine().execute(ws_id, query, timespan, mode, slice_size,
+                                concurrency)
+
+
+def execute_batch(jobs, mode: str = 'json') -> list:
+    """
+    Executes many (ws_id, query, timespan) jobs in batched requests with the
+        shared QueryEngine.
+
+    Args:
+        jobs: iterable of (ws_id, query, timespan) tuples
+        mode: shape of each job's results, one of RESULT_MODES
 
-def get_active_conns(ws_id):
+    Returns:
+        list of results in the same order as jobs, None for failed jobs
+    """
+    return get_engine().execute_batch(jobs, mode)
+
+
+ACTIVE_CONNS_QUERY = """let a = (
+    CommonSecurityLog
+    | summarize LastSeen = max(TimeGenerated) by DeviceVendor, DeviceProduct
+    | project Source = strcat("CEF - ", DeviceVendor, " - ", DeviceProduct),
+        LastSeen
+    );
+let b = (
+    AzureDiagnostics
+    | summarize LastSeen = max(TimeGenerated) by ResourceType, Type
+    | project Source = strcat(Type, " - ", ResourceType), LastSeen
+    );
+union *
+| summarize LastSeen = max(TimeGenerated) by Type
+| project Source = Type, LastSeen
+| union a, b"""
+
+
+class ActiveConnsTracker:
+    '''
+    Keeps a rolling answer to get_active_conns per workspace without
+        rescanning the whole window. The first refresh scans the full
+        window, later refreshes only scan from the last high-water mark
+        (minus an overlap for late ingestion) and merge the last-seen time
+        of each source locally, aging out sources not seen within window.
+
+    Argments
+    state_path:string       json file the sources and watermarks persist to
+    window:timedelta        how far back a source counts as active
+    overlap:timedelta       rescanned slack before the watermark
+    engine:QueryEngine      (optional) engine to query with, defaults to the
+                                shared engine
+    '''
+    def __init__(self, state_path, window=timedelta(7),
+                 overlap=timedelta(hours=1), engine=None):
+        self.state_path = state_path
+        self.window = window
+        self.overlap = overlap
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as fd:
+                self._state = json.load(fd)
+
+    def _save(self):
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump(self._state, fd)
+        os.replace(tmp, self.state_path)
+
+    def refresh(self, ws_id: str) -> list:
+        """
+        Scan the interval since the last refresh of a workspace and return
+            its active sources.
+
+        Args:
+            ws_id: id of the workspace to query.
+
+        Returns:
+            list of {'Source': name} dicts sorted by Source, as returned by
+                get_active_conns, or None if the query failed or came back
+                PARTIAL. Neither moves the watermark.
+        """
+        engine = self.engine or get_engine()
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            state = self._state.get(ws_id, {'watermark': None,
+                                            'sources': {}})
+        oldest = now - self.window
+        if state['watermark']:
+            start = max(datetime.fromisoformat(state['watermark']) -
+                        self.overlap, oldest)
+        else:
+            start = oldest
+
+        # Queried directly rather than through execute, which hands back the
+        # rows of a PARTIAL result as if they were complete
+        from azure.core.exceptions import HttpResponseError
+        from azure.monitor.query import LogsQueryStatus
+        try:
+            with instrumentation.named('ActiveConnsTracker.refresh'):
+                response = engine._query(ws_id, ACTIVE_CONNS_QUERY,
+                                         (start, now))
+        except HttpResponseError as err:
+            print(err)
+            return None
+        if response.status != LogsQueryStatus.SUCCESS:
+            # Sources may be missing, so the watermark stays put and the
+            # next refresh rescans this interval
+            print(getattr(response, 'partial_error', response))
+            return None
+        tables = [_convert_table(table, 'records')
+                  for table in response.tables]
+
+        sources = dict(state['sources'])
+        for record in tables[0] if tables else []:
+            last_seen = record['LastSeen'].isoformat()
+            if last_seen > sources.get(record['Source'], ''):
+                sources[record['Source']] = last_seen
+        oldest = oldest.isoformat()
+        sources = {source: last_seen for source, last_seen in sources.items()
+                   if last_seen >= oldest}
+
+        with self._lock:
+            self._state[ws_id] = {'watermark': now.isoformat(),
+                                  'sources': sources}
+            self._save()
+        return [{'Source': source} for source in sorted(sources)]
+
+
+def get_active_conns(ws_id, tracker: ActiveConnsTracker = None):
     """
     Executes KQL query against LAW and returns a list of all dataTypes that
         have been active over the past 7 days.
 
     Args:
         ws_id: id of the workspace to query.
+        tracker: ( optional ) ActiveConnsTracker to answer incrementally from
+            its persisted state instead of scanning all 7 days
 
     Returns:
         dictionary representation of query results
     """
+    if tracker is not None:
+        return tracker.refresh(ws_id)
+
     timespan = timedelta(7)
     query = """let a = (
         CommonSecurityLog
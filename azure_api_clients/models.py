@@ -0,0 +1,237 @@
+'''
+    Compact incident and alert models with lazily decoded fields
+'''
+
+import sys
+
+from . import json_backend
+
+
+def _lookup(data, path):
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+class _Model:
+    '''
+    Base of the models. The fields listed in FIELDS are decoded when the
+        model is built and kept in slots. The full resource is only kept as
+        compact JSON bytes and parsed again on access through get, [] or
+        to_dict, so a model costs little more than its raw bytes.
+
+    FIELDS is a tuple of (attribute, path into the resource dict) and
+        INTERNED the attributes with few distinct values, which are shared
+        across models.
+    '''
+    __slots__ = ('raw',)
+    FIELDS = ()
+    INTERNED = ()
+
+    def __init__(self, raw, data=None):
+        self.raw = raw
+        if data is None:
+            data = json_backend.loads(raw)
+        for name, path in self.FIELDS:
+            value = _lookup(data, path)
+            if name in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, name, value)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+         Build a model from a resource dict, e.g. response.json().
+        """
+        return cls(json_backend.dumps(data), data)
+
+    @classmethod
+    def from_bytes(cls, raw):
+        """
+         Build a model from the JSON bytes of a resource, e.g.
+            response.content.
+        """
+        return cls(bytes(raw))
+
+    def to_dict(self):
+        """
+         Decode the full resource.
+        """
+        return json_backend.loads(self.raw)
+
+    def get(self, key, default=None):
+        """
+         Decode the full resource and get one of its top level keys.
+        """
+        return self.to_dict().get(key, default)
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.raw == other.raw
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}'
+                           for name, _ in self.FIELDS[:3])
+        return f'{type(self).__name__}({fields})'
+
+
+class SentinelIncident(_Model):
+    '''
+    Sentinel incident as returned by SentinelClient.get_inc / iter_incs
+    '''
+    __slots__ = ('name', 'number', 'title', 'severity', 'status', 'owner',
+                 'created', 'modified')
+    FIELDS = (('name', ('name',)),
+              ('number', ('properties', 'incidentNumber')),
+              ('title', ('properties', 'title')),
+              ('severity', ('properties', 'severity')),
+              ('status', ('properties', 'status')),
+              ('owner', ('properties', 'owner', 'assignedTo')),
+              ('created', ('properties', 'createdTimeUtc')),
+              ('modified', ('properties', 'lastModifiedTimeUtc')))
+    INTERNED = ('severity', 'status', 'owner')
+
+
+class SentinelAlert(_Model):
+    '''
+    Sentinel alert, one item of SentinelClient.get_alert's value list
+    '''
+    __slots__ = ('name', 'display_name', 'severity', 'status', 'product',
+                 'time_generated')
+    FIELDS = (('name', ('name',)),
+              ('display_name', ('properties', 'alertDisplayName')),
+              ('severity', ('properties', 'severity')),
+              ('status', ('properties', 'status')),
+              ('product', ('properties', 'productName')),
+              ('time_generated', ('properties', 'timeGenerated')))
+    INTERNED = ('severity', 'status', 'product')
+
+
+class GraphIncident(_Model):
+    '''
+    Graph security incident as returned by GraphClient.get_inc / get_incs
+    '''
+    __slots__ = ('id', 'display_name', 'severity', 'status', 'assigned_to',
+                 'created', 'modified')
+    FIELDS = (('id', ('id',)),
+              ('display_name', ('displayName',)),
+              ('severity', ('severity',)),
+              ('status', ('status',)),
+              ('assigned_to', ('assignedTo',)),
+              ('created', ('createdDateTime',)),
+              ('modified', ('lastUpdateDateTime',)))
+    INTERNED = ('severity', 'status', 'assigned_to')
+
+
+class GraphAlert(_Model):
+    '''
+    Graph security alert as returned by GraphClient.get_alert / get_alerts
+    '''
+    __slots__ = ('id', 'title', 'incident_id', 'severity', 'status',
+                 'service_source', 'created')
+    FIELDS = (('id', ('id',)),
+              ('title', ('title',)),
+              ('incident_id', ('incidentId',)),
+              ('severity', ('severity',)),
+              ('status', ('status',)),
+              ('service_source', ('serviceSource',)),
+              ('created', ('createdDateTime',)))
+    INTERNED = ('severity', 'status', 'service_source')
+
+
+class ColumnStore:
+    '''
+    Column oriented container for large sets of one model. Each field of
+        the model is held in its own list and the raw bytes in another, so
+        no per-item objects are kept until an item is accessed.
+
+    Argments
+    model:class             model class of the items, e.g. SentinelIncident
+    '''
+    def __init__(self, model):
+        self.model = model
+        self.columns = {name: [] for name, _ in model.FIELDS}
+        self.raw = []
+
+    @classmethod
+    def from_iter(cls, model, items):
+        """
+         Build a store from resource dicts or models, e.g.
+            ColumnStore.from_iter(SentinelIncident, client.iter_incs()).
+        """
+        store = cls(model)
+        store.extend(items)
+        return store
+
+    def append(self, item):
+        """
+         Add a model or resource dict.
+        """
+        if not isinstance(item, self.model):
+            item = self.model.from_dict(item)
+        for name, column in self.columns.items():
+            column.append(getattr(item, name))
+        self.raw.append(item.raw)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, index):
+        """
+         Rebuild the model at index.
+        """
+        item = self.model.__new__(self.model)
+        item.raw = self.raw[index]
+        for name, column in self.columns.items():
+            setattr(item, name, column[index])
+        return item
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def column(self, name):
+        """
+         The values of one field, in item order.
+        """
+        return self.columns[name]
+
+    def where(self, **values):
+        """
+         Select the items whose fields equal the given values, or are in
+            them when a list, set or tuple is given, e.g.
+            store.where(severity='High', status=('New', 'Active')).
+
+         Returns:
+            ColumnStore of the matching items
+        """
+        indexes = range(len(self))
+        for name, value in values.items():
+            column = self.columns[name]
+            if isinstance(value, (list, set, tuple, frozenset)):
+                value = set(value)
+                indexes = [i for i in indexes if column[i] in value]
+            else:
+                indexes = [i for i in indexes if column[i] == value]
+        selected = ColumnStore(self.model)
+        for name, column in self.columns.items():
+            selected.columns[name] = [column[i] for i in indexes]
+        selected.raw = [self.raw[i] for i in indexes]
+        return selected
+
+    def to_dataframe(self):
+        """
+         The decoded fields as a pandas DataFrame, without the raw bytes.
+        """
+        import pandas as pd
+        return pd.DataFrame(self.columns)
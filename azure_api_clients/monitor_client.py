@@ -1,7 +1,9 @@
+from . import instrumentation
+from . import json_backend
 from . import messages
-import requests
 from . import api_auth as aa
 from . import response_check
+from . import transport
 
 
 class MonitorClient:
@@ -18,7 +20,8 @@ class MonitorClient:
                                 (Example: https://login.microsoftonline.com)
 
     '''
-    def __init__(self, sub, rg, api_version):
+    def __init__(self, sub, rg, api_version, session=None,
+                 resource=aa.MANAGEMENT_SCOPE, token_provider=None):
         """
          Initialize the Azure Management REST API.
             Subclasses should override this if they need to customize the
@@ -28,16 +31,31 @@ class MonitorClient:
             sub: The subscription Id to use for the resource
             rg: The resource group name to use for the resource.
             api_version: The API version to use for the
+            session: ( optional ) transport.ClientSession to send requests
+                with. Defaults to the shared pooled session.
+            resource: ( optional ) ARM endpoint, e.g. a mock_server url
+            token_provider: ( optional ) provider of request headers.
+                Defaults to the shared Azure CLI provider.
         """
+        self.session = session or transport.get_session()
         self.sub = sub
         self.rg = rg
-        self.resource = "https://management.azure.com"
-        self.api_base = 'https://management.azure.com/subscriptions/' + \
+        self.resource = resource
+        self.api_base = self.resource + '/subscriptions/' + \
             self.sub + '/resourceGroups/' + self.rg + \
             '/providers/Microsoft.Insights/'
-        self.headers = aa.get_headers()
+        self.token_provider = token_provider or \
+            aa.get_token_provider('cli', aa.MANAGEMENT_SCOPE)
         self.api_version = f'?api-version={api_version}'
 
+    @property
+    def headers(self):
+        """
+         Request headers with a current token from the shared provider.
+        """
+        return self.token_provider.headers()
+
+    @instrumentation.operation
     def get_dcr(self, name):
         """
          Gets Data Collection Rule. Rule is returned or False if error.
@@ -52,14 +70,15 @@ class MonitorClient:
         """
         resource = f'dataCollectionRules/{name}'
         url = self.api_base + resource + self.api_version
-        response = requests.get(url, headers=self.headers, verify=True)
+        response = self.session.get(url, headers=self.headers, verify=True)
         # Return the DCR if successful else False.
         if response_check.response_check(response):
             messages.success(f'Successfully retreived DCR: {name}')
-            return response.json()
+            return json_backend.parse(response)
         else:
             return False
 
+    @instrumentation.operation
     def create_dcr(self, name: str, body: dict) -> dict:
         """
          Create a Data Collection Rule from a predefined body.
@@ -76,15 +95,41 @@ class MonitorClient:
         """
         resource = f'dataCollectionRules/{name}'
         url = self.api_base + resource + self.api_version
-        response = requests.put(url, headers=self.headers, verify=True,
-                                json=body)
+        response = self.session.put(url, headers=self.headers, verify=True,
+                                    json=body)
         # Return the DCR object if successful.
         if response_check.response_check(response):
             messages.success(f'Successfully created DCR: {name}')
-            return response.json()
+            return json_backend.parse(response)
+        else:
+            return False
+
+    @instrumentation.operation
+    def get_table(self, table_name: str, ws_name: str) -> dict:
+        """
+         Gets a table of a log analytics workspace.
+
+         Args:
+            table_name: Name of the table
+            ws_name: Name of workspace
+
+         Returns:
+            ( dict ) Dictionary rep of JSON response or False if error occured
+                during request
+        """
+        resource = f'{ws_name}/tables/{table_name}'
+        api_base = self.resource + '/subscriptions/' + \
+            self.sub + '/resourceGroups/' + self.rg + \
+            '/providers/Microsoft.OperationalInsights/workspaces/'
+        url = api_base + resource + self.api_version
+        response = self.session.get(url, headers=self.headers, verify=True)
+        if response_check.response_check(response):
+            messages.success(f'Successfully retreived table: {table_name}')
+            return json_backend.parse(response)
         else:
             return False
 
+    @instrumentation.operation
     def create_table(self, table_name: str, ws_name: str, body: dict) -> dict:
         """
          Create a table in a log analytics workspace from a predefined body.
@@ -101,18 +146,18 @@ class MonitorClient:
                 OK ( response code == 200 )
         """
         resource = f'{ws_name}/tables/{table_name}'
-        api_base = 'https://management.azure.com/subscriptions/' + \
+        api_base = self.resource + '/subscriptions/' + \
             self.sub + '/resourceGroups/' + self.rg + \
             '/providers/Microsoft.OperationalInsights/workspaces/'
         url = api_base + resource + self.api_version
-        response = requests.put(url, headers=self.headers, verify=True,
-                                json=body)
+        response = self.session.put(url, headers=self.headers, verify=True,
+                                    json=body)
         if response_check.response_check(response):
             if response.status_code == 202:
                 messages.success(f'Creating DCR: {table_name}. Verify in WS')
                 return response
             else:
                 messages.success(f'Successfully created DCR: {table_name}')
-                return response.json()
+                return json_backend.parse(response)
         else:
             return False
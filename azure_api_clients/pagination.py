@@ -0,0 +1,112 @@
+'''
+    Lazily follows nextLink paging on ARM and Graph list endpoints
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import instrumentation
+from . import json_backend
+from . import response_check
+
+
+class PageError(Exception):
+    '''
+    A page of a list endpoint could not be fetched, so the items iterated
+        up to it are not all there is.
+
+    Argments
+    url:string              url of the page that failed
+    status_code:int         HTTP status of the failed request
+    error:object            error detail of the response, see
+                                response_check.error_detail
+    '''
+    def __init__(self, url, status_code, error):
+        super().__init__(f'{status_code} fetching {url}: {error}')
+        self.url = url
+        self.status_code = status_code
+        self.error = error
+
+
+def _fetch(session, url, headers, operation, cache):
+    with instrumentation.named(operation):
+        if cache is None:
+            response = session.get(url, headers=headers())
+        else:
+            response = cache.get(session, url, headers())
+    if response.status_code > 399:
+        raise PageError(url, response.status_code,
+                        response_check.error_detail(response))
+    return json_backend.parse(response)
+
+
+def _next_link(page):
+    return page.get('nextLink') or page.get('@odata.nextLink')
+
+
+def iter_pages(session, url, headers, prefetch=True, cache=None):
+    """
+     Iterate over the pages of a list endpoint, following nextLink until
+        exhausted. While a page is being consumed the next one is already
+        being fetched, so at most two pages are held in memory.
+
+     Args:
+        session: requests Session to send requests with
+        url: url of the first page
+        headers: callable returning the headers for each request, so tokens
+            stay current across long iterations
+        prefetch: fetch the next page in the background
+        cache: ( optional ) http_cache.HttpCache each page is revalidated
+            through
+
+     Returns:
+        generator of page dicts
+
+     Raises:
+        PageError: when a page request fails, so a truncated iteration is
+            never mistaken for the end of the data
+    """
+    # Pages are fetched lazily, outside of the calling client method
+    operation = instrumentation.current_operation()
+    return _iter_pages(session, url, headers, prefetch, operation, cache)
+
+
+def _iter_pages(session, url, headers, prefetch, operation, cache):
+    if not prefetch:
+        while url:
+            page = _fetch(session, url, headers, operation, cache)
+            url = _next_link(page)
+            yield page
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(_fetch, session, url, headers, operation,
+                              cache)
+        while pending is not None:
+            page = pending.result()
+            url = _next_link(page)
+            pending = pool.submit(_fetch, session, url, headers, operation,
+                                  cache) if url else None
+            yield page
+
+
+def iter_values(session, url, headers, prefetch=True, cache=None):
+    """
+     Iterate over the items of a list endpoint across all of its pages.
+
+     Args:
+        session: requests Session to send requests with
+        url: url of the first page
+        headers: callable returning the headers for each request
+        prefetch: fetch the next page in the background
+        cache: ( optional ) http_cache.HttpCache each page is revalidated
+            through
+
+     Returns:
+        generator of item dicts from each page's value list
+
+     Raises:
+        PageError: when a page request fails, see iter_pages
+    """
+    return (item for page in iter_pages(session, url, headers, prefetch,
+                                        cache)
+            for item in page.get('value', []))
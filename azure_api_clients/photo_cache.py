@@ -0,0 +1,208 @@
+'''
+    Size bounded, content-addressed disk cache for Graph user photos
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import json_backend
+
+MAX_BYTES = 64 * 1024 * 1024
+# Seconds a photo is served before its metadata etag is checked again
+MAX_AGE = 3600
+WORKERS = 8
+
+
+class PhotoCache:
+    '''
+    Caches user photos on disk by the sha256 of their content, so users
+        sharing a photo ( e.g. a default avatar ) share one file. A user's
+        photo is served from disk for max_age seconds, after which the
+        photo metadata is fetched and the binary only downloaded again if
+        its @odata.mediaEtag changed. Least recently served files are
+        evicted once the cache grows past max_bytes.
+
+    Argments
+    path:string             directory to keep photos and the index in
+    max_bytes:int           disk budget for photo files
+    max_age:int             seconds served without revalidating
+    '''
+    def __init__(self, path, max_bytes=MAX_BYTES, max_age=MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._index_file = os.path.join(path, 'index.json')
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(self._index_file) as fd:
+                self._users = json.load(fd)
+        except (OSError, ValueError):
+            self._users = {}
+        # digest to [size, last served]
+        self._blobs = {}
+        for name in os.listdir(path):
+            if name.endswith('.photo'):
+                stat = os.stat(os.path.join(path, name))
+                self._blobs[name[:-len('.photo')]] = [stat.st_size,
+                                                      stat.st_mtime]
+        self._users = {user: entry for user, entry in self._users.items()
+                       if entry['digest'] is None or
+                       entry['digest'] in self._blobs}
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, digest + '.photo')
+
+    def _save_index(self):
+        tmp = f'{self._index_file}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump(self._users, fd)
+        os.replace(tmp, self._index_file)
+
+    def _serve(self, entry):
+        """
+         Path of an entry's photo, marking it recently served.
+        """
+        if entry['digest'] is None:
+            return None
+        now = time.time()
+        self._blobs[entry['digest']][1] = now
+        path = self._blob_path(entry['digest'])
+        os.utime(path, (now, now))
+        return path
+
+    def _store(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if digest not in self._blobs:
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as fd:
+                fd.write(content)
+            os.replace(tmp, path)
+            self._blobs[digest] = [len(content), time.time()]
+        return digest
+
+    def _evict(self, keep=None):
+        total = sum(size for size, _ in self._blobs.values())
+        if total <= self.max_bytes:
+            return
+        for digest, (size, _) in sorted(self._blobs.items(),
+                                        key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            del self._blobs[digest]
+            total -= size
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+        self._users = {user: entry for user, entry in self._users.items()
+                       if entry['digest'] is None or
+                       entry['digest'] in self._blobs}
+
+    def _update(self, user, etag, content):
+        with self._lock:
+            digest = None if content is None else self._store(content)
+            entry = {'etag': etag, 'digest': digest, 'checked': time.time()}
+            self._users[user] = entry
+            # The photo being served is never evicted
+            self._evict(keep=digest)
+            self._save_index()
+            return self._serve(entry)
+
+    def get_path(self, client, user):
+        """
+         Get the path of a user's photo file, fetching it when it is not
+            cached or its etag changed.
+
+         Args:
+            client: GraphClient to fetch photos with
+            user: id or userPrincipalName of the user
+
+         Returns:
+            str path of the photo, or None if the user has no photo or it
+                could not be fetched
+        """
+        with self._lock:
+            entry = self._users.get(user)
+            if entry is not None and \
+                    time.time() - entry['checked'] < self.max_age:
+                return self._serve(entry)
+
+        meta = client.get_user_photo_meta(user)
+        if meta.status_code == 404:
+            # No photo, remembered for max_age like any other answer
+            return self._update(user, None, None)
+        if not meta.ok:
+            return None
+        etag = json_backend.parse(meta).get('@odata.mediaEtag')
+
+        with self._lock:
+            entry = self._users.get(user)
+            if entry is not None and etag and entry['etag'] == etag:
+                entry['checked'] = time.time()
+                self._save_index()
+                return self._serve(entry)
+
+        response = client.get_user_photo(user)
+        if not response.ok:
+            return None
+        return self._update(user, etag, response.content)
+
+    def get_paths(self, client, users, workers=WORKERS):
+        """
+         Get the photo paths of many users in parallel, e.g. everyone on an
+            incident.
+
+         Returns:
+            dict of user to path or None
+        """
+        users = list(dict.fromkeys(users))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            paths = pool.map(lambda user: self.get_path(client, user), users)
+            return dict(zip(users, paths))
+
+    def get_bytes(self, client, user):
+        """
+         Get a user's photo as bytes, or None if there is none.
+        """
+        path = self.get_path(client, user)
+        if path is None:
+            return None
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+    def open_mmap(self, client, user):
+        """
+         Get a user's photo as a read-only memory map, so it can be served
+            without copying it into memory. Close it when done.
+
+         Returns:
+            mmap.mmap or None if there is no photo
+        """
+        path = self.get_path(client, user)
+        if path is None:
+            return None
+        with open(path, 'rb') as fd:
+            return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def clear(self):
+        """
+         Remove every cached photo and the index.
+        """
+        with self._lock:
+            for digest in self._blobs:
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+            self._blobs.clear()
+            self._users.clear()
+            self._save_index()
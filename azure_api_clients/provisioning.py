@@ -0,0 +1,289 @@
+'''
+    Provisions custom tables and DCRs from a manifest, in dependency order
+'''
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import instrumentation
+from . import json_backend
+from . import messages
+from . import response_check
+
+WORKERS = 8
+# Seconds between polls of a table creation, doubled up to MAX_INTERVAL
+POLL_INTERVAL = 2
+MAX_INTERVAL = 30
+# Seconds a table creation may take before it is reported failed
+TIMEOUT = 900
+DONE_STATUSES = ('succeeded', 'failed', 'canceled')
+
+
+def _contains(existing, desired):
+    """
+     Whether an existing resource already has everything the manifest asks
+        for. Keys ARM adds on its own ( provisioningState, ids, ... ) are
+        ignored.
+    """
+    if isinstance(desired, dict):
+        return isinstance(existing, dict) and all(
+            key in existing and _contains(existing[key], value)
+            for key, value in desired.items())
+    if isinstance(desired, list):
+        return isinstance(existing, list) and \
+            len(existing) == len(desired) and \
+            all(_contains(e, d) for e, d in zip(existing, desired))
+    if isinstance(desired, str) and isinstance(existing, str):
+        return desired.lower() == existing.lower()
+    return existing == desired
+
+
+def _streams(body):
+    """
+     Tables a DCR body streams into, from its Custom-<table> output streams.
+    """
+    streams = set()
+    for flow in body.get('properties', {}).get('dataFlows', []):
+        stream = flow.get('outputStream') or ''
+        if stream.startswith('Custom-'):
+            streams.add(stream[len('Custom-'):])
+    return streams
+
+
+def _workspaces(body):
+    """
+     Names of the workspaces a DCR body sends to, from its logAnalytics
+        destinations, lowercased.
+    """
+    destinations = body.get('properties', {}).get('destinations', {})
+    return {d['workspaceResourceId'].rstrip('/').rsplit('/', 1)[-1].lower()
+            for d in destinations.get('logAnalytics', [])
+            if d.get('workspaceResourceId')}
+
+
+def plan(manifest):
+    """
+     Resolve the items of a manifest and their dependencies.
+
+     Args:
+        manifest: dict with 'tables', a list of {'name', 'workspace',
+            'body'}, and 'dcrs', a list of {'name', 'body'} with an optional
+            'depends_on' list of item names. A DCR depends on the tables its
+            Custom-<table> output streams write to, in the workspaces of its
+            logAnalytics destinations ( in every workspace when it names
+            none ).
+
+     Returns:
+        dict of item key to item, keys being ('table', workspace, name) or
+            ('dcr', None, name) and items carrying their 'requires' keys
+    """
+    items = {}
+    entries = [(('table', table['workspace'].lower(), table['name']),
+                {**table, 'kind': 'table'})
+               for table in manifest.get('tables', [])]
+    entries += [(('dcr', None, dcr['name']), {**dcr, 'kind': 'dcr'})
+                for dcr in manifest.get('dcrs', [])]
+    for key, item in entries:
+        if key in items:
+            raise ValueError(f'Duplicate {key[0]} {key[2]}' +
+                             (f' in {key[1]}' if key[1] else ''))
+        items[key] = item
+
+    for key, item in items.items():
+        requires = set()
+        for name in item.get('depends_on', []):
+            found = [k for k in items if k[2] == name and k != key]
+            if not found:
+                raise ValueError(f'{key[2]} depends on unknown {name}')
+            requires.update(found)
+        if item['kind'] == 'dcr':
+            streams = _streams(item['body'])
+            workspaces = _workspaces(item['body'])
+            requires.update(k for k in items
+                            if k[0] == 'table' and k[2] in streams and
+                            (not workspaces or k[1] in workspaces))
+        item['requires'] = requires
+
+    # Fail on cycles before anything is created
+    done = set()
+    remaining = dict(items)
+    while remaining:
+        ready = [k for k, item in remaining.items()
+                 if item['requires'] <= done]
+        if not ready:
+            raise ValueError('Dependency cycle between ' +
+                             ', '.join(k[2] for k in remaining))
+        for key in ready:
+            done.add(key)
+            del remaining[key]
+    return items
+
+
+def _report(item, status, started, error=None):
+    return {'kind': item['kind'],
+            'name': item['name'],
+            'workspace': item.get('workspace'),
+            'status': status,
+            'ok': status in ('created', 'unchanged'),
+            'seconds': time.perf_counter() - started,
+            'error': error}
+
+
+@instrumentation.operation
+def wait_operation(client, url, poll_interval=POLL_INTERVAL,
+                   timeout=TIMEOUT):
+    """
+     Poll an Azure-AsyncOperation url until it finishes.
+
+     Returns:
+        str: final status, 'Succeeded', 'Failed', 'Canceled' or 'Timeout'
+    """
+    deadline = time.monotonic() + timeout
+    interval = poll_interval
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        response = client.session.get(url, headers=client.headers)
+        if response.status_code == 429:
+            interval = response_check.retry_after(response.headers,
+                                                  default=interval)
+            continue
+        if response.status_code > 399:
+            return 'Failed'
+        status = (json_backend.parse_or_none(response) or {}) \
+            .get('status', '')
+        if status.lower() in DONE_STATUSES:
+            return status
+        interval = min(interval * 2, MAX_INTERVAL)
+    return 'Timeout'
+
+
+class Provisioner:
+    '''
+    Creates the tables and DCRs of a manifest, running items whose
+        dependencies are done in parallel. Items that already match the
+        manifest are skipped, table creations are polled to completion
+        before the DCRs streaming into them start, and the dependents of a
+        failed item are skipped.
+
+    Argments
+    client:MonitorClient        client for the DCRs
+    table_client:MonitorClient  (optional) client for the tables, when they
+                                    need another api version than the DCRs
+    workers:int                 max items provisioned at once
+    force:bool                  put every item even when unchanged
+    poll_interval:float         seconds before a table creation is first
+                                    polled
+    timeout:float               seconds a table creation may take
+    '''
+    def __init__(self, client, table_client=None, workers=WORKERS,
+                 force=False, poll_interval=POLL_INTERVAL, timeout=TIMEOUT):
+        self.client = client
+        self.table_client = table_client or client
+        self.workers = workers
+        self.force = force
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def _table(self, item):
+        client = self.table_client
+        if not self.force:
+            existing = client.get_table(item['name'], item['workspace'])
+            if existing and _contains(existing, item['body']):
+                return 'unchanged', None
+        response = client.create_table(item['name'], item['workspace'],
+                                       item['body'])
+        if response is False:
+            return 'failed', 'Table creation was rejected'
+        if isinstance(response, dict):
+            return 'created', None
+        operation = response.headers.get('Azure-AsyncOperation')
+        if not operation:
+            return 'created', None
+        status = wait_operation(client, operation, self.poll_interval,
+                                self.timeout)
+        if status.lower() != 'succeeded':
+            return 'failed', f'Table creation {status}'
+        return 'created', None
+
+    def _dcr(self, item):
+        client = self.client
+        if not self.force:
+            existing = client.get_dcr(item['name'])
+            if existing and _contains(existing, item['body']):
+                return 'unchanged', None
+        if client.create_dcr(item['name'], item['body']) is False:
+            return 'failed', 'DCR creation was rejected'
+        return 'created', None
+
+    @instrumentation.operation
+    def provision(self, item):
+        """
+         Provision one planned item.
+
+         Returns:
+            dict report with kind, name, workspace ( None for DCRs ),
+                status ( 'created', 'unchanged' or 'failed' ), ok, seconds
+                and error
+        """
+        started = time.perf_counter()
+        try:
+            if item['kind'] == 'table':
+                status, error = self._table(item)
+            else:
+                status, error = self._dcr(item)
+        except Exception as err:
+            status, error = 'failed', str(err)
+        return _report(item, status, started, error)
+
+    @instrumentation.operation
+    def run(self, manifest):
+        """
+         Provision a manifest, see plan for its format.
+
+         Returns:
+            list of reports in manifest order, tables first. Items whose
+                dependencies failed are reported with status 'skipped'.
+        """
+        items = plan(manifest)
+        reports = {}
+        pending = {}
+        waiting = dict(items)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while waiting or pending:
+                for key, item in list(waiting.items()):
+                    failed = [k for k in item['requires']
+                              if k in reports and not reports[k]['ok']]
+                    if failed:
+                        reports[key] = _report(
+                            item, 'skipped', time.perf_counter(),
+                            f'{failed[0][2]} failed')
+                        del waiting[key]
+                    elif all(k in reports for k in item['requires']):
+                        pending[pool.submit(self.provision, item)] = key
+                        del waiting[key]
+                if not pending:
+                    continue
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    reports[pending.pop(future)] = future.result()
+
+        failed = [r for r in reports.values() if not r['ok']]
+        if failed:
+            messages.warn(f'{len(failed)} of {len(reports)} items were not '
+                          'provisioned')
+        else:
+            messages.success(f'Provisioned {len(reports)} items')
+        return [reports[key] for key in items]
+
+
+def provision(client, manifest, table_client=None, workers=WORKERS,
+              force=False, poll_interval=POLL_INTERVAL, timeout=TIMEOUT):
+    """
+     Provision the tables and DCRs of a manifest, see Provisioner.run.
+
+     Returns:
+        list of reports in manifest order
+    """
+    provisioner = Provisioner(client, table_client, workers, force,
+                              poll_interval, timeout)
+    return provisioner.run(manifest)
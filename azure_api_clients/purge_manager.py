@@ -0,0 +1,237 @@
+'''
+    Submits many Log Analytics purges and tracks their operations to the end
+'''
+
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import instrumentation
+from . import json_backend
+from . import messages
+from . import response_check
+
+WORKERS = 8
+MAX_ATTEMPTS = 6
+# Seconds before the first poll of an operation, doubled after every poll
+# that finds it still pending up to MAX_INTERVAL
+POLL_INTERVAL = 30
+MAX_INTERVAL = 600
+BACKOFF = 2
+
+
+def _job(client, body):
+    return {'workspace': client.ws,
+            'table': body.get('table'),
+            'status': 'new',
+            'ok': False,
+            'operation_id': None,
+            'location': None,
+            'attempts': 0,
+            'polls': 0,
+            'error': None,
+            'submitted_at': None,
+            'finished_at': None}
+
+
+def _finish(job, status, error=None):
+    job['status'] = status
+    job['ok'] = status == 'completed'
+    job['error'] = error
+    job['finished_at'] = time.time()
+    return job
+
+
+@instrumentation.operation
+def submit_purge(client, body, max_attempts=MAX_ATTEMPTS):
+    """
+     Submit one purge, retrying throttled submissions after Retry-After.
+
+     Args:
+        client: SentinelClient of the workspace to purge
+        body: purge body, e.g. {'table': 'Heartbeat', 'filters': [...]}
+        max_attempts: max throttled submissions before giving up
+
+     Returns:
+        dict job report with status 'pending' and the operation location,
+            or 'failed' with the error
+    """
+    job = _job(client, body)
+    while job['attempts'] < max_attempts:
+        job['attempts'] += 1
+        response = client.purge_data(body)
+        if response.status_code == 429:
+            time.sleep(response_check.retry_after(response.headers,
+                                                  job['attempts']))
+            continue
+        if response.status_code > 399:
+            return _finish(job, 'failed',
+                           response_check.error_detail(response))
+        location = response.headers.get('x-ms-status-location')
+        if not location:
+            return _finish(job, 'failed',
+                           'No x-ms-status-location in purge response')
+        result = json_backend.parse_or_none(response) or {}
+        job['operation_id'] = result.get('operationId') or \
+            location.split('?')[0].rsplit('/', 1)[-1]
+        job['location'] = location
+        job['status'] = 'pending'
+        job['submitted_at'] = time.time()
+        return job
+    return _finish(job, 'failed', 'Throttled on every submission')
+
+
+@instrumentation.operation
+def poll_purge(client, job):
+    """
+     Poll a submitted purge once and update its report.
+
+     Returns:
+        None when the job finished, else seconds the service asked to wait
+            before the next poll ( Retry-After ), 0 when it did not ask
+    """
+    job['polls'] += 1
+    response = client.session.get(job['location'], headers=client.headers)
+    if response.status_code == 429:
+        return response_check.retry_after(response.headers, job['polls'])
+    if response.status_code > 399:
+        _finish(job, 'failed', response_check.error_detail(response))
+        return None
+    status = (json_backend.parse_or_none(response) or {}).get('status', '')
+    if status.lower() == 'completed':
+        _finish(job, 'completed')
+        return None
+    if status.lower() in ('failed', 'canceled', 'cancelled'):
+        _finish(job, 'failed', status)
+        return None
+    return 0
+
+
+class PurgeManager:
+    '''
+    Runs many purges across tables and workspaces. Purges are submitted in
+        parallel, then every outstanding operation is polled from a single
+        scheduler loop, each with its own exponential backoff, until all of
+        them complete, fail or time out.
+
+    Argments
+    workers:int             max submissions in flight
+    poll_interval:float     seconds before an operation is first polled
+    max_interval:float      cap on the seconds between polls of one job
+    timeout:float           (optional) seconds after submission a job is
+                                given up on with status 'timeout'
+    on_update:callable      (optional) called with each job report when it
+                                is submitted or finishes
+    '''
+    def __init__(self, workers=WORKERS, poll_interval=POLL_INTERVAL,
+                 max_interval=MAX_INTERVAL, timeout=None, on_update=None):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.on_update = on_update
+
+    def _update(self, job):
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def submit(self, jobs):
+        """
+         Submit purges in parallel.
+
+         Args:
+            jobs: iterable of (client, body) pairs
+
+         Returns:
+            list of (client, job report) pairs in the same order as jobs
+        """
+        jobs = list(jobs)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(submit_purge, client, body)
+                       for client, body in jobs]
+            submitted = []
+            for (client, _), future in zip(jobs, futures):
+                job = future.result()
+                self._update(job)
+                submitted.append((client, job))
+        return submitted
+
+    def wait(self, submitted):
+        """
+         Poll the pending jobs of submit until none are left.
+
+         Args:
+            submitted: list of (client, job report) pairs from submit
+        """
+        now = time.monotonic()
+        intervals = {}
+        schedule = []
+        for i, (_, job) in enumerate(submitted):
+            if job['status'] == 'pending':
+                intervals[i] = self.poll_interval
+                heapq.heappush(schedule, (now + self.poll_interval, i))
+
+        while schedule:
+            due, i = heapq.heappop(schedule)
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            client, job = submitted[i]
+            try:
+                retry_after = poll_purge(client, job)
+            except Exception as err:
+                # A connection error only costs this poll
+                messages.error(f'Polling purge {job["operation_id"]} '
+                               f'failed: {err}')
+                retry_after = 0
+            if retry_after is None:
+                self._update(job)
+                continue
+            if self.timeout is not None and \
+                    time.time() - job['submitted_at'] > self.timeout:
+                _finish(job, 'timeout')
+                self._update(job)
+                continue
+            intervals[i] = min(intervals[i] * BACKOFF, self.max_interval)
+            heapq.heappush(schedule, (time.monotonic() +
+                                      max(intervals[i], retry_after), i))
+
+    @instrumentation.operation
+    def run(self, jobs):
+        """
+         Submit purges and wait for all of them to finish.
+
+         Args:
+            jobs: iterable of (client, body) pairs, client being the
+                SentinelClient of the workspace to purge
+
+         Returns:
+            list of dict job reports ( workspace, table, status, ok,
+                operation_id, location, attempts, polls, error,
+                submitted_at, finished_at ) in the same order as jobs.
+                status is 'completed', 'failed' or 'timeout'.
+        """
+        submitted = self.submit(jobs)
+        self.wait(submitted)
+        reports = [job for _, job in submitted]
+        failed = sum(not job['ok'] for job in reports)
+        if failed:
+            messages.warn(f'{failed} of {len(reports)} purges did not '
+                          'complete')
+        else:
+            messages.success(f'All {len(reports)} purges completed')
+        return reports
+
+
+def purge_many(jobs, workers=WORKERS, poll_interval=POLL_INTERVAL,
+               max_interval=MAX_INTERVAL, timeout=None, on_update=None):
+    """
+     Submit purges across tables and workspaces and wait for them, see
+        PurgeManager.run.
+
+     Returns:
+        list of job reports in the same order as jobs
+    """
+    manager = PurgeManager(workers, poll_interval, max_interval, timeout,
+                           on_update)
+    return manager.run(jobs)
@@ -0,0 +1,301 @@
+'''
+    TTL and size bounded result cache for Log Analytics queries
+'''
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+TTL = 300
+MAX_BYTES = 256 * 1024 * 1024
+# Marks values JSON has no type for in the files of the disk backend
+TYPE_KEY = '__type__'
+
+
+def _normalize_timespan(timespan):
+    """
+     Resolve a timespan into a stable, hashable form. Relative timespans
+        stay relative so repeated "last N days" queries share an entry for
+        as long as the TTL allows.
+    """
+    if timespan is None:
+        return None
+    if isinstance(timespan, timedelta):
+        return ('last', timespan.total_seconds())
+    start, end = timespan
+    if isinstance(end, timedelta):
+        end = start + end
+    return (start.isoformat(), end.isoformat())
+
+
+def make_key(ws_id, query, timespan, mode='json'):
+    """
+     Build the cache key for a query.
+
+     Args:
+        ws_id: id of the workspace queried
+        query: KQL text. Whitespace is collapsed so formatting differences
+            share an entry.
+        timespan: timespan as passed to execute_query
+        mode: result mode, results of different modes are cached apart
+
+     Returns:
+        str: hex digest identifying the query
+    """
+    normalized = (ws_id.lower(), ' '.join(query.split()),
+                  _normalize_timespan(timespan), mode)
+    return hashlib.sha256(repr(normalized).encode()).hexdigest()
+
+
+def _cache_file(name):
+    """
+     The extension of a file named after a make_key digest, else None.
+    """
+    key, dot, extension = name.partition('.')
+    if len(key) != 64 or not dot or extension not in ('json', 'pkl') or \
+            any(c not in '0123456789abcdef' for c in key):
+        return None
+    return '.' + extension
+
+
+def _encode(value):
+    """
+     Turn a query result into plain JSON types, tagging the ones JSON lacks
+        so _decode can restore them. Raises TypeError for anything else,
+        e.g. DataFrames, which are then only cached in memory.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, tuple):
+        return {TYPE_KEY: 'tuple', 'value': [_encode(item) for item in value]}
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value) and TYPE_KEY not in value:
+            return {k: _encode(v) for k, v in value.items()}
+        return {TYPE_KEY: 'dict',
+                'value': [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if isinstance(value, datetime):
+        return {TYPE_KEY: 'datetime', 'value': value.isoformat()}
+    if isinstance(value, date):
+        return {TYPE_KEY: 'date', 'value': value.isoformat()}
+    if isinstance(value, timedelta):
+        return {TYPE_KEY: 'timedelta', 'value': value.total_seconds()}
+    raise TypeError(f'{type(value).__name__} is not cached on disk')
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    kind = value.get(TYPE_KEY)
+    if kind is None:
+        return {k: _decode(v) for k, v in value.items()}
+    if kind == 'tuple':
+        return tuple(_decode(item) for item in value['value'])
+    if kind == 'dict':
+        return {_decode(k): _decode(v) for k, v in value['value']}
+    if kind == 'datetime':
+        return datetime.fromisoformat(value['value'])
+    if kind == 'date':
+        return date.fromisoformat(value['value'])
+    if kind == 'timedelta':
+        return timedelta(seconds=value['value'])
+    raise ValueError(f'Unknown cached type: {kind}')
+
+
+class QueryCache:
+    '''
+    An in-process LRU cache of query results with a TTL and a size budget,
+        optionally backed by a directory so results survive restarts.
+        Values are stored pickled in memory, so every hit returns a private
+        copy. On disk they are stored as JSON, so a shared directory never
+        has code loaded from it; results JSON cannot represent, such as
+        DataFrames and Arrow tables, stay in memory only. The size of the
+        directory is tracked as files are written, and only a write that
+        takes it past max_bytes sweeps it of expired files and of the files
+        closest to expiry. Other expired files are removed when read.
+
+    Argments
+    ttl:int             seconds a result stays valid
+    max_bytes:int       budget in memory and on disk, each. Least recently
+                            used entries are evicted first in memory, the
+                            oldest files on disk.
+    path:string         (optional) directory for the on-disk backend
+    '''
+    def __init__(self, ttl=TTL, max_bytes=MAX_BYTES, path=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.path = path
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk_size = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self.sweep()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def _remember(self, key, expires, blob):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(blob) > self.max_bytes:
+                return
+            self._entries[key] = (expires, blob)
+            self.size += len(blob)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _load(self, key):
+        try:
+            with open(self._file(key), 'rb') as fd:
+                entry = json.load(fd)
+            expires = entry['expires']
+            value = _decode(entry['value'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if expires < time.time():
+            self._discard(key)
+            return None
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, expires, blob)
+        return blob
+
+    def _discard(self, key):
+        path = self._file(key)
+        try:
+            size = os.stat(path).st_size
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.disk_size = max(0, self.disk_size - size)
+
+    def get(self, key):
+        """
+         Get a cached result.
+
+         Args:
+            key: key from make_key
+
+         Returns:
+            the cached result or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, blob = entry
+                if expires >= time.time():
+                    self._entries.move_to_end(key)
+                else:
+                    del self._entries[key]
+                    self.size -= len(blob)
+                    blob = None
+            else:
+                blob = None
+        if blob is None and self.path:
+            blob = self._load(key)
+        if blob is None:
+            return None
+        return pickle.loads(blob)
+
+    def set(self, key, value):
+        """
+         Cache a result for ttl seconds.
+
+         Args:
+            key: key from make_key
+            value: picklable query result
+        """
+        expires = time.time() + self.ttl
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, expires, blob)
+        if self.path:
+            try:
+                data = json.dumps({'expires': expires,
+                                   'value': _encode(value)}).encode()
+            except TypeError:
+                return
+            if len(data) > self.max_bytes:
+                return
+            path = self._file(key)
+            try:
+                replaced = os.stat(path).st_size
+            except OSError:
+                replaced = 0
+            tmp = path + f'.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as fd:
+                fd.write(data)
+            # The file's mtime is its expiry, so sweeps need no reads
+            os.utime(tmp, (expires, expires))
+            os.replace(tmp, path)
+            with self._lock:
+                self.disk_size += len(data) - replaced
+                full = self.disk_size > self.max_bytes
+            if full:
+                self.sweep()
+
+    def sweep(self):
+        """
+         Remove expired files from the disk backend, then the files closest
+            to expiry until the rest fit max_bytes. Cache files of other
+            formats, e.g. pickles of older versions, are removed without
+            being read, and files the cache did not name are left alone.
+        """
+        if not self.path:
+            return
+        now = time.time()
+        files = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                kind = _cache_file(entry.name)
+                if kind is None or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if kind != '.json' or stat.st_mtime < now:
+                    self._remove(entry.path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_bytes:
+                break
+            self._remove(path)
+            size -= file_size
+        with self._lock:
+            self.disk_size = size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+         Drop every cached result, in memory and on disk.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        if self.path:
+            for name in os.listdir(self.path):
+                if _cache_file(name) is not None:
+                    self._remove(os.path.join(self.path, name))
+            with self._lock:
+                self.disk_size = 0
@@ -0,0 +1,226 @@
+'''
+    Paces requests against ARM and Graph throttling budgets
+'''
+
+import base64
+import functools
+import json
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from . import response_check
+
+# ARM reports the budget left in the subscription's bucket on every response
+REMAINING_HEADERS = {'reads': 'x-ms-ratelimit-remaining-subscription-reads',
+                     'writes': 'x-ms-ratelimit-remaining-subscription-writes'}
+# Graph sends this (0.8 - 1.8) once a tenant gets close to its limit
+GRAPH_THROTTLE_HEADER = 'x-ms-throttle-limit-percentage'
+# Requests per second the buckets refill at, used to pace once low
+REFILL_RATES = {'reads': 25.0, 'writes': 10.0}
+# Remaining budget below which requests are paced to the refill rate
+RESERVE = 20
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_SUBSCRIPTION = re.compile(r'/subscriptions/([^/]+)', re.IGNORECASE)
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=64)
+def _token_tenant(token):
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(
+            payload + '=' * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+    return claims.get('tid') if isinstance(claims, dict) else None
+
+
+def tenant_of(headers):
+    """
+     Get the tenant a request is sent as, from the tid claim of its bearer
+        token. The token is only decoded, not verified.
+
+     Args:
+        headers: request headers, may be None
+
+     Returns:
+        str tenant id, or None if there is no token or it is not a JWT
+    """
+    for name, value in (headers or {}).items():
+        if name.lower() == 'authorization':
+            scheme, _, token = value.partition(' ')
+            if scheme.lower() == 'bearer' and token:
+                return _token_tenant(token)
+    return None
+
+
+class _Budget:
+    __slots__ = ('remaining', 'reported', 'blocked_until', 'next_slot',
+                 'throttled', 'updated')
+
+    def __init__(self):
+        self.remaining = None
+        # Whether remaining came from the service's count, rather than
+        # from a Graph hint or a 429
+        self.reported = False
+        self.blocked_until = 0.0
+        self.next_slot = 0.0
+        self.throttled = 0
+        self.updated = None
+
+
+class RateGovernor:
+    '''
+    Tracks the throttling budget of every subscription (ARM) and every
+        tenant of a host (Graph, Log Analytics) requests go to, split into
+        reads and writes.
+        While the budget is healthy requests go straight through. Once it
+        drops under the reserve they are spaced out at the bucket's refill
+        rate, and after a 429 every request to that budget waits out
+        Retry-After instead of piling on. Budgets without a reported count
+        ( Graph ) are paced only until a response comes back without the
+        throttle hint.
+
+    Argments
+    reserve:int             remaining budget to start pacing at
+    refill_rates:dict       requests per second for 'reads' and 'writes'
+    '''
+    def __init__(self, reserve=RESERVE, refill_rates=None):
+        self.reserve = reserve
+        self.refill_rates = {**REFILL_RATES, **(refill_rates or {})}
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def key_for(self, method, url, tenant=None):
+        """
+         Get the budget a request counts against.
+
+         Args:
+            method: HTTP method of the request
+            url: url of the request
+            tenant: ( optional ) tenant the request is sent as, see
+                tenant_of
+
+         Returns:
+            tuple of ( scope, 'reads' or 'writes' ) where scope is
+                'subscription/<id>' for ARM, '<host>/<tenant>' otherwise and
+                just the host when the tenant is not known
+        """
+        kind = 'reads' if method.upper() in READ_METHODS else 'writes'
+        parts = urlsplit(url)
+        match = _SUBSCRIPTION.search(parts.path)
+        if match:
+            return 'subscription/' + match.group(1).lower(), kind
+        if tenant:
+            return f'{parts.hostname}/{tenant.lower()}', kind
+        return parts.hostname, kind
+
+    def _budget(self, key):
+        budget = self._budgets.get(key)
+        if budget is None:
+            budget = self._budgets[key] = _Budget()
+        return budget
+
+    def reserve_slot(self, method, url, tenant=None):
+        """
+         Claim a slot for a request without sleeping, for callers that wait
+            themselves ( e.g. with asyncio.sleep ).
+
+         Returns:
+            float: seconds to wait before sending the request
+        """
+        key = self.key_for(method, url, tenant)
+        with self._lock:
+            budget = self._budget(key)
+            now = time.monotonic()
+            start = max(now, budget.blocked_until)
+            if budget.remaining is not None:
+                if budget.remaining <= self.reserve:
+                    start = max(start, budget.next_slot)
+                    budget.next_slot = start + 1 / self.refill_rates[key[1]]
+                budget.remaining = max(0, budget.remaining - 1)
+        return start - now
+
+    def acquire(self, method, url, tenant=None):
+        """
+         Wait until a request may be sent without running into throttling.
+
+         Returns:
+            float: seconds waited
+        """
+        wait = self.reserve_slot(method, url, tenant)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def observe(self, method, url, status, headers, tenant=None):
+        """
+         Update the budget from a response's status and headers.
+
+         Args:
+            method: HTTP method of the request
+            url: url of the request
+            status: HTTP status code of the response
+            headers: response headers ( case insensitive mapping )
+            tenant: ( optional ) tenant the request was sent as
+        """
+        key = self.key_for(method, url, tenant)
+        with self._lock:
+            budget = self._budget(key)
+            now = time.monotonic()
+            budget.updated = time.time()
+            remaining = headers.get(REMAINING_HEADERS[key[1]])
+            if remaining is not None:
+                budget.remaining = max(0, int(remaining))
+                budget.reported = True
+            elif headers.get(GRAPH_THROTTLE_HEADER) is not None:
+                budget.remaining = self.reserve
+                budget.reported = False
+            elif status != 429 and not budget.reported:
+                # No longer close to the limit
+                budget.remaining = None
+            if status == 429:
+                budget.throttled += 1
+                retry_after = response_check.retry_after(headers,
+                                                         default=1.0)
+                budget.blocked_until = max(budget.blocked_until,
+                                           now + retry_after)
+                budget.remaining = 0
+
+    def budget(self):
+        """
+         Snapshot of every tracked budget for monitoring.
+
+         Returns:
+            dict of 'scope/kind' to dict with remaining ( None until the
+                service reported it ), blocked_for seconds, throttled count
+                and updated epoch time
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {f'{scope}/{kind}': {
+                        'remaining': budget.remaining,
+                        'blocked_for': max(0.0, budget.blocked_until - now),
+                        'throttled': budget.throttled,
+                        'updated': budget.updated}
+                    for (scope, kind), budget in self._budgets.items()}
+
+
+def get_governor():
+    """
+     Get the process wide RateGovernor, creating it on first use.
+
+     Returns:
+        RateGovernor shared by all clients
+    """
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = RateGovernor()
+    return _governor
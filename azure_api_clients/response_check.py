@@ -2,20 +2,78 @@
     Checks requests for error code
 '''
 
+import time
+from email.utils import parsedate_to_datetime
+
+from . import json_backend
 from . import messages
 
+# Characters of a non-JSON error body that are printed
+MAX_ERROR_TEXT = 500
+# Cap in seconds on the backoff used when no Retry-After was sent
+MAX_BACKOFF = 60
+
+
+def retry_after(headers, attempt=None, default=0.0):
+    """
+     Seconds a throttled response asked to wait, from its Retry-After header
+        given either in seconds or as an HTTP-date.
+
+     Args:
+        headers: response headers, e.g. response.headers or the headers of
+            a Graph $batch sub-response
+        attempt: ( optional ) number of the attempt that was throttled,
+            used for exponential backoff when no Retry-After was sent
+        default: seconds when there is neither Retry-After nor attempt
+
+     Returns:
+        float: seconds to wait, never negative
+    """
+    value = headers.get('Retry-After')
+    if value is None:
+        # Graph $batch sub-response headers are a plain dict
+        value = next((v for k, v in headers.items()
+                      if k.lower() == 'retry-after'), None)
+    if value is not None:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() -
+                       time.time())
+        except (TypeError, ValueError):
+            pass
+    if attempt is not None:
+        return min(2 ** attempt, MAX_BACKOFF)
+    return default
+
+
+def error_detail(response):
+    """
+     The error of a failed response: the 'error' member of a JSON body, the
+        whole JSON body when it has none, or the start of a non-JSON body.
+    """
+    body = json_backend.parse_or_none(response)
+    if body is None:
+        return response.text[:MAX_ERROR_TEXT]
+    if isinstance(body, dict) and 'error' in body:
+        return body['error']
+    return body
+
 
 def response_check(response):
     """
-     Check HTTP response for errors.
+     Check HTTP response for errors. The body of a failed response is
+        parsed through json_backend.parse, so the caller can read it again
+        without a second parse.
 
      Args:
         response: response from requests package
     """
     if response.status_code > 399:
         messages.error(f'{response.status_code}')
-        r = response.json()
-        messages.error(f'{r["error"]}')
+        messages.error(f'{error_detail(response)}')
         return False
     else:
         return True
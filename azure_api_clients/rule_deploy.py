@@ -0,0 +1,255 @@
+'''
+    Deploys analytics rules incrementally by diffing content hashes
+'''
+
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import instrumentation
+from . import messages
+from . import response_check
+
+WORKERS = 8
+MAX_ATTEMPTS = 6
+# Set by the service, never part of a rule's content
+SERVER_PROPERTIES = ('lastModifiedUtc', 'createdTimeUtc', 'etag',
+                     'provisioningState')
+# Rule properties the service fills in when a rule leaves them out, so
+# they only count as changes when the desired rule sets them
+SERVICE_DEFAULTS = ('incidentConfiguration', 'eventGroupingSettings',
+                    'suppressionDuration', 'suppressionEnabled', 'tactics',
+                    'techniques', 'subTechniques', 'alertRuleTemplateName',
+                    'templateVersion')
+# Template properties that do not carry over to a rule
+TEMPLATE_ONLY = ('requiredDataConnectors', 'status', 'createdDateUTC',
+                 'lastUpdatedDateUTC', 'alertRulesCreatedByTemplateCount')
+
+
+def normalize(rule):
+    """
+     The deployable content of a rule: its kind and properties, without
+        server set and null properties, with line endings and surrounding
+        whitespace of the query made uniform.
+    """
+    properties = {key: value
+                  for key, value in rule.get('properties', {}).items()
+                  if key not in SERVER_PROPERTIES and value is not None}
+    if isinstance(properties.get('query'), str):
+        properties['query'] = '\n'.join(
+            line.rstrip() for line in
+            properties['query'].replace('\r\n', '\n').strip().split('\n'))
+    return {'kind': rule.get('kind'), 'properties': properties}
+
+
+def content_hash(rule):
+    """
+     sha256 of a rule's normalized content, independent of key order.
+    """
+    content = json.dumps(normalize(rule), sort_keys=True,
+                         separators=(',', ':'))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _project(current, desired):
+    """
+     The part of a current value the desired value specifies, so defaults
+        the service fills in do not count as changes.
+    """
+    if isinstance(desired, dict) and isinstance(current, dict):
+        return {key: _project(current.get(key), value)
+                for key, value in desired.items()}
+    return current
+
+
+def _comparable(current, desired):
+    """
+     A current rule as it compares to a desired one: all of its content
+        except the SERVICE_DEFAULTS the desired rule leaves out, and the
+        defaults nested in the ones it sets.
+    """
+    wanted = desired.get('properties', {})
+    properties = {}
+    for key, value in current.get('properties', {}).items():
+        if key in SERVICE_DEFAULTS:
+            if key not in wanted:
+                continue
+            value = _project(value, wanted[key])
+        properties[key] = value
+    return {'kind': current.get('kind'), 'properties': properties}
+
+
+def from_template(template, overrides=None):
+    """
+     Build a rule from an alert rule template, e.g. an item of
+        SentinelClient.iter_alert_ruleTemplates.
+
+     Args:
+        template: the template dict
+        overrides: ( optional ) rule properties to set on top
+
+     Returns:
+        rule dict with kind and properties
+    """
+    properties = {key: value
+                  for key, value in template.get('properties', {}).items()
+                  if key not in TEMPLATE_ONLY}
+    properties['alertRuleTemplateName'] = template['name']
+    if 'version' in properties:
+        properties['templateVersion'] = properties.pop('version')
+    properties.setdefault('enabled', True)
+    properties.update(overrides or {})
+    return {'kind': template.get('kind'), 'properties': properties}
+
+
+def _resolve(client, desired):
+    """
+     Turn the desired rules into a dict of rule name to rule, building the
+        ones given as {'template': name} from the template catalog, which is
+        fetched once.
+    """
+    if isinstance(desired, dict):
+        desired = [{**rule, 'name': name} for name, rule in desired.items()]
+    rules = {}
+    templates = None
+    for rule in desired:
+        if 'template' in rule:
+            if templates is None:
+                templates = {t['name']: t
+                             for t in client.iter_alert_ruleTemplates()}
+            template = templates.get(rule['template'])
+            if template is None:
+                raise ValueError(f'Unknown template {rule["template"]} for '
+                                 f'rule {rule["name"]}')
+            built = from_template(template, rule.get('properties'))
+            if rule.get('kind'):
+                built['kind'] = rule['kind']
+            rules[rule['name']] = built
+        else:
+            rules[rule['name']] = {'kind': rule.get('kind'),
+                                   'properties': rule.get('properties', {})}
+    return rules
+
+
+def plan(client, desired, prune=False, managed=None):
+    """
+     Compare desired rules with the rules of a workspace, fetched once.
+        A page of rules or templates that fails to load raises
+        pagination.PageError rather than planning from a partial list.
+
+     Args:
+        client: SentinelClient of the workspace
+        desired: list of rules with a name, or dict of name to rule. A rule
+            is {'kind', 'properties'}, or {'template': template name,
+            'properties': overrides} to build it from the template catalog.
+        prune: delete rules that are not desired
+        managed: ( optional ) predicate on a current rule, limiting prune
+            to the rules it returns True for
+
+     Returns:
+        list of dicts with name, action ( 'create', 'update', 'delete' or
+            'unchanged' ), body and the etag of the current rule
+    """
+    rules = _resolve(client, desired)
+    current = {rule['name']: rule for rule in client.iter_alertrules()}
+    actions = []
+    for name, rule in rules.items():
+        existing = current.get(name)
+        if existing is None:
+            action = 'create'
+        elif content_hash(_comparable(existing, rule)) == \
+                content_hash(rule):
+            action = 'unchanged'
+        else:
+            action = 'update'
+        etag = existing.get('etag') if existing else None
+        body = dict(rule, etag=etag) if etag else rule
+        actions.append({'name': name, 'action': action, 'body': body,
+                        'etag': etag})
+    if prune:
+        for name, existing in current.items():
+            if name not in rules and (managed is None or managed(existing)):
+                actions.append({'name': name, 'action': 'delete',
+                                'body': None, 'etag': existing.get('etag')})
+    return actions
+
+
+def _report(action, status, attempts, error=None):
+    return {'name': action['name'],
+            'action': action['action'],
+            'ok': error is None and (status is None or status < 400),
+            'status': status,
+            'attempts': attempts,
+            'error': error}
+
+
+@instrumentation.operation
+def apply(client, action, max_attempts=MAX_ATTEMPTS):
+    """
+     Apply one planned action, retrying throttled requests after
+        Retry-After. A request that raises, e.g. a ConnectionError once the
+        transport's retries are spent, fails only this action.
+
+     Returns:
+        dict report with name, action, ok, status, attempts and error
+    """
+    if action['action'] == 'unchanged':
+        return _report(action, None, 0)
+    attempts = 0
+    try:
+        while attempts < max_attempts:
+            attempts += 1
+            if action['action'] == 'delete':
+                response = client.delete_alertrule(action['name'])
+            else:
+                response = client.create_alertrule(action['name'],
+                                                   action['body'])
+            if response.status_code != 429:
+                break
+            time.sleep(response_check.retry_after(response.headers,
+                                                  attempts))
+    except Exception as err:
+        return _report(action, None, attempts, f'{type(err).__name__}: {err}')
+    error = response_check.error_detail(response) \
+        if response.status_code > 399 else None
+    return _report(action, response.status_code, attempts, error)
+
+
+@instrumentation.operation
+def deploy(client, desired, prune=False, managed=None, workers=WORKERS,
+           dry_run=False):
+    """
+     Deploy analytics rules to a workspace, only writing the rules whose
+        content changed and deleting, with prune, the rules no longer
+        desired. Writes run in parallel.
+
+     Args:
+        client: SentinelClient of the workspace
+        desired: rules as in plan
+        prune: delete rules that are not desired
+        managed: ( optional ) limits prune, see plan
+        workers: max writes in flight
+        dry_run: only plan, report every action without applying it
+
+     Returns:
+        list of dict reports ( name, action, ok, status, attempts, error )
+            in plan order
+    """
+    actions = plan(client, desired, prune, managed)
+    counts = {}
+    for action in actions:
+        counts[action['action']] = counts.get(action['action'], 0) + 1
+    messages.info(', '.join(f'{count} {name}'
+                            for name, count in sorted(counts.items())))
+    if dry_run:
+        return [_report(action, None, 0) for action in actions]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        reports = list(pool.map(lambda action: apply(client, action),
+                                actions))
+    failed = [r for r in reports if not r['ok']]
+    if failed:
+        messages.error(f'{len(failed)} of {len(reports)} rules failed to '
+                       'deploy')
+    return reports
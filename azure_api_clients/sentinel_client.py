@@ -2,10 +2,17 @@
 Creates Sentinel API Client
 '''
 
-import requests
+from urllib.parse import quote
+
 from . import api_auth
+from . import bulk_update
+from . import export
+from . import instrumentation
+from . import json_backend
 from . import messages
+from . import pagination
 from . import response_check
+from . import transport
 
 
 class SentinelClient:
@@ -17,7 +24,9 @@ class SentinelClient:
     rg:string               resource group name
     ws:string               workspace name
     '''
-    def __init__(self, sub, rg, ws, api_version):
+    def __init__(self, sub, rg, ws, api_version, session=None,
+                 resource=api_auth.MANAGEMENT_SCOPE, token_provider=None,
+                 http_cache=None):
         """
          A Class to establish a client to interact with MSFT Sentinel REST API.
 
@@ -26,18 +35,46 @@ class SentinelClient:
             rg: The resource group name to use ( REQUIRED ).
             ws: The workspace name to use ( REQUIRED ).
             api_version
+            session: ( optional ) transport.ClientSession to send requests
+                with. Defaults to the shared pooled session.
+            resource: ( optional ) ARM endpoint, e.g. a mock_server url
+            token_provider: ( optional ) provider of request headers.
+                Defaults to the shared Azure CLI provider.
+            http_cache: ( optional ) http_cache.HttpCache the template
+                catalog GETs are revalidated through
         """
+        self.session = session or transport.get_session()
+        self.http_cache = http_cache
         self.sub = sub
         self.rg = rg
         self.ws = ws
-        self.resource = "https://management.azure.com"
-        self.api_base = 'https://management.azure.com/subscriptions/' + \
+        self.resource = resource
+        self.api_base = self.resource + '/subscriptions/' + \
             self.sub + '/resourceGroups/' + self.rg + \
             '/providers/Microsoft.OperationalInsights/workspaces/' + self.ws +\
             '/providers/Microsoft.SecurityInsights/'
-        self.headers = api_auth.get_headers()
+        self.token_provider = token_provider or api_auth.get_token_provider(
+            'cli', api_auth.MANAGEMENT_SCOPE)
         self.api_version = f'?api-version={api_version}'
 
+    @property
+    def headers(self):
+        """
+         Request headers with a current token from the shared provider.
+        """
+        return self.token_provider.headers()
+
+    def _cached_get(self, request_url, stream=False):
+        """
+         GET through http_cache when one is set. Streamed requests bypass
+            it.
+        """
+        if self.http_cache is None or stream:
+            return self.session.get(request_url, headers=self.headers,
+                                    stream=stream)
+        return self.http_cache.get(self.session, request_url, self.headers)
+
+    @instrumentation.operation
     def get_inc(self, id):
         """
          Get an incident's information from Sentinel
@@ -51,14 +88,15 @@ class SentinelClient:
         """
         incident_endpoint = 'incidents/'
         request_url = self.api_base + incident_endpoint + id + self.api_version
-        response = requests.get(request_url, headers=self.headers)
+        response = self.session.get(request_url, headers=self.headers)
         # Return the incident data.
         if response_check.response_check(response):
             messages.success(f'Successfully got incident: {id}')
-            return response.json()
+            return json_backend.parse(response)
         else:
             return False
 
+    @instrumentation.operation
     def get_alert(self, id):
         """
          Get information about an incident's alert from Sentinel
@@ -72,40 +110,86 @@ class SentinelClient:
         """
         incident_endpoint = 'incidents/' + id + '/alerts' + self.api_version
         request_url = self.api_base + incident_endpoint
-        response = requests.post(request_url, headers=self.headers)
+        response = self.session.post(request_url, headers=self.headers)
         # Return the alert if successful False otherwise.
         if response_check.response_check(response):
-            success(f'Successfully got alert: {id}')
-            return response.json()
+            messages.success(f'Successfully got alert: {id}')
+            return json_backend.parse(response)
         else:
             return False
 
+    @instrumentation.operation
+    def iter_incs(self, filter=None, orderby=None):
+        """
+        Iterate over incidents, following nextLink paging.
+
+        Args:
+            filter: ( optional ) OData $filter, e.g.
+                "properties/lastModifiedTimeUtc ge 2024-01-01T00:00:00Z"
+            orderby: ( optional ) OData $orderby, e.g.
+                'properties/lastModifiedTimeUtc asc'
+
+        Returns:
+            generator of incident dicts. A page that fails to load raises
+                pagination.PageError.
+        """
+        params = {'$filter': filter, '$orderby': orderby}
+        query = ''.join(f'&{name}={quote(value)}'
+                        for name, value in params.items() if value)
+        request_url = self.api_base + 'incidents' + self.api_version + query
+        return pagination.iter_values(self.session, request_url,
+                                      lambda: self.headers)
+
 # TODO Fix to remove out and use rc
-    def create_inc(self, id, body, out=False):
+    @instrumentation.operation
+    def create_inc(self, id, body, out=False, compression=None):
         """
          Create Incident in Sentinel by id and return response object.
 
          Args:
             id: incident id to be created
             body: json body of items to update in the incident
-            out: boolean whether to write output to file default False
+            out: boolean whether to write output to file default False, or a
+                path or binary file object to stream it to
+            compression: None, 'gzip' or 'zstd' to compress the output
 
          Returns:
-            response object from requests library or json if out = True
-                response object will be returned in json format if out
+            response object from requests library. When out is set and the
+                request succeeded the body is streamed to out and an
+                export.Written ( destination, size ) is returned instead
         """
         incident_endpoint = 'incidents/' + id + self.api_version
         request_url = self.api_base + incident_endpoint
-        response = requests.put(request_url, json=body, headers=self.headers)
+        response = self.session.put(request_url, json=body,
+                                    headers=self.headers, stream=bool(out))
         # If out is true write the sent inc alert. json to file
-        if out:
-            with open('sent_inc_alert.json', 'wb') as fd:
-                fd.write(response.content)
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='sent_inc_alert.json')
 
         return response
 
+    @instrumentation.operation
+    def update_incs(self, updates, workers=bulk_update.WORKERS):
+        """
+         Update many incidents in parallel. Each incident is read, patched
+            and written back with its etag in If-Match so concurrent edits
+            are not lost, and throttled requests wait for Retry-After.
+
+         Args:
+            updates: iterable of (id, patch) pairs where patch is a dict of
+                incident properties to change
+            workers: max updates in flight
+
+         Returns:
+            list of dict reports ( id, ok, status, attempts, throttle_wait,
+                error ) in the same order as updates
+        """
+        return bulk_update.update_sentinel_incs(self, updates, workers)
+
 # TODO Fix to remove out and use rc
-    def purge_data(self, body, out=False):
+    @instrumentation.operation
+    def purge_data(self, body, out=False, compression=None):
         """
          Purge Incident data from Sentinel.
             Purge data is a way to get a list of incident's data
@@ -113,99 +197,196 @@ class SentinelClient:
 
          Args:
             body: json formatted body of items to update
-            out: boolean whether to write output to file default is False
+            out: boolean whether to write output to file default is False,
+                or a path or binary file object to stream it to
+            compression: None, 'gzip' or 'zstd' to compress the output
 
          Returns:
             requests response object from API and data to be used in other
-                methods of this class. Example response object is
-                returned as JSON
+                methods of this class. When out is set and the request
+                succeeded the body is streamed to out and an export.Written
+                is returned instead
         """
         purge_endpoint = '/purge?api-version=2020-08-01'
-        base_url = 'https://management.azure.com/subscriptions/' + \
+        base_url = self.resource + '/subscriptions/' + \
             self.sub + '/resourceGroups/' + self.rg + \
             '/providers/Microsoft.OperationalInsights/workspaces/' + self.ws
         request_url = base_url + purge_endpoint
-        response = requests.post(request_url, json=body, headers=self.headers)
+        response = self.session.post(request_url, json=body,
+                                     headers=self.headers, stream=bool(out))
         # purge the response from the server
-        if out:
-            with open('purge_response.json', 'wb') as fd:
-                fd.write(response.content)
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='purge_response.json')
 
         return response
 
 # TODO Fix to remove out and use rc
-    def get_alert_ruleTemplates(self, out=False):
+    @instrumentation.operation
+    def get_alert_ruleTemplates(self, out=False, compression=None,
+                                ndjson=False):
         """
-        Get list of alert rule templates.
+        Get list of alert rule templates. This is the first page only, see
+            iter_alert_ruleTemplates for the whole catalog.
 
         Args:
-            out: Output file to write to
+            out: Output file to write to. True for
+                sent_alert_ruleTemplates.json, or a path or binary file
+                object to stream it to
+            compression: None, 'gzip' or 'zstd' to compress the output
+            ndjson: write every template of every page to out as one JSON
+                line each and return the number written
 
         Returns:
             HTTP response from API ( json ) or None
-            if not succesful ( error )
+            if not succesful ( error ). When out is set and the request
+                succeeded the body is streamed to out and an export.Written
+                is returned instead
         """
 
+        if out and ndjson:
+            return export.write_ndjson(
+                self.iter_alert_ruleTemplates(), out, compression,
+                default='sent_alert_ruleTemplates.ndjson')
+
         incident_endpoint = 'alertRuleTemplates/' + self.api_version
         request_url = self.api_base + incident_endpoint
-        response = requests.get(request_url, headers=self.headers)
+        response = self._cached_get(request_url, stream=bool(out))
         # Write the sent alert rule templates to json file
-        if out:
-            with open('sent_alert_ruleTemplates.json', 'wb') as fd:
-                fd.write(response.content)
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='sent_alert_ruleTemplates.json')
 
         return response
 
+    @instrumentation.operation
+    def iter_alert_ruleTemplates(self):
+        """
+        Iterate over all alert rule templates, following nextLink paging.
+            The next page is fetched while the current one is consumed.
+            Every page goes through http_cache when one is set.
+
+        Returns:
+            generator of alert rule template dicts. A page that fails to
+                load raises pagination.PageError.
+        """
+        request_url = self.api_base + 'alertRuleTemplates' + self.api_version
+        return pagination.iter_values(self.session, request_url,
+                                      lambda: self.headers,
+                                      cache=self.http_cache)
+
 # TODO Fix to remove out and use rc
-    def get_alert_ruleTemplate(self, id, out=False):
+    @instrumentation.operation
+    def get_alert_ruleTemplate(self, id, out=False, compression=None):
         """
         Get alert rule template by id.
 
         Args:
             id: id of the alert rule template
             out: if True the response will be written to
-                sent_alert_ruleTemplate. json
+                sent_alert_ruleTemplate. json, or a path or binary file
+                object to stream it to
+            compression: None, 'gzip' or 'zstd' to compress the output
 
         Returns:
             json object of the alert rule template that was passed as
                 parameter or
-                None if not found or error while querying
+                None if not found or error while querying. When out is set
+                and the request succeeded the body is streamed to out and an
+                export.Written is returned instead
         """
 
         alert_template_endpoint = 'alertRuleTemplates/' + id + self.api_version
         request_url = self.api_base + alert_template_endpoint
-        response = requests.get(request_url, headers=self.headers)
+        response = self._cached_get(request_url, stream=bool(out))
         # Write the sent alert rule template to json file
-        if out:
-            with open('sent_alert_ruleTemplate.json', 'wb') as fd:
-                fd.write(response.content)
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='sent_alert_ruleTemplate.json')
 
-        return response.json()
+        return json_backend.parse(response)
 
 # TODO Fix to remove out and use rc
-    def get_alertrules(self, out=False):
+    @instrumentation.operation
+    def get_alertrules(self, out=False, compression=None, ndjson=False):
         """
         Get alert rules from Alert
 
         Args:
-            out: If True write the response to sent_alert_ruless. json
+            out: If True write the response to sent_alert_ruless. json, or a
+                path or binary file object to stream it to
+            compression: None, 'gzip' or 'zstd' to compress the output
+            ndjson: write every rule of every page to out as one JSON line
+                each and return the number written
 
         Returns:
             response from API call as a requests. Response object or None if
-                there was an error.
+                there was an error. When out is set and the request succeeded
+                the body is streamed to out and an export.Written is returned
+                instead
         """
 
+        if out and ndjson:
+            return export.write_ndjson(self.iter_alertrules(), out,
+                                       compression,
+                                       default='sent_alert_ruless.ndjson')
+
         alert_endpoint = 'alertRules' + self.api_version
         request_url = self.api_base + alert_endpoint
-        response = requests.get(request_url, headers=self.headers)
+        response = self.session.get(request_url, headers=self.headers,
+                                    stream=bool(out))
         # If out is true write rule to json file
-        if out:
-            with open('sent_alert_ruless.json', 'wb') as fd:
-                fd.write(response.content)
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='sent_alert_ruless.json')
 
         return response
 
+    @instrumentation.operation
+    def iter_alertrules(self):
+        """
+        Iterate over all alert rules, following nextLink paging.
+
+        Returns:
+            generator of alert rule dicts. A page that fails to load raises
+                pagination.PageError.
+        """
+        request_url = self.api_base + 'alertRules' + self.api_version
+        return pagination.iter_values(self.session, request_url,
+                                      lambda: self.headers)
+
+    @instrumentation.operation
+    def create_alertrule(self, id, body):
+        """
+        Create or replace an alert rule.
+
+        Args:
+            id: name of the rule
+            body: rule with kind and properties, and the etag of the current
+                rule to only replace that version
+
+        Returns:
+            response from API call as a requests. Response object
+        """
+        request_url = self.api_base + 'alertRules/' + id + self.api_version
+        return self.session.put(request_url, json=body, headers=self.headers)
+
+    @instrumentation.operation
+    def delete_alertrule(self, id):
+        """
+        Delete an alert rule.
+
+        Args:
+            id: name of the rule
+
+        Returns:
+            response from API call as a requests. Response object
+        """
+        request_url = self.api_base + 'alertRules/' + id + self.api_version
+        return self.session.delete(request_url, headers=self.headers)
+
 # TODO Fix to remove out and use rc
+    @instrumentation.operation
     def get_product_templates(self, out=False):
         """
          Get all templates in the catalog.
@@ -219,50 +400,97 @@ class SentinelClient:
         prod_endpoint = 'contentProductTemplates' + self.api_version
         request_url = self.api_base + prod_endpoint
 
-        return requests.get(request_url, headers=self.headers).json()
+        return json_backend.parse(self._cached_get(request_url))
+
+    @instrumentation.operation
+    def iter_product_templates(self):
+        """
+         Iterate over all templates in the catalog, following nextLink paging.
+            Every page goes through http_cache when one is set.
+
+         Returns:
+            generator of template dicts. A page that fails to load raises
+                pagination.PageError.
+        """
+        request_url = self.api_base + 'contentProductTemplates' + \
+            self.api_version
+        return pagination.iter_values(self.session, request_url,
+                                      lambda: self.headers,
+                                      cache=self.http_cache)
 
 # TODO Fix to remove out and use rc
-    def get_data_conns(self, out=False):
+    @instrumentation.operation
+    def get_data_conns(self, out=False, compression=None, ndjson=False):
         """
         Get alert rules from Alert
 
         Args:
-            out: If True write the response to sent_alert_ruless. json
+            out: If True write the response to sent_data_conns. json, or a
+                path or binary file object to stream it to
+            compression: None, 'gzip' or 'zstd' to compress the output
+            ndjson: write every connector of every page to out as one JSON
+                line each and return the number written
 
         Returns:
             response from API call as a requests. Response object or None if
-                there was an error.
+                there was an error. When out is set and the request succeeded
+                the body is streamed to out and an export.Written is returned
+                instead
         """
+        if out and ndjson:
+            return export.write_ndjson(self.iter_data_conns(), out,
+                                       compression,
+                                       default='sent_data_conns.ndjson')
 
         alert_endpoint = 'dataConnectors' + self.api_version
         request_url = self.api_base + alert_endpoint
-        response = requests.get(request_url, headers=self.headers)
+        response = self.session.get(request_url, headers=self.headers,
+                                    stream=bool(out))
         # If out is true write rule to json file
-        if out:
-            with open('sent_alert_ruless.json', 'wb') as fd:
-                fd.write(response.content)
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='sent_data_conns.json')
         if response_check.response_check(response):
-            return response.json()
+            return json_backend.parse(response)
+
+    @instrumentation.operation
+    def iter_data_conns(self):
+        """
+        Iterate over all data connectors, following nextLink paging.
+
+        Returns:
+            generator of data connector dicts. A page that fails to load raises
+                pagination.PageError.
+        """
+        request_url = self.api_base + 'dataConnectors' + self.api_version
+        return pagination.iter_values(self.session, request_url,
+                                      lambda: self.headers)
 
-    def run_query(self, ws_id, query, out=False):
+    @instrumentation.operation
+    def run_query(self, ws_id, query, out=False, compression=None):
         """
         Get alert rules from Alert
 
         Args:
-            out: If True write the response to sent_alert_ruless. json
+            out: If True write the response to query_results. json, or a
+                path or binary file object to stream it to
+            compression: None, 'gzip' or 'zstd' to compress the output
 
         Returns:
             response from API call as a requests. Response object or None if
-                there was an error.
+                there was an error. When out is set and the request succeeded
+                the body is streamed to out and an export.Written is returned
+                instead
         """
 
         alert_endpoint = 'dataSources' + self.api_version
         base = f'https://api.loganalytics.io/v1/workspaces/{ws_id}/query'
         request_url = base + alert_endpoint
-        response = requests.post(request_url, headers=self.headers, json=query)
+        response = self.session.post(request_url, headers=self.headers,
+                                     json=query, stream=bool(out))
         # If out is true write rule to json file
-        if out:
-            with open('sent_alert_ruless.json', 'wb') as fd:
-                fd.write(response.content)
+        if out and response.ok:
+            return export.save(response, out, compression,
+                               default='query_results.json')
         if response_check.response_check(response):
-            return response.json()
+            return json_backend.parse(response)
@@ -0,0 +1,128 @@
+'''
+Shared HTTP transport with connection pooling and retries for all clients
+'''
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import instrumentation
+from . import json_backend
+from . import rate_governor
+
+POOL_SIZE = 32
+RETRIES = 5
+BACKOFF_FACTOR = 0.5
+BACKOFF_JITTER = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class ClientSession(requests.Session):
+    '''
+    A requests Session used by every client. Connections are pooled and
+        kept alive per host, and idempotent requests are retried with
+        exponential backoff and jitter on 5xx responses and connection
+        resets.
+
+    Argments
+    pool_size:int           connections kept open per host
+    retries:int             max retries per request
+    backoff_factor:float    base of the exponential backoff in seconds
+    backoff_jitter:float    max random seconds added to each backoff
+    governor:RateGovernor   (optional) paces requests against throttling
+                                budgets and learns from their responses
+    '''
+    def __init__(self, pool_size=POOL_SIZE, retries=RETRIES,
+                 backoff_factor=BACKOFF_FACTOR,
+                 backoff_jitter=BACKOFF_JITTER, governor=None):
+        super().__init__()
+        self.governor = governor
+        retry = Retry(total=retries,
+                      connect=retries,
+                      read=retries,
+                      status=retries,
+                      backoff_factor=backoff_factor,
+                      backoff_jitter=backoff_jitter,
+                      status_forcelist=RETRY_STATUSES,
+                      raise_on_status=False,
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        # Encode json= bodies with the selected JSON backend
+        body = kwargs.pop('json', None)
+        if body is not None:
+            kwargs['data'] = json_backend.dumps(body)
+            headers = dict(kwargs.get('headers') or {})
+            if not any(name.lower() == 'content-type' for name in headers):
+                headers['Content-Type'] = 'application/json'
+            kwargs['headers'] = headers
+        throttle_wait = 0.0
+        if self.governor is not None:
+            tenant = rate_governor.tenant_of(kwargs.get('headers'))
+            throttle_wait = self.governor.acquire(method, url, tenant)
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception:
+            instrumentation.record(method, url, 'error',
+                                   time.perf_counter() - start,
+                                   throttle_wait=throttle_wait)
+            raise
+        latency = time.perf_counter() - start
+        if self.governor is not None:
+            self.governor.observe(method, url, response.status_code,
+                                  response.headers, tenant)
+        instrumentation.record(method, url, response.status_code, latency,
+                               bytes_out=_body_size(response.request.body),
+                               bytes_in=_content_size(response),
+                               retries=_retries(response),
+                               throttle_wait=throttle_wait)
+        return response
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return None
+
+
+def _content_size(response):
+    # Streamed bodies have not been read yet, go by the declared length
+    if response._content_consumed:
+        return len(response.content or b'')
+    length = response.headers.get('Content-Length')
+    return int(length) if length else None
+
+
+def _retries(response):
+    retries = getattr(response.raw, 'retries', None)
+    return len(retries.history) if retries is not None else 0
+
+
+def get_session():
+    """
+     Get the process wide ClientSession, creating it on first use.
+
+     Returns:
+        ClientSession shared by all clients that were not given their own
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = ClientSession(
+                    governor=rate_governor.get_governor())
+    return _session
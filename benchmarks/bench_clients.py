@@ -0,0 +1,254 @@
+'''
+Throughput benchmarks for the clients against the local mock server
+
+    python -m benchmarks.bench_clients [--requests N] [--workers W]
+        [--latency S] [--throttle R] [--payload B] [--json PATH]
+        [--baseline PATH] [--tolerance T]
+
+Every client method is run sequentially and with a thread pool, recording
+requests/sec, p50/p99 latency, peak traced Python allocations and RSS. Each
+run happens in its own process with its own mock server, so the peak RSS
+and its growth during the run belong to that scenario alone. With
+--baseline the run fails if any scenario lost more than --tolerance of its
+throughput.
+'''
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from azure_api_clients import api_auth
+from azure_api_clients import law_query
+from azure_api_clients import rate_governor
+from azure_api_clients import transport
+from azure_api_clients.graph_client import GraphClient
+from azure_api_clients.monitor_client import MonitorClient
+from azure_api_clients.sentinel_client import SentinelClient
+from benchmarks import mock_server
+
+SUB, RG, WS = 'sub', 'rg', 'ws'
+API_VERSION = '2023-02-01'
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def measure(name, call, args, workers):
+    """
+     Run call once per item of args and collect its performance.
+
+     Returns:
+        dict of results for the scenario
+    """
+    latencies = []
+
+    def timed(arg):
+        start = time.perf_counter()
+        call(arg)
+        latencies.append(time.perf_counter() - start)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        if workers == 1:
+            for arg in args:
+                timed(arg)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(timed, args))
+    elapsed = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies.sort()
+    return {'scenario': name,
+            'workers': workers,
+            'calls': len(args),
+            'calls_per_sec': len(args) / elapsed if elapsed else 0.0,
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000,
+            'traced_peak_kb': traced_peak / 1024,
+            'max_rss_kb': max_rss,
+            'rss_growth_kb': max_rss - rss_before}
+
+
+def scenarios(server, count, workers):
+    """
+     Build the (name, call, args) scenarios to run against server.
+    """
+    session = transport.ClientSession(
+        pool_size=max(workers, transport.POOL_SIZE),
+        governor=rate_governor.RateGovernor())
+    token = api_auth.StaticTokenProvider('mock-token')
+    sentinel = SentinelClient(SUB, RG, WS, API_VERSION, session=session,
+                              resource=server.url, token_provider=token)
+    monitor = MonitorClient(SUB, RG, API_VERSION, session=session,
+                            resource=server.url, token_provider=token)
+    graph = GraphClient(None, None, None, session=session,
+                        resource=server.url, token_provider=token)
+    incident_ids = [str(i % 100) for i in range(count)]
+    users = [f'user{i % 20}' for i in range(count)]
+    server.put_arm(f'/subscriptions/{SUB}/resourceGroups/{RG}/providers/'
+                   'Microsoft.Insights/dataCollectionRules/dcr',
+                   {'properties': {}})
+
+    found = [
+        ('SentinelClient.get_inc', sentinel.get_inc, incident_ids),
+        ('SentinelClient.get_alert', sentinel.get_alert, incident_ids),
+        ('SentinelClient.iter_alertrules',
+         lambda _: list(sentinel.iter_alertrules()), range(count // 10)),
+        ('SentinelClient.get_alert_ruleTemplates',
+         lambda _: sentinel.get_alert_ruleTemplates().content,
+         range(count // 10)),
+        ('MonitorClient.get_dcr', monitor.get_dcr, ['dcr'] * count),
+        ('GraphClient.get_inc', graph.get_inc, incident_ids),
+        ('GraphClient.get_inc_and_alerts', graph.get_inc_and_alerts,
+         incident_ids),
+        ('GraphClient.get_user_photo', graph.get_user_photo, users),
+        ('GraphClient.get_incs',
+         lambda ids: graph.get_incs(ids),
+         [incident_ids[i:i + 20] for i in range(0, count, 20)]),
+    ]
+    try:
+        engine = law_query.QueryEngine(
+            credential=mock_server.MockCredential(),
+            endpoint=server.url + '/v1',
+            query_kwargs={'enforce_https': False})
+    except ImportError:
+        return found
+    found.append(('QueryEngine.execute',
+                  lambda _: engine.execute(WS, 'MockTable', None, 'rows'),
+                  range(count // 10)))
+    return found
+
+
+def compare(results, baseline_path, tolerance):
+    """
+     Compare throughput with a previous --json run.
+
+     Returns:
+        list of regression messages
+    """
+    with open(baseline_path) as fd:
+        baseline = {(r['scenario'], r['workers']): r for r in json.load(fd)}
+    regressions = []
+    for result in results:
+        before = baseline.get((result['scenario'], result['workers']))
+        if before is None:
+            continue
+        floor = before['calls_per_sec'] * (1 - tolerance)
+        if result['calls_per_sec'] < floor:
+            regressions.append(
+                f"{result['scenario']} x{result['workers']}: "
+                f"{result['calls_per_sec']:.1f}/s < "
+                f"{before['calls_per_sec']:.1f}/s baseline")
+    return regressions
+
+
+def run_one(args, name, workers):
+    """
+     Run one scenario in this process against a fresh mock server.
+
+     Returns:
+        dict of results, see measure
+    """
+    server = mock_server.MockAzureServer(latency=args.latency,
+                                         throttle_rate=args.throttle,
+                                         payload_bytes=args.payload).start()
+    try:
+        server.seed_workspace(SUB, RG, WS)
+        server.seed_graph()
+        for found, call, call_args in scenarios(server, args.requests,
+                                                args.workers):
+            if found == name:
+                return measure(name, call, list(call_args), workers)
+        raise ValueError(f'Unknown scenario {name}')
+    finally:
+        server.stop()
+
+
+def run_isolated(argv, name, workers):
+    """
+     Run one scenario in a child process, so its RSS is not inflated by the
+        scenarios run before it.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')]))
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_clients', *argv,
+         '--scenario', name, '--run-workers', str(workers)],
+        env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of latency injected per request')
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help='fraction of requests answered with 429')
+    parser.add_argument('--payload', type=int, default=0,
+                        help='padding bytes added to every item')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    # Used by run_isolated for the child processes
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--run-workers', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        print(json.dumps(run_one(args, args.scenario, args.run_workers)))
+        return 0
+
+    # Only the names are needed here, the scenarios run in child processes
+    server = mock_server.MockAzureServer().start()
+    try:
+        names = [name for name, _, _ in scenarios(server, 0, 1)]
+    finally:
+        server.stop()
+    results = []
+    for name in names:
+        for workers in (1, args.workers):
+            results.append(run_isolated(argv, name, workers))
+
+    print(f'{"scenario":<42}{"workers":>8}{"calls/s":>10}{"p50 ms":>9}'
+          f'{"p99 ms":>9}{"traced KB":>11}{"RSS KB":>10}{"+RSS KB":>9}')
+    for r in results:
+        print(f'{r["scenario"]:<42}{r["workers"]:>8}'
+              f'{r["calls_per_sec"]:>10.1f}{r["p50_ms"]:>9.2f}'
+              f'{r["p99_ms"]:>9.2f}{r["traced_peak_kb"]:>11.0f}'
+              f'{r["max_rss_kb"]:>10}{r["rss_growth_kb"]:>9}')
+    if args.json:
+        with open(args.json, 'w') as fd:
+            json.dump(results, fd, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+'''
+Import-time benchmark for the package and its client modules
+
+    python -m benchmarks.bench_import [--repeat N] [--json PATH]
+        [--baseline PATH] [--tolerance T]
+
+Each module is imported in a fresh interpreter, recording the median import
+time and which of the heavy optional dependencies got loaded with it. The
+run fails if importing a module pulls in a heavy dependency, or with
+--baseline if any module got more than --tolerance slower.
+'''
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MODULES = ('azure_api_clients',
+           'azure_api_clients.api_auth',
+           'azure_api_clients.transport',
+           'azure_api_clients.sentinel_client',
+           'azure_api_clients.graph_client',
+           'azure_api_clients.monitor_client',
+           'azure_api_clients.law_query')
+# Only imported once they are actually used
+HEAVY = ('pandas', 'pyarrow', 'azure.identity', 'azure.monitor.query',
+         'azure.core', 'aiohttp')
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed,
+                  'loaded': [name for name in {heavy!r}
+                             if name in sys.modules]}}))
+'''
+
+
+def probe(module):
+    """
+     Import module in a fresh interpreter.
+
+     Returns:
+        dict with the import time in seconds and the heavy modules loaded,
+            or None if the import failed
+    """
+    code = _PROBE.format(module=module, heavy=HEAVY)
+    result = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f'{module}: import failed\n{result.stderr}', file=sys.stderr)
+        return None
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def measure(module, repeat):
+    """
+     Import module repeat times and collect the median import time.
+
+     Returns:
+        dict of results for the module, or None if the import failed
+    """
+    runs = [probe(module) for _ in range(repeat)]
+    if any(run is None for run in runs):
+        return None
+    return {'module': module,
+            'median_ms': statistics.median(r['seconds'] for r in runs) * 1000,
+            'min_ms': min(r['seconds'] for r in runs) * 1000,
+            'loaded': runs[0]['loaded']}
+
+
+def compare(results, baseline_path, tolerance):
+    """
+     Compare import times with a previous --json run.
+
+     Returns:
+        list of regression messages
+    """
+    with open(baseline_path) as fd:
+        baseline = {r['module']: r for r in json.load(fd)}
+    regressions = []
+    for result in results:
+        before = baseline.get(result['module'])
+        if before is None:
+            continue
+        ceiling = before['median_ms'] * (1 + tolerance)
+        if result['median_ms'] > ceiling:
+            regressions.append(
+                f"{result['module']}: {result['median_ms']:.1f}ms > "
+                f"{before['median_ms']:.1f}ms baseline")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    results = []
+    failed = False
+    for module in MODULES:
+        result = measure(module, args.repeat)
+        if result is None:
+            failed = True
+            continue
+        results.append(result)
+
+    print(f'{"module":<38}{"median ms":>11}{"min ms":>9}  heavy imports')
+    for r in results:
+        print(f'{r["module"]:<38}{r["median_ms"]:>11.1f}{r["min_ms"]:>9.1f}'
+              f'  {", ".join(r["loaded"]) or "-"}')
+    if args.json:
+        with open(args.json, 'w') as fd:
+            json.dump(results, fd, indent=2)
+
+    regressions = [f'{r["module"]} imports {", ".join(r["loaded"])}'
+                   for r in results if r['loaded']]
+    if args.baseline:
+        regressions += compare(results, args.baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    return 1 if regressions or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,573 @@
+'''
+    Local stand-in for the ARM, Graph and Log Analytics endpoints the clients
+    call, for benchmarks and offline development
+'''
+
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+PAGE_SIZE = 50
+QUERY_ROWS = 1000
+# Polls an async operation reports as running before it completes
+LRO_POLLS = 2
+ARM_BUDGET = 11999
+PHOTO = bytes(range(256)) * 16
+
+
+def _etag():
+    return '"' + str(uuid.uuid4()) + '"'
+
+
+class MockCredential:
+    '''
+    azure-core TokenCredential handing out a fake token, for pointing a
+        law_query.QueryEngine at the mock server
+    '''
+    def get_token(self, *scopes, **kwargs):
+        from azure.core.credentials import AccessToken
+        return AccessToken('mock-token', int(time.time()) + 3600)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, keep them from waiting on
+    # delayed ACKs
+    disable_nagle_algorithm = True
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, headers, payload = self.server.mock.handle(
+            self.command, self.path, self.headers, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockAzureServer:
+    '''
+    A threaded HTTP server emulating the Sentinel/Insights ARM, Graph
+        security and Log Analytics query endpoints. ARM and Graph
+        collections are paginated, ARM GETs answer If-None-Match with 304,
+        ARM PUTs and Graph incident PATCHes honor If-Match, purges and
+        table creation return pollable async operations, and latency,
+        throttling and payload size can be injected.
+
+    Argments
+    host:string             interface to listen on
+    port:int                port to listen on, 0 picks a free one
+    latency:float           seconds added to every request
+    throttle_rate:float     fraction of requests answered with 429
+    retry_after:int         Retry-After sent with each 429
+    page_size:int           items per page of list endpoints
+    query_rows:int          rows returned by each Log Analytics query
+    payload_bytes:int       padding added to every generated item/row
+    '''
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0,
+                 throttle_rate=0.0, retry_after=0, page_size=PAGE_SIZE,
+                 query_rows=QUERY_ROWS, payload_bytes=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.query_rows = query_rows
+        self.payload_bytes = payload_bytes
+        self.requests = 0
+        # ARM GETs answered with 304
+        self.not_modified = 0
+        self.arm = {}
+        self.graph = {'incidents': {}, 'alerts': {}, 'photos': {}}
+        self.operations = {}
+        self.faults = []
+        self.queries = {}
+        self.partial = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """
+         Start serving on a background thread.
+
+         Returns:
+            self, with url set to the server's base url
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self.port = self._server.server_address[1]
+        self.url = f'http://{self.host}:{self.port}'
+        # A short poll interval keeps stop() from lagging half a second
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+         Stop serving and close the listening socket.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    # Seeding
+
+    def _padding(self):
+        return 'x' * self.payload_bytes
+
+    def put_arm(self, path, item):
+        """
+         Store an ARM resource at path ( without api-version ).
+
+         Returns:
+            the stored item with id, name and a fresh etag
+        """
+        collection, name = path.rstrip('/').rsplit('/', 1)
+        item = {**item, 'id': path, 'name': name, 'etag': _etag()}
+        with self._lock:
+            self.arm.setdefault(collection.lower(), {})[name.lower()] = item
+        return item
+
+    def seed_workspace(self, sub, rg, ws, incidents=100, rules=100,
+                       templates=100, connectors=20, product_templates=50):
+        """
+         Fill a workspace with generated Sentinel resources.
+
+         Returns:
+            str: ARM path of the workspace's SecurityInsights provider
+        """
+        base = f'/subscriptions/{sub}/resourceGroups/{rg}/providers/' + \
+            f'Microsoft.OperationalInsights/workspaces/{ws}/providers/' + \
+            'Microsoft.SecurityInsights'
+        now = datetime.now(timezone.utc)
+        severities = ('High', 'Medium', 'Low', 'Informational')
+        statuses = ('New', 'Active', 'Closed')
+        for i in range(incidents):
+            modified = (now - timedelta(minutes=i)).isoformat()
+            self.put_arm(f'{base}/incidents/{i}', {'properties': {
+                'title': f'Incident {i}',
+                'incidentNumber': i,
+                'severity': severities[i % len(severities)],
+                'status': statuses[i % len(statuses)],
+                'owner': {'assignedTo': f'analyst{i % 5}'},
+                'createdTimeUtc': modified,
+                'lastModifiedTimeUtc': modified,
+                'description': self._padding()}})
+        for i in range(rules):
+            self.put_arm(f'{base}/alertRules/rule-{i}', {
+                'kind': 'Scheduled', 'properties': {
+                    'displayName': f'Rule {i}', 'enabled': True,
+                    'severity': severities[i % len(severities)],
+                    'query': f'SecurityEvent | where EventID == {i}',
+                    'description': self._padding()}})
+        for i in range(templates):
+            self.put_arm(f'{base}/alertRuleTemplates/template-{i}', {
+                'kind': 'Scheduled', 'properties': {
+                    'displayName': f'Template {i}',
+                    'description': self._padding()}})
+        for i in range(connectors):
+            self.put_arm(f'{base}/dataConnectors/connector-{i}', {
+                'kind': 'AzureActiveDirectory',
+                'properties': {'dataTypes': {}}})
+        for i in range(product_templates):
+            self.put_arm(f'{base}/contentProductTemplates/product-{i}', {
+                'properties': {'displayName': f'Product {i}',
+                               'description': self._padding()}})
+        return base
+
+    def seed_graph(self, incidents=100, alerts_per_incident=3, users=20):
+        """
+         Fill the Graph security store with generated incidents, alerts and
+            user photos.
+        """
+        with self._lock:
+            for i in range(incidents):
+                alert_ids = [f'{i}-{a}' for a in range(alerts_per_incident)]
+                for alert_id in alert_ids:
+                    self.graph['alerts'][alert_id] = {
+                        'id': alert_id, 'incidentId': str(i),
+                        'severity': 'medium', 'status': 'new',
+                        'title': f'Alert {alert_id}',
+                        'description': self._padding()}
+                self.graph['incidents'][str(i)] = {
+                    'id': str(i), 'displayName': f'Incident {i}',
+                    'severity': 'medium', 'status': 'active',
+                    'alertIds': alert_ids, '@odata.etag': _etag()}
+            for i in range(users):
+                self.graph['photos'][f'user{i}'] = PHOTO
+
+    # Request handling
+
+    def fail_next(self, match, status=429, count=1, headers=None,
+                  method=None):
+        """
+         Answer the next count requests whose path contains match with an
+            error, e.g. to exercise throttling and failure handling. Graph
+            $batch sub-requests are matched on their own url.
+
+         Args:
+            match: substring of the request path, query included
+            status: status code to answer with
+            count: number of requests to fail
+            headers: ( optional ) headers to add, e.g. Retry-After
+            method: ( optional ) only fail requests with this method
+
+         Returns:
+            self
+        """
+        with self._lock:
+            self.faults.append([count, match, method, status,
+                                dict(headers or {})])
+        return self
+
+    def put_query(self, match, columns, rows):
+        """
+         Answer Log Analytics queries whose text contains match with a fixed
+            table instead of generated rows.
+
+         Args:
+            match: substring of the KQL text
+            columns: list of (name, type) pairs, e.g. ('LastSeen',
+                'datetime')
+            rows: list of row lists
+        """
+        with self._lock:
+            self.queries[match] = {
+                'name': 'PrimaryResult',
+                'columns': [{'name': name, 'type': kind}
+                            for name, kind in columns],
+                'rows': rows}
+
+    def partial_next(self, count=1):
+        """
+         Answer the next count Log Analytics queries with a partial result:
+            the first half of the rows along with an error, as the service
+            does when a query hits its limits.
+        """
+        with self._lock:
+            self.partial += count
+
+    def _fault(self, method, path):
+        with self._lock:
+            for fault in self.faults:
+                count, match, fault_method, status, headers = fault
+                if count > 0 and match in path and \
+                        fault_method in (None, method):
+                    fault[0] -= 1
+                    break
+            else:
+                return None
+        status, out_headers, payload = self._error(
+            status, str(status), 'Injected by mock server')
+        out_headers.update(headers)
+        return status, out_headers, payload
+
+    def _json(self, status, body, headers=None):
+        return status, {'Content-Type': 'application/json',
+                        **(headers or {})}, json.dumps(body).encode()
+
+    def _error(self, status, code, message):
+        return self._json(status, {'error': {'code': code,
+                                             'message': message}})
+
+    def handle(self, method, raw_path, headers, body):
+        """
+         Answer one request.
+
+         Returns:
+            tuple of ( status, headers dict, body bytes )
+        """
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            status, out_headers, payload = self._error(
+                429, 'TooManyRequests', 'Throttled by mock server')
+            out_headers['Retry-After'] = str(self.retry_after)
+            return status, out_headers, payload
+        fault = self._fault(method, raw_path)
+        if fault is not None:
+            return fault
+
+        parts = urlsplit(raw_path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        path = parts.path.rstrip('/')
+        data = json.loads(body) if body else None
+
+        if path.startswith('/subscriptions/'):
+            status, out_headers, payload = self._arm(method, path, query,
+                                                     headers, data)
+            kind = 'reads' if method == 'GET' else 'writes'
+            out_headers[f'x-ms-ratelimit-remaining-subscription-{kind}'] = \
+                str(ARM_BUDGET)
+            if method == 'GET' and status == 200:
+                etag = '"' + hashlib.sha256(payload).hexdigest() + '"'
+                out_headers['ETag'] = etag
+                if headers.get('If-None-Match') == etag:
+                    with self._lock:
+                        self.not_modified += 1
+                    return 304, out_headers, b''
+            return status, out_headers, payload
+        if path.startswith('/v1.0'):
+            return self._graph(method, path[len('/v1.0'):], query, data,
+                               headers)
+        if path.startswith('/v1/'):
+            return self._logs(method, path[len('/v1'):], data)
+        return self._error(404, 'NotFound', path)
+
+    def _page(self, items, query, base_url, next_key):
+        skip = int(query.get('$skipToken', 0))
+        page = {'value': items[skip:skip + self.page_size]}
+        if skip + self.page_size < len(items):
+            next_query = {**query, '$skipToken': skip + self.page_size}
+            page[next_key] = self.url + base_url + '?' + urlencode(next_query)
+        return page
+
+    def _filter(self, items, query):
+        """
+         Apply the "properties/<field> ge <value>" $filter and
+            "properties/<field> asc|desc" $orderby forms the clients send.
+            Returns None for any other $filter.
+        """
+        if query.get('$filter'):
+            field, op, value = query['$filter'].split(' ', 2)
+            if op != 'ge':
+                return None
+            field = field.split('/')[-1]
+            value = value.strip("'")
+            items = [item for item in items
+                     if item['properties'].get(field, '') >= value]
+        if query.get('$orderby'):
+            field, _, order = query['$orderby'].partition(' ')
+            field = field.split('/')[-1]
+            items = sorted(items, reverse=order == 'desc',
+                           key=lambda item: item['properties'].get(field, ''))
+        return items
+
+    def _operation(self, done_status, running_status):
+        op_id = str(uuid.uuid4())
+        with self._lock:
+            self.operations[op_id] = [LRO_POLLS, running_status, done_status]
+        return op_id
+
+    def _poll(self, op_id):
+        with self._lock:
+            operation = self.operations.get(op_id)
+            if operation is None:
+                return self._error(404, 'NotFound', op_id)
+            operation[0] -= 1
+            status = operation[1] if operation[0] >= 0 else operation[2]
+        return self._json(200, {'id': op_id, 'status': status})
+
+    def _arm(self, method, path, query, headers, data):
+        lower = path.lower()
+        if '/operations/' in lower or '/operationstatuses/' in lower:
+            return self._poll(path.rsplit('/', 1)[1])
+        if method == 'POST' and lower.endswith('/purge'):
+            op_id = self._operation('completed', 'pending')
+            location = f'{self.url}{path}/operations/{op_id}' + \
+                '?api-version=2020-08-01'
+            return self._json(202, {'operationId': op_id},
+                              {'x-ms-status-location': location})
+        if method == 'POST' and lower.endswith('/alerts'):
+            incident = path.rsplit('/', 2)[1]
+            return self._json(200, {'value': [
+                {'name': f'{incident}-{a}', 'properties': {
+                    'alertDisplayName': f'Alert {incident}-{a}',
+                    'description': self._padding()}}
+                for a in range(3)]})
+
+        with self._lock:
+            collection = self.arm.get(lower)
+            items = list(collection.values()) if collection else None
+        if method == 'GET' and items is not None:
+            items = self._filter(items, query)
+            if items is None:
+                return self._error(400, 'BadRequest', query['$filter'])
+            return self._json(200, self._page(items, query, path,
+                                              'nextLink'))
+
+        parent, name = lower.rsplit('/', 1)
+        with self._lock:
+            current = self.arm.get(parent, {}).get(name)
+        if method == 'GET':
+            if current is None:
+                return self._error(404, 'NotFound', path)
+            return self._json(200, current)
+        if method == 'DELETE':
+            with self._lock:
+                self.arm.get(parent, {}).pop(name, None)
+            return 200 if current else 204, {}, b''
+        if method == 'PUT':
+            if_match = headers.get('If-Match')
+            if if_match and current is not None and \
+                    if_match != current['etag']:
+                return self._error(412, 'PreconditionFailed',
+                                   'etag mismatch')
+            item = self.put_arm(path, {k: v for k, v in (data or {}).items()
+                                       if k not in ('id', 'name', 'etag')})
+            if '/tables/' in lower:
+                op_id = self._operation('Succeeded', 'InProgress')
+                operation = f'{self.url}/subscriptions/' + \
+                    f'{path.split("/")[2]}/providers/' + \
+                    'Microsoft.OperationalInsights/locations/mock/' + \
+                    f'operationStatuses/{op_id}?api-version=2022-10-01'
+                return self._json(202, item,
+                                  {'Azure-AsyncOperation': operation})
+            return self._json(201 if current is None else 200, item)
+        return self._error(405, 'MethodNotAllowed', method)
+
+    def _graph(self, method, path, query, data, headers=None):
+        if method == 'POST' and path == '/$batch':
+            responses = []
+            statuses = {}
+            for request in data['requests']:
+                if any(statuses.get(dep, 424) > 399
+                       for dep in request.get('dependsOn', [])):
+                    status, headers, payload = self._error(
+                        424, 'FailedDependency', request['id'])
+                else:
+                    status, headers, payload = \
+                        self._fault(request['method'], request['url']) or \
+                        self._graph(request['method'],
+                                    *self._split(request['url']),
+                                    request.get('body'),
+                                    request.get('headers'))
+                statuses[request['id']] = status
+                if headers.get('Content-Type') == 'application/json':
+                    body = json.loads(payload) if payload else None
+                else:
+                    body = base64.b64encode(payload).decode()
+                responses.append({'id': request['id'], 'status': status,
+                                  'headers': headers, 'body': body})
+            return self._json(200, {'responses': responses})
+
+        segments = path.strip('/').split('/')
+        if segments[:2] == ['security', 'incidents']:
+            if len(segments) == 2:
+                items = list(self.graph['incidents'].values())
+                return self._json(200, self._page(items, query,
+                                                  '/v1.0' + path,
+                                                  '@odata.nextLink'))
+            incident = self.graph['incidents'].get(segments[2])
+            if incident is None:
+                return self._error(404, 'NotFound', path)
+            if method == 'PATCH':
+                if_match = (headers or {}).get('If-Match')
+                with self._lock:
+                    if if_match and if_match != incident['@odata.etag']:
+                        return self._error(412, 'PreconditionFailed',
+                                           'etag mismatch')
+                    incident.update(data or {})
+                    incident['@odata.etag'] = _etag()
+            if query.get('$expand') == 'alerts':
+                incident = {**incident, 'alerts': [
+                    self.graph['alerts'][a] for a in incident['alertIds']]}
+            return self._json(200, incident)
+        if segments[:2] == ['security', 'alerts_v2'] and len(segments) == 3:
+            alert = self.graph['alerts'].get(segments[2])
+            if alert is None:
+                return self._error(404, 'NotFound', path)
+            return self._json(200, alert)
+        if segments[0] == 'users' and len(segments) >= 3:
+            photo = self.graph['photos'].get(segments[1])
+            if photo is None:
+                return self._error(404, 'ImageNotFound', path)
+            if segments[-1] == '$value':
+                return 200, {'Content-Type': 'image/jpeg'}, photo
+            return self._json(200, {
+                '@odata.mediaContentType': 'image/jpeg',
+                '@odata.mediaEtag': '"' + str(hash(photo)) + '"',
+                'id': '240X240', 'height': 240, 'width': 240})
+        return self._error(404, 'NotFound', path)
+
+    def _split(self, url):
+        parts = urlsplit(url)
+        return parts.path, {k: v[0] for k, v in
+                            parse_qs(parts.query).items()}
+
+    def _tables(self, query=''):
+        with self._lock:
+            fixed = next((table for match, table in self.queries.items()
+                          if match in query), None)
+            partial = self.partial > 0
+            self.partial -= partial
+        if fixed is not None:
+            table = fixed
+        else:
+            now = datetime.now(timezone.utc)
+            rows = [[(now - timedelta(seconds=i)).isoformat(),
+                     f'host{i % 50}', f'Event {i} {self._padding()}']
+                    for i in range(self.query_rows)]
+            table = {'name': 'PrimaryResult',
+                     'columns': [{'name': 'TimeGenerated',
+                                  'type': 'datetime'},
+                                 {'name': 'Computer', 'type': 'string'},
+                                 {'name': 'Message', 'type': 'string'}],
+                     'rows': rows}
+        if not partial:
+            return {'tables': [table]}
+        return {'tables': [{**table,
+                            'rows': table['rows'][:len(table['rows']) // 2]}],
+                'error': {'code': 'PartialError',
+                          'message': 'Query result exceeded the limits'}}
+
+    def _logs(self, method, path, data):
+        if method == 'POST' and path == '/$batch':
+            return self._json(200, {'responses': [
+                {'id': request['id'], 'status': 200,
+                 'body': self._tables(request['body']['query'])}
+                for request in data['requests']]})
+        if method == 'POST' and path.endswith('/query'):
+            return self._json(200, self._tables(data['query']))
+        return self._error(404, 'NotFound', path)
+
+
+def main():
+    """
+     Run the mock server in the foreground:
+        python -m benchmarks.mock_server [port]
+    """
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = MockAzureServer(port=port).start()
+    server.seed_workspace('sub', 'rg', 'ws')
+    server.seed_graph()
+    print(f'Mock Azure endpoints on {server.url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import pytest
+
+from azure_api_clients import api_auth
+from azure_api_clients import instrumentation
+from azure_api_clients import transport
+from azure_api_clients.graph_client import GraphClient
+from azure_api_clients.monitor_client import MonitorClient
+from azure_api_clients.sentinel_client import SentinelClient
+from benchmarks.mock_server import MockAzureServer
+
+SUB, RG, WS = 'sub', 'rg', 'ws'
+API_VERSION = '2023-02-01'
+
+
+@pytest.fixture
+def server():
+    server = MockAzureServer(page_size=10).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def session():
+    # No retry backoff, so throttling tests run at full speed
+    session = transport.ClientSession(pool_size=8, backoff_factor=0,
+                                      backoff_jitter=0)
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def events():
+    # Every instrumentation event recorded during the test
+    events = []
+    instrumentation.add_hook(events.append)
+    yield events
+    instrumentation.remove_hook(events.append)
+
+
+@pytest.fixture
+def token():
+    return api_auth.StaticTokenProvider('mock-token')
+
+
+@pytest.fixture
+def sentinel(server, session, token):
+    server.seed_workspace(SUB, RG, WS, incidents=25, rules=25, templates=25,
+                          connectors=5, product_templates=15)
+    return SentinelClient(SUB, RG, WS, API_VERSION, session=session,
+                          resource=server.url, token_provider=token)
+
+
+@pytest.fixture
+def monitor(server, session, token):
+    return MonitorClient(SUB, RG, API_VERSION, session=session,
+                         resource=server.url, token_provider=token)
+
+
+@pytest.fixture
+def graph(server, session, token):
+    server.seed_graph(incidents=30, alerts_per_incident=2, users=5)
+    return GraphClient(None, None, None, session=session,
+                       resource=server.url, token_provider=token)
+
+
+@pytest.fixture
+def engine(server):
+    pytest.importorskip('azure.monitor.query')
+    from azure_api_clients.law_query import QueryEngine
+    from benchmarks.mock_server import MockCredential
+    return QueryEngine(credential=MockCredential(),
+                       endpoint=server.url + '/v1',
+                       query_kwargs={'enforce_https': False})
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import namedtuple
+
+from azure_api_clients import api_auth
+
+AccessToken = namedtuple('AccessToken', ['token', 'expires_on'])
+
+
+class StubCredential:
+    def __init__(self, lifetime=3600):
+        self.lifetime = lifetime
+        self.calls = 0
+        self.scopes = []
+
+    def get_token(self, scope):
+        self.calls += 1
+        self.scopes.append(scope)
+        return AccessToken(f'token-{self.calls}',
+                           time.time() + self.lifetime)
+
+
+def _in_thread(func, timeout=5):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()),
+                              daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'call did not return'
+    return result[0]
+
+
+def test_first_get_token_builds_credential():
+    credential = StubCredential()
+    built = []
+
+    def factory():
+        built.append(credential)
+        return credential
+
+    provider = api_auth.TokenProvider(factory, 'scope')
+    assert _in_thread(provider.get_token) == 'token-1'
+    assert provider.get_token() == 'token-1'
+    assert len(built) == 1
+    assert credential.scopes == ['scope']
+    assert provider.credential is credential
+
+
+def test_headers_carry_bearer_token():
+    provider = api_auth.TokenProvider(StubCredential, 'scope')
+    headers = _in_thread(provider.headers)
+    assert headers['Authorization'] == 'Bearer token-1'
+
+
+def test_expiring_token_refreshed_before_use():
+    credential = StubCredential(lifetime=30)
+    provider = api_auth.TokenProvider(lambda: credential, 'scope',
+                                      refresh_margin=300,
+                                      blocking_margin=60)
+    assert provider.get_token() == 'token-1'
+    # Within blocking_margin of expiry, so the caller waits for a new one
+    assert provider.get_token() == 'token-2'
+
+
+def test_background_refresh_serves_cached_token():
+    credential = StubCredential(lifetime=120)
+    provider = api_auth.TokenProvider(lambda: credential, 'scope',
+                                      refresh_margin=300,
+                                      blocking_margin=60)
+    assert provider.get_token() == 'token-1'
+    # Inside refresh_margin but not blocking_margin: the cached token is
+    # handed out while a new one is fetched in the background
+    assert provider.get_token() == 'token-1'
+    deadline = time.time() + 5
+    while credential.calls < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert credential.calls == 2
+    while provider._refreshing and time.time() < deadline:
+        time.sleep(0.01)
+    assert provider._token.token == 'token-2'
+
+
+def test_background_refresh_error_is_reported(capsys):
+    class FailingCredential(StubCredential):
+        def get_token(self, scope):
+            if self.calls:
+                self.calls += 1
+                raise RuntimeError('refresh failed')
+            return super().get_token(scope)
+
+    credential = FailingCredential(lifetime=120)
+    provider = api_auth.TokenProvider(lambda: credential, 'scope')
+    provider.get_token()
+    assert provider.get_token() == 'token-1'
+    deadline = time.time() + 5
+    while (credential.calls < 2 or provider._refreshing) and \
+            time.time() < deadline:
+        time.sleep(0.01)
+    assert 'refresh failed' in capsys.readouterr().out
+    assert provider.get_token() == 'token-1'
+
+
+def test_providers_shared_per_key():
+    first = api_auth.get_token_provider('client_secret', 'scope', 't', 'c',
+                                        'secret')
+    assert api_auth.get_token_provider('client_secret', 'scope', 't', 'c',
+                                       'secret') is first
+    rotated = api_auth.get_token_provider('client_secret', 'scope', 't',
+                                          'c', 'rotated')
+    assert rotated is not first
+    assert not any('rotated' in key for key in api_auth._providers)
+
+
+def test_static_token_provider():
+    provider = api_auth.StaticTokenProvider('abc')
+    assert provider.get_token() == 'abc'
+    assert provider.headers()['Authorization'] == 'Bearer abc'
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from azure_api_clients import rate_governor
+from tests.conftest import API_VERSION, RG, SUB, WS
+
+pytest.importorskip('aiohttp')
+from azure_api_clients.async_clients import (  # noqa: E402
+    AsyncGraphClient, AsyncSentinelClient)
+
+
+def _sentinel(server, token, **kwargs):
+    return AsyncSentinelClient(SUB, RG, WS, API_VERSION, resource=server.url,
+                               token_provider=token,
+                               governor=rate_governor.RateGovernor(),
+                               **kwargs)
+
+
+def _graph(server, token, **kwargs):
+    return AsyncGraphClient(None, None, None, resource=server.url,
+                            token_provider=token,
+                            governor=rate_governor.RateGovernor(), **kwargs)
+
+
+async def _collect(results):
+    return {id: result async for id, result in results}
+
+
+def test_get_incs_bounded(server, token):
+    server.seed_workspace(SUB, RG, WS, incidents=20)
+
+    async def run():
+        async with _sentinel(server, token) as client:
+            return await _collect(client.get_incs(
+                [str(i) for i in range(20)] + ['missing'], concurrency=4))
+
+    results = asyncio.run(run())
+    assert len(results) == 21
+    assert results['3']['properties']['incidentNumber'] == 3
+    assert results['missing'] is False
+
+
+def test_get_alerts(server, token):
+    server.seed_workspace(SUB, RG, WS, incidents=2)
+
+    async def run():
+        async with _sentinel(server, token) as client:
+            return await _collect(client.get_alerts(['0', '1']))
+
+    results = asyncio.run(run())
+    assert len(results['1']['value']) == 3
+
+
+def test_graph_expand_alerts(server, token):
+    server.seed_graph(incidents=5, alerts_per_incident=2)
+
+    async def run():
+        async with _graph(server, token) as client:
+            return await _collect(client.get_incs(['1', '2'],
+                                                  expand_alerts=True))
+
+    results = asyncio.run(run())
+    assert len(results['2']['alerts']) == 2
+
+
+def test_429_retried_after_retry_after(server, token):
+    server.seed_graph(incidents=2)
+    server.fail_next('/security/incidents/1', 429, count=2,
+                     headers={'Retry-After': '0'})
+
+    async def run():
+        async with _graph(server, token) as client:
+            return await client.get_inc('1')
+
+    incident = asyncio.run(run())
+    assert incident['id'] == '1'
+
+
+def test_429_gives_up_after_retries(server, token):
+    server.seed_graph(incidents=2)
+    server.fail_next('/security/incidents/1', 429, count=10,
+                     headers={'Retry-After': '0'})
+
+    async def run():
+        async with _graph(server, token, retries=2) as client:
+            return await client.get_inc('1')
+
+    assert asyncio.run(run()) is False
+    # Three attempts, seven faults left
+    assert server.faults[0][0] == 7
@@ -0,0 +1,63 @@
+import json
+
+import requests
+
+from benchmarks import bench_clients
+from benchmarks.mock_server import MockAzureServer
+
+
+def test_mock_server_pages_arm_collections(server, sentinel):
+    items = list(sentinel.iter_alertrules())
+    assert len(items) == 25
+    # 10 items per page
+    assert server.requests == 3
+
+
+def test_mock_server_throttles():
+    with MockAzureServer(throttle_rate=1.0, retry_after=7) as server:
+        response = requests.get(server.url + '/v1.0/security/incidents')
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '7'
+
+
+def test_measure_reports_rss_growth():
+    result = bench_clients.measure('noop', lambda arg: bytearray(1024),
+                                   range(10), 2)
+    assert result['calls'] == 10
+    assert result['workers'] == 2
+    assert result['rss_growth_kb'] >= 0
+    assert result['max_rss_kb'] >= result['rss_growth_kb']
+
+
+def test_compare_flags_regressions(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps([
+        {'scenario': 'a', 'workers': 1, 'calls_per_sec': 100.0},
+        {'scenario': 'b', 'workers': 1, 'calls_per_sec': 100.0}]))
+    results = [{'scenario': 'a', 'workers': 1, 'calls_per_sec': 70.0},
+               {'scenario': 'b', 'workers': 1, 'calls_per_sec': 90.0},
+               {'scenario': 'c', 'workers': 1, 'calls_per_sec': 1.0}]
+    regressions = bench_clients.compare(results, str(baseline), 0.2)
+    assert len(regressions) == 1
+    assert regressions[0].startswith('a x1')
+
+
+def test_run_isolated_runs_scenario_in_child():
+    result = bench_clients.run_isolated(['--requests', '20'],
+                                        'MonitorClient.get_dcr', 1)
+    assert result['scenario'] == 'MonitorClient.get_dcr'
+    assert result['calls'] == 20
+    assert result['max_rss_kb'] > 0
+
+
+def test_mock_server_injects_faults(server, graph):
+    server.fail_next('/security/incidents/1', 503, count=2,
+                     headers={'Retry-After': '0'})
+    response = requests.get(server.url + '/v1.0/security/incidents/1')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '0'
+    results = graph.batch([{'method': 'GET',
+                            'url': '/security/incidents/1'}], retries=0)
+    assert results[0]['status'] == 503
+    assert requests.get(
+        server.url + '/v1.0/security/incidents/1').status_code == 200
@@ -0,0 +1,92 @@
+from azure_api_clients import bulk_update
+from tests.conftest import RG, SUB, WS
+
+
+def _incident(server, id):
+    return server.arm[(f'/subscriptions/{SUB}/resourceGroups/{RG}/providers/'
+                       'Microsoft.OperationalInsights/workspaces/'
+                       f'{WS}/providers/Microsoft.SecurityInsights/'
+                       'incidents').lower()][id]
+
+
+def test_sentinel_updates(server, sentinel):
+    reports = sentinel.update_incs([(str(i), {'status': 'Closed'})
+                                    for i in range(5)])
+    assert [r['id'] for r in reports] == [str(i) for i in range(5)]
+    assert all(r['ok'] and r['attempts'] == 1 for r in reports)
+    assert _incident(server, '3')['properties']['status'] == 'Closed'
+
+
+def test_sentinel_conflict_is_merged_again(server, sentinel):
+    server.fail_next('/incidents/1', 412, method='PUT')
+    report, = sentinel.update_incs([('1', {'status': 'Closed'})])
+    assert report['ok'] and report['attempts'] == 2
+    # Read, rejected PUT, read again, PUT
+    assert server.requests == 4
+
+
+def test_sentinel_throttled(server, sentinel):
+    server.fail_next('/incidents/2', 429, count=2, method='PUT',
+                     headers={'Retry-After': '0'})
+    report, = sentinel.update_incs([('2', {'status': 'Closed'})])
+    assert report['ok']
+    assert _incident(server, '2')['properties']['status'] == 'Closed'
+
+
+def test_sentinel_missing(sentinel):
+    report, = sentinel.update_incs([('missing', {'status': 'Closed'})])
+    assert not report['ok'] and report['status'] == 404
+    assert report['error']['code'] == 'NotFound'
+
+
+def test_graph_updates_span_chunks(server, graph):
+    ids = [str(i) for i in range(25)]
+    reports = bulk_update.update_graph_incs(
+        graph, [(id, {'status': 'resolved'}) for id in ids])
+    assert [r['id'] for r in reports] == ids
+    assert all(r['ok'] and r['attempts'] == 1 for r in reports)
+    assert server.graph['incidents']['24']['status'] == 'resolved'
+    # A read and a patch $batch per chunk of 20
+    assert server.requests == 4
+
+
+def test_graph_patch_sends_if_match(server, graph):
+    etag = server.graph['incidents']['1']['@odata.etag']
+    graph.update_inc('1', {'status': 'resolved'}, etag=etag)
+    result, = graph.update_incs([('1', {'status': 'active'}, etag)])
+    assert result['status'] == 412
+    assert server.graph['incidents']['1']['status'] == 'resolved'
+
+
+def test_graph_conflict_is_patched_again(server, graph):
+    server.fail_next('/security/incidents/3', 412, method='PATCH')
+    report, = bulk_update.update_graph_incs(graph,
+                                            [('3', {'status': 'resolved'})])
+    assert report['ok'] and report['attempts'] == 2
+    assert server.graph['incidents']['3']['status'] == 'resolved'
+
+
+def test_graph_throttle_wait(server, graph):
+    server.fail_next('/security/incidents/4', 429, method='PATCH',
+                     headers={'Retry-After': '0.05'})
+    reports = bulk_update.update_graph_incs(
+        graph, [('4', {'status': 'resolved'}), ('5', {'status': 'resolved'})])
+    assert reports[0]['attempts'] == 2
+    assert reports[0]['throttle_wait'] == 0.05
+    assert reports[1]['attempts'] == 1 and reports[1]['throttle_wait'] == 0
+    assert all(r['ok'] for r in reports)
+
+
+def test_graph_gives_up_after_max_attempts(server, graph):
+    server.fail_next('/security/incidents/6', 412, count=5, method='PATCH')
+    report, = bulk_update.update_graph_incs(
+        graph, [('6', {'status': 'resolved'})], max_attempts=3)
+    assert report['status'] == 412 and report['attempts'] == 3
+    assert report['error']
+
+
+def test_graph_missing(graph):
+    report, = bulk_update.update_graph_incs(graph,
+                                            [('missing', {'status': 'x'})])
+    assert not report['ok'] and report['status'] == 404
+    assert report['attempts'] == 0
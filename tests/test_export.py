@@ -0,0 +1,82 @@
+import gzip
+import io
+import json
+import sys
+
+import pytest
+
+from azure_api_clients import export
+from benchmarks.mock_server import PHOTO
+
+
+def test_out_path_returns_written(sentinel, tmp_path):
+    path = tmp_path / 'rules.json'
+    result = sentinel.get_alertrules(out=str(path))
+    assert isinstance(result, export.Written)
+    assert result.ok and result.status_code == 200
+    assert result.destination == str(path)
+    assert result.size == path.stat().st_size
+    assert len(json.loads(path.read_bytes())['value']) == 10
+
+
+def test_out_true_uses_default_name(sentinel, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = sentinel.get_data_conns(out=True, compression='gzip')
+    assert result.destination == 'sent_data_conns.json.gz'
+    with gzip.open(tmp_path / result.destination) as fd:
+        assert len(json.load(fd)['value']) == 5
+
+
+def test_create_inc_out_file_object(sentinel):
+    fd = io.BytesIO()
+    result = sentinel.create_inc('new', {'properties': {'title': 'x'}},
+                                 out=fd)
+    assert result.ok and result.destination is fd
+    assert json.loads(fd.getvalue())['properties']['title'] == 'x'
+
+
+def test_binary_body_streamed(graph):
+    fd = io.BytesIO()
+    result = graph.get_user_photo('user0', out=fd)
+    assert fd.getvalue() == PHOTO
+    assert result.size == len(PHOTO)
+
+
+def test_failed_request_returns_response(graph, tmp_path):
+    path = tmp_path / 'missing.json'
+    response = graph.get_inc('missing', out=str(path))
+    assert not isinstance(response, export.Written)
+    assert response.status_code == 404
+    assert 'error' in response.json()
+    assert not path.exists()
+
+
+def test_zstd(sentinel):
+    zstandard = pytest.importorskip('zstandard')
+    fd = io.BytesIO()
+    result = sentinel.get_alertrules(out=fd, compression='zstd')
+    body = zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(fd.getvalue())).read()
+    assert len(body) == result.size
+    assert len(json.loads(body)['value']) == 10
+
+
+def test_zstd_missing(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+    with pytest.raises(ImportError, match='zstd extra'):
+        with export.open_sink(io.BytesIO(), 'zstd'):
+            pass
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError):
+        with export.open_sink(io.BytesIO(), 'brotli'):
+            pass
+
+
+def test_ndjson_pages_all_items(sentinel):
+    fd = io.BytesIO()
+    count = sentinel.get_alertrules(out=fd, ndjson=True)
+    lines = fd.getvalue().splitlines()
+    assert count == len(lines) == 25
+    assert len({json.loads(line)['name'] for line in lines}) == 25
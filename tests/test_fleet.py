@@ -0,0 +1,109 @@
+import time
+
+from azure_api_clients.fleet import Fleet
+from tests.conftest import API_VERSION, RG, SUB
+
+
+def _fleet(server, session, token, workspaces, **kwargs):
+    for ws in workspaces:
+        server.seed_workspace(SUB, RG, ws, incidents=15, rules=5,
+                              templates=0, connectors=0,
+                              product_templates=0)
+    return Fleet([(SUB, RG, ws) for ws in workspaces], API_VERSION,
+                 session=session, token_provider=token, resource=server.url,
+                 **kwargs)
+
+
+def test_iter_items_records_failed_pages(server, session, token):
+    fleet = _fleet(server, session, token, ['ws1', 'ws2'])
+    server.fail_next('workspaces/ws2/providers/Microsoft.SecurityInsights/'
+                     'incidents', 503, count=10)
+    items = list(fleet.iter_items('iter_incs'))
+    assert {key for key, _ in items} == {f'{SUB}/{RG}/ws1'}
+    assert len(items) == 15
+    assert list(fleet.errors) == [f'{SUB}/{RG}/ws2']
+    assert 'PageError: 503' in fleet.errors[f'{SUB}/{RG}/ws2']
+
+
+def test_collect_decodes_results(server, session, token):
+    fleet = _fleet(server, session, token, ['ws1', 'ws2', 'ws3'])
+    reports = fleet.collect('get_alertrules')
+    assert sorted(reports) == [f'{SUB}/{RG}/ws{i}' for i in (1, 2, 3)]
+    assert all(r['ok'] and r['error'] is None for r in reports.values())
+    assert len(reports[f'{SUB}/{RG}/ws2']['result']['value']) == 5
+
+
+def test_collect_drains_iterators(server, session, token):
+    fleet = _fleet(server, session, token, ['ws1', 'ws2'])
+    reports = fleet.collect('iter_incs')
+    assert [len(r['result']) for r in reports.values()] == [15, 15]
+
+
+def test_failures_stay_per_workspace(server, session, token):
+    fleet = _fleet(server, session, token, ['ws1', 'ws2'])
+    server.fail_next('workspaces/ws1/', 400)
+    reports = fleet.collect('get_alertrules')
+    assert not reports[f'{SUB}/{RG}/ws1']['ok']
+    assert reports[f'{SUB}/{RG}/ws1']['result'] is None
+    assert reports[f'{SUB}/{RG}/ws1']['error']['code'] == '400'
+    assert reports[f'{SUB}/{RG}/ws2']['ok']
+    # The False error convention of the clients is not ok
+    reports = fleet.collect('get_inc', 'missing')
+    assert [r['error'] for r in reports.values()] == ['Request failed'] * 2
+
+
+def test_callable_and_dict_targets(server, session, token):
+    server.seed_workspace(SUB, RG, 'ws1', incidents=1, rules=1, templates=0,
+                          connectors=0, product_templates=0)
+    fleet = Fleet([{'sub': SUB, 'rg': RG, 'ws': 'ws1'}], API_VERSION,
+                  session=session, token_provider=token, resource=server.url)
+
+    def fail(client):
+        raise RuntimeError(client.ws)
+
+    report, = fleet.run(lambda client, n: client.get_inc(n), '0')
+    assert report['result']['name'] == '0'
+    report, = fleet.run(fail)
+    assert report['error'] == 'RuntimeError: ws1'
+
+
+def test_out_result_is_ok(server, session, token, tmp_path):
+    fleet = _fleet(server, session, token, ['ws1'])
+    report, = fleet.run('get_alertrules', out=str(tmp_path / 'rules.json'))
+    assert report['ok'] and report['result'].size > 0
+
+
+def test_iter_items_closed_early(server, session, token):
+    fleet = _fleet(server, session, token, ['ws1', 'ws2'])
+    items = fleet.iter_items('iter_incs')
+    first = [next(items) for _ in range(3)]
+    items.close()
+    assert len(first) == 3 and fleet.errors == {}
+
+
+def test_failed_data_conns_not_ok(server, session, token):
+    fleet = _fleet(server, session, token, ['ws1', 'ws2'])
+    for ws in ('ws1', 'ws2'):
+        server.seed_workspace(SUB, RG, ws, incidents=0, rules=0, templates=0,
+                              connectors=2, product_templates=0)
+    server.fail_next('workspaces/ws1/', 403)
+    reports = fleet.collect('get_data_conns')
+    assert not reports[f'{SUB}/{RG}/ws1']['ok']
+    assert reports[f'{SUB}/{RG}/ws1']['error'] == 'Request failed'
+    assert reports[f'{SUB}/{RG}/ws2']['ok']
+
+
+def test_run_closed_early_cancels_pending(server, session, token):
+    fleet = _fleet(server, session, token, [f'ws{i}' for i in range(6)],
+                   concurrency=1)
+    started = []
+
+    def slow(client):
+        started.append(client.ws)
+        time.sleep(0.05)
+        return client.ws
+
+    reports = fleet.run(slow)
+    next(reports)
+    reports.close()
+    assert len(started) < 6
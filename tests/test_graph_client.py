@@ -0,0 +1,84 @@
+import time
+from email.utils import formatdate
+
+from azure_api_clients import graph_client
+
+
+def test_get_incs_spans_batches(server, graph):
+    ids = [str(i) for i in range(25)] + ['missing']
+    incidents = graph.get_incs(ids)
+    assert [inc['id'] for inc in incidents[:25]] == ids[:25]
+    assert incidents[25] is False
+    # Two $batch round trips for 26 ids
+    assert server.requests == 2
+
+
+def test_get_alerts_and_photos(server, graph):
+    alerts = graph.get_alerts(['1-0', '1-1'])
+    assert [alert['id'] for alert in alerts] == ['1-0', '1-1']
+    photos = graph.get_user_photos(['user1', 'nobody'])
+    assert photos[0] == server.graph['photos']['user1']
+    assert photos[1] is False
+
+
+def test_update_incs(server, graph):
+    results = graph.update_incs([('1', {'status': 'resolved'}),
+                                 ('2', {'status': 'active'})])
+    assert [r['status'] for r in results] == [200, 200]
+    assert server.graph['incidents']['1']['status'] == 'resolved'
+
+
+def test_batch_retries_throttled_sub_requests(server, graph):
+    server.fail_next('/security/incidents/3', 429, headers={
+        'Retry-After': formatdate(time.time() - 1, usegmt=True)})
+    server.fail_next('/security/incidents/4', 503,
+                     headers={'Retry-After': '0'})
+    results = graph.batch([{'method': 'GET', 'url': '/security/incidents/'
+                            + str(i)} for i in range(3, 6)])
+    assert [r['status'] for r in results] == [200, 200, 200]
+    assert server.requests == 2
+
+
+def test_failed_dependency_not_resent(server, graph):
+    server.graph['incidents']['2']['status'] = 'active'
+    results = graph.batch([
+        {'method': 'GET', 'url': '/security/incidents/missing'},
+        {'method': 'PATCH', 'url': '/security/incidents/2',
+         'body': {'status': 'resolved'}, 'dependsOn': [0]}])
+    assert [r['status'] for r in results] == [404, 424]
+    assert server.graph['incidents']['2']['status'] == 'active'
+    assert server.requests == 1
+
+
+def test_dependency_retried_with_dependent(server, graph):
+    server.fail_next('/security/incidents/1', 429,
+                     headers={'Retry-After': '0'})
+    results = graph.batch([
+        {'method': 'GET', 'url': '/security/incidents/1'},
+        {'method': 'PATCH', 'url': '/security/incidents/2',
+         'body': {'status': 'resolved'}, 'dependsOn': [0]},
+        {'method': 'PATCH', 'url': '/security/incidents/3',
+         'body': {'status': 'resolved'}, 'dependsOn': [1]}])
+    assert [r['status'] for r in results] == [200, 200, 200]
+    assert server.graph['incidents']['3']['status'] == 'resolved'
+    assert server.requests == 2
+
+
+def test_dependency_failing_on_retry(server, graph):
+    server.fail_next('/security/incidents/1', 429,
+                     headers={'Retry-After': '0'})
+    server.fail_next('/security/incidents/1', 400)
+    results = graph.batch([
+        {'method': 'GET', 'url': '/security/incidents/1'},
+        {'method': 'PATCH', 'url': '/security/incidents/2',
+         'body': {'status': 'resolved'}, 'dependsOn': [0]}])
+    assert [r['status'] for r in results] == [400, 424]
+    assert server.graph['incidents']['2']['status'] != 'resolved'
+
+
+def test_dependency_chains_stay_in_one_chunk(graph):
+    sub_requests = [{'method': 'GET', 'url': f'/x/{i}'} for i in range(30)]
+    sub_requests[25]['dependsOn'] = [1]
+    chunks = list(graph._batch_chunks(sub_requests, list(range(30))))
+    assert all(len(chunk) <= graph_client.BATCH_LIMIT for chunk in chunks)
+    assert any({1, 25} <= set(chunk) for chunk in chunks)
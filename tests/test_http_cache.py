@@ -0,0 +1,85 @@
+import pytest
+
+from azure_api_clients import http_cache
+from azure_api_clients import pagination
+from azure_api_clients.sentinel_client import SentinelClient
+from tests.conftest import API_VERSION, RG, SUB, WS
+
+BASE = (f'/subscriptions/{SUB}/resourceGroups/{RG}/providers/'
+        'Microsoft.OperationalInsights/workspaces/'
+        f'{WS}/providers/Microsoft.SecurityInsights')
+
+
+def _client(server, session, token, cache):
+    server.seed_workspace(SUB, RG, WS, templates=25, product_templates=15)
+    return SentinelClient(SUB, RG, WS, API_VERSION, session=session,
+                          resource=server.url, token_provider=token,
+                          http_cache=cache)
+
+
+def test_template_pages_revalidated(server, session, token, tmp_path):
+    client = _client(server, session, token,
+                     http_cache.HttpCache(str(tmp_path)))
+    first = list(client.iter_alert_ruleTemplates())
+    assert len(first) == 25 and server.requests == 3
+    assert list(client.iter_alert_ruleTemplates()) == first
+    # Every page was revalidated and came back 304
+    assert server.requests == 6 and server.not_modified == 3
+
+
+def test_template_pages_within_max_age(server, session, token, tmp_path):
+    cache = http_cache.HttpCache(str(tmp_path),
+                                 {'*/alertRuleTemplates': 3600})
+    client = _client(server, session, token, cache)
+    first = list(client.iter_alert_ruleTemplates())
+    assert list(client.iter_alert_ruleTemplates()) == first
+    assert server.requests == 3
+
+
+def test_changed_page_is_refetched(server, session, token, tmp_path):
+    client = _client(server, session, token,
+                     http_cache.HttpCache(str(tmp_path)))
+    list(client.iter_alert_ruleTemplates())
+    server.put_arm(f'{BASE}/alertRuleTemplates/template-0',
+                   {'kind': 'Scheduled',
+                    'properties': {'displayName': 'Renamed'}})
+    templates = {t['name']: t for t in client.iter_alert_ruleTemplates()}
+    assert templates['template-0']['properties']['displayName'] == 'Renamed'
+    assert server.not_modified == 2
+
+
+def test_product_templates_cached(server, session, token, tmp_path):
+    client = _client(server, session, token,
+                     http_cache.HttpCache(str(tmp_path)))
+    assert len(list(client.iter_product_templates())) == 15
+    assert len(list(client.iter_product_templates())) == 15
+    assert server.not_modified == 2
+    assert client.get_product_templates()['value']
+    assert server.not_modified == 3
+
+
+def test_single_template_from_cache(server, session, token, tmp_path):
+    cache = http_cache.HttpCache(str(tmp_path), default_max_age=3600)
+    client = _client(server, session, token, cache)
+    template = client.get_alert_ruleTemplate('template-3')
+    assert client.get_alert_ruleTemplate('template-3') == template
+    assert server.requests == 1
+
+
+def test_errors_not_cached(server, session, token, tmp_path):
+    client = _client(server, session, token,
+                     http_cache.HttpCache(str(tmp_path)))
+    server.fail_next('skipToken=10', 400)
+    with pytest.raises(pagination.PageError):
+        list(client.iter_alert_ruleTemplates())
+    assert len(list(client.iter_alert_ruleTemplates())) == 25
+
+
+def test_clear(server, session, token, tmp_path):
+    cache = http_cache.HttpCache(str(tmp_path), default_max_age=3600)
+    client = _client(server, session, token, cache)
+    list(client.iter_alert_ruleTemplates())
+    cache.clear()
+    assert not list(tmp_path.iterdir())
+    list(client.iter_alert_ruleTemplates())
+    assert server.requests == 6
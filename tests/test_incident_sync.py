@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from azure_api_clients import incident_sync
+from azure_api_clients import pagination
+from tests.conftest import RG, SUB, WS
+
+BASE = (f'/subscriptions/{SUB}/resourceGroups/{RG}/providers/'
+        'Microsoft.OperationalInsights/workspaces/'
+        f'{WS}/providers/Microsoft.SecurityInsights')
+
+
+@pytest.fixture
+def store():
+    store = incident_sync.IncidentStore(':memory:')
+    yield store
+    store.close()
+
+
+def _sync(sentinel, store, **kwargs):
+    return incident_sync.IncidentSync(sentinel, store,
+                                      overlap=timedelta(seconds=1), **kwargs)
+
+
+def test_full_sync(sentinel, store):
+    assert _sync(sentinel, store).sync() == 25
+    workspace = incident_sync.workspace_key(sentinel)
+    assert workspace == f'{SUB}/{RG}/{WS}'
+    assert store.count(workspace) == 25
+    # Incident 0 is the most recently modified
+    assert store.checkpoint(workspace) == \
+        store.get(workspace, '0')['properties']['lastModifiedTimeUtc']
+    assert 'alerts' not in store.get(workspace, '0')
+
+
+def test_query_filters(sentinel, store):
+    _sync(sentinel, store).sync()
+    workspace = incident_sync.workspace_key(sentinel)
+    high = store.query(workspace, severity='High')
+    assert {i['name'] for i in high} == {'0', '4', '8', '12', '16', '20',
+                                         '24'}
+    assert [i['name'] for i in high] == sorted(
+        (i['name'] for i in high), key=int)
+    assert len(store.query(workspace, status=['New', 'Active'])) == 17
+    assert len(store.query(workspace, owner='analyst1', limit=2)) == 2
+    since = datetime.now(timezone.utc) - timedelta(minutes=2, seconds=30)
+    assert {i['name'] for i in store.query(workspace, since=since)} == \
+        {'0', '1', '2'}
+    assert store.query('other/rg/ws') == []
+
+
+def test_delta_sync_pulls_only_changes(server, sentinel, store):
+    sync = _sync(sentinel, store)
+    sync.sync()
+    requests = server.requests
+    server.put_arm(f'{BASE}/incidents/10', {'properties': {
+        'title': 'Incident 10', 'status': 'Closed', 'severity': 'High',
+        'lastModifiedTimeUtc': datetime.now(timezone.utc).isoformat()}})
+    # The changed incident and the one at the checkpoint
+    assert sync.sync() == 2
+    assert server.requests == requests + 1
+    workspace = sync.workspace
+    assert store.count(workspace) == 25
+    assert store.get(workspace, '10')['properties']['status'] == 'Closed'
+    assert store.query(workspace, limit=1)[0]['name'] == '10'
+
+
+def test_alerts_synced_and_kept(server, sentinel, store):
+    _sync(sentinel, store, alerts=True, workers=4).sync()
+    incident = store.get(incident_sync.workspace_key(sentinel), '3')
+    assert [a['name'] for a in incident['alerts']] == ['3-0', '3-1', '3-2']
+    # An upsert without alerts keeps the stored ones
+    store.upsert(incident_sync.workspace_key(sentinel),
+                 [({**incident, 'alerts': None}, None)])
+    assert store.get(incident_sync.workspace_key(sentinel),
+                     '3')['alerts'][0]['name'] == '3-0'
+
+
+def test_failed_page_resumes_from_checkpoint(server, sentinel, store,
+                                              monkeypatch):
+    monkeypatch.setattr(incident_sync, 'BATCH_SIZE', 10)
+    sync = _sync(sentinel, store)
+    server.fail_next('skipToken=20', 400)
+    with pytest.raises(pagination.PageError):
+        sync.sync()
+    # The two batches before the failed page were stored
+    assert store.count(sync.workspace) == 20
+    assert store.checkpoint(sync.workspace) is not None
+    # Oldest first: the five newest incidents were not reached
+    assert store.get(sync.workspace, '0') is None
+    assert sync.sync() == 6
+    assert store.count(sync.workspace) == 25
+
+
+def test_store_shared_by_workspaces(tmp_path):
+    path = str(tmp_path / 'incidents.db')
+    store = incident_sync.IncidentStore(path)
+    incident = {'name': 'a', 'properties': {
+        'severity': 'Low', 'lastModifiedTimeUtc': '2024-01-01T00:00:00Z'}}
+    store.upsert('s/r/one', [(incident, None)], '2024-01-01T00:00:00Z')
+    store.upsert('s/r/two', [(incident, None)])
+    # The checkpoint never moves backwards
+    store.upsert('s/r/one', [], '2023-01-01T00:00:00Z')
+    store.close()
+    store = incident_sync.IncidentStore(path)
+    assert store.count('s/r/one') == store.count('s/r/two') == 1
+    assert store.checkpoint('s/r/one') == '2024-01-01T00:00:00Z'
+    assert store.checkpoint('s/r/two') is None
+    store.close()
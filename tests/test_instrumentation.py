@@ -0,0 +1,94 @@
+import asyncio
+import math
+from datetime import timedelta
+
+from azure_api_clients import instrumentation
+
+RULES = ('127.0.0.1/subscriptions/{}/resourceGroups/{}/providers/'
+         'Microsoft.OperationalInsights/workspaces/{}/providers/'
+         'Microsoft.SecurityInsights/alertRules')
+
+
+def test_client_call_event(server, sentinel, events):
+    sentinel.get_alertrules()
+    event, = events
+    assert event['operation'] == 'SentinelClient.get_alertrules'
+    assert event['http_method'] == 'GET'
+    assert event['endpoint'] == RULES
+    assert event['status'] == 200
+    assert event['latency'] > 0 and event['bytes_in'] > 0
+    assert event['retries'] == 0 and event['throttle_wait'] == 0
+
+
+def test_lazy_pages_keep_operation(server, sentinel, events):
+    rules = sentinel.iter_alertrules()
+    assert not events
+    list(rules)
+    assert [e['operation'] for e in events] == \
+        ['SentinelClient.iter_alertrules'] * 3
+
+
+def test_outer_name_wins():
+    with instrumentation.named('outer'):
+        with instrumentation.named('inner'):
+            assert instrumentation.current_operation() == 'outer'
+    assert instrumentation.current_operation() is None
+
+
+def test_async_operation_named():
+    @instrumentation.operation
+    async def fetch():
+        return instrumentation.current_operation()
+
+    assert asyncio.run(fetch()) == \
+        'test_async_operation_named.<locals>.fetch'
+
+
+def test_endpoint_template():
+    assert instrumentation.endpoint_template(
+        'https://graph.microsoft.com/v1.0/security/incidents/42?$top=1') == \
+        'graph.microsoft.com/v1.0/security/incidents/{}'
+
+
+def test_hook_errors_do_not_break_requests(server, sentinel):
+    def broken(event):
+        raise RuntimeError('hook')
+
+    instrumentation.add_hook(broken)
+    try:
+        assert sentinel.get_alertrules().status_code == 200
+    finally:
+        instrumentation.remove_hook(broken)
+
+
+def test_prometheus_text():
+    registry = instrumentation.Registry(buckets=(0.1, 1.0, math.inf))
+    for latency in (0.05, 0.5, 5.0):
+        registry.record({'operation': 'Op', 'endpoint': 'host/x',
+                         'status': 200, 'latency': latency,
+                         'bytes_in': 10, 'bytes_out': None, 'retries': 1,
+                         'throttle_wait': 0.25})
+    registry.record({'operation': None, 'endpoint': 'host/"y"',
+                     'status': 'error', 'latency': 0.01, 'bytes_in': None,
+                     'bytes_out': 5, 'retries': 0, 'throttle_wait': 0})
+    text = registry.prometheus_text()
+    labels = 'operation="Op",endpoint="host/x",status="200"'
+    assert f'azure_api_request_duration_seconds_bucket{{{labels},' \
+        'le="1.0"} 2' in text
+    assert f'azure_api_request_duration_seconds_bucket{{{labels},' \
+        'le="+Inf"} 3' in text
+    assert f'azure_api_request_duration_seconds_count{{{labels}}} 3' in text
+    assert f'azure_api_response_bytes_total{{{labels}}} 30' in text
+    assert f'azure_api_retries_total{{{labels}}} 3' in text
+    assert f'azure_api_throttle_wait_seconds_total{{{labels}}} 0.75' in text
+    assert 'endpoint="host/\\"y\\""' in text
+    registry.reset()
+    assert 'azure_api_retries_total{' not in registry.prometheus_text()
+
+
+def test_law_query_event(server, engine, events):
+    engine.execute('ws', 'T', timedelta(1), 'rows')
+    event = events[-1]
+    assert event['operation'] == 'QueryEngine.execute'
+    assert event['endpoint'] == 'api.loganalytics.io/v1/workspaces/{}/query'
+    assert event['status'] == 'SUCCESS'
@@ -0,0 +1,89 @@
+import sys
+
+import pytest
+import requests
+
+from azure_api_clients import json_backend
+from azure_api_clients import response_check
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    name = json_backend.backend()
+    yield
+    json_backend.set_backend(name)
+
+
+def _response(status, content, url='https://example.test/x'):
+    response = requests.Response()
+    response.status_code = status
+    response._content = content
+    response.url = url
+    return response
+
+
+def test_stdlib_backend():
+    assert json_backend.set_backend('json') == 'json'
+    assert json_backend.backend() == 'json'
+    assert json_backend.dumps({'a': [1, 2]}) == b'{"a":[1,2]}'
+    assert json_backend.loads(b'{"a":[1,2]}') == {'a': [1, 2]}
+
+
+def test_first_installed_backend(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    monkeypatch.setitem(sys.modules, 'msgspec', None)
+    assert json_backend.set_backend() == 'json'
+    with pytest.raises(ImportError):
+        json_backend.set_backend('orjson')
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match='Unknown'):
+        json_backend.set_backend('yaml')
+
+
+@pytest.mark.parametrize('name', json_backend.BACKENDS)
+def test_invalid_json_is_value_error(name):
+    if name != 'json':
+        pytest.importorskip(name)
+    json_backend.set_backend(name)
+    with pytest.raises(ValueError):
+        json_backend.loads(b'<html>')
+
+
+def test_body_parsed_once(monkeypatch):
+    calls = []
+    loads = json_backend.loads
+    monkeypatch.setattr(json_backend, 'loads',
+                        lambda data: calls.append(data) or loads(data))
+    response = _response(400, b'{"error": {"code": "BadRequest"}}')
+    assert not response_check.response_check(response)
+    assert json_backend.parse(response)['error']['code'] == 'BadRequest'
+    assert len(calls) == 1
+
+
+def test_non_json_body():
+    response = _response(502, b'<html>Bad Gateway</html>')
+    assert not response_check.response_check(response)
+    assert response_check.error_detail(response) == \
+        '<html>Bad Gateway</html>'
+    assert json_backend.parse_or_none(response) is None
+    with pytest.raises(ValueError, match='not JSON'):
+        json_backend.parse(response)
+
+
+def test_error_detail_without_error_member():
+    response = _response(409, b'{"message": "conflict"}')
+    assert response_check.error_detail(response) == {'message': 'conflict'}
+
+
+def test_client_parses_once(sentinel, monkeypatch):
+    calls = []
+    loads = json_backend.loads
+    monkeypatch.setattr(json_backend, 'loads',
+                        lambda data: calls.append(data) or loads(data))
+    assert sentinel.get_inc('1')['name'] == '1'
+    # A failed request is checked without raising on its JSON error body
+    assert sentinel.get_inc('missing') is False
+    # One parse per response
+    assert len(calls) == 2
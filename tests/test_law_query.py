@@ -0,0 +1,232 @@
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from azure_api_clients import law_query
+
+SOURCES = [('Source', 'string'), ('LastSeen', 'datetime')]
+
+
+def _seen(**ago):
+    return (datetime.now(timezone.utc) - timedelta(**ago)).isoformat()
+
+
+def test_tracker_merges_incrementally(server, engine, tmp_path):
+    state_path = str(tmp_path / 'state.json')
+    server.put_query('LastSeen', SOURCES, [['Syslog', _seen(hours=1)],
+                                           ['Old', _seen(days=30)]])
+    tracker = law_query.ActiveConnsTracker(state_path, engine=engine)
+    assert tracker.refresh('ws') == [{'Source': 'Syslog'}]
+
+    server.put_query('LastSeen', SOURCES, [['SecurityEvent', _seen()]])
+    assert law_query.get_active_conns('ws', tracker) == [
+        {'Source': 'SecurityEvent'}, {'Source': 'Syslog'}]
+    # State survives a new tracker
+    reloaded = law_query.ActiveConnsTracker(state_path, engine=engine)
+    assert set(reloaded._state['ws']['sources']) == {'SecurityEvent',
+                                                      'Syslog'}
+
+
+def test_tracker_keeps_watermark_on_partial(server, engine, tmp_path):
+    state_path = str(tmp_path / 'state.json')
+    server.put_query('LastSeen', SOURCES, [['Syslog', _seen(hours=1)]])
+    tracker = law_query.ActiveConnsTracker(state_path, engine=engine)
+    tracker.refresh('ws')
+    with open(state_path) as fd:
+        before = json.load(fd)
+
+    server.put_query('LastSeen', SOURCES, [['A', _seen()], ['B', _seen()]])
+    server.partial_next()
+    assert tracker.refresh('ws') is None
+    with open(state_path) as fd:
+        assert json.load(fd) == before
+    assert tracker._state == before
+
+    # The next complete refresh rescans the interval and finds both
+    result = tracker.refresh('ws')
+    assert result == [{'Source': 'A'}, {'Source': 'B'}, {'Source': 'Syslog'}]
+    assert tracker._state['ws']['watermark'] > before['ws']['watermark']
+
+
+def test_tracker_query_failure(server, engine, tmp_path):
+    tracker = law_query.ActiveConnsTracker(str(tmp_path / 'state.json'),
+                                           engine=engine)
+    server.fail_next('/query', 400)
+    assert tracker.refresh('ws') is None
+    assert 'ws' not in tracker._state
+
+
+@pytest.mark.parametrize('mode', ['records', 'rows', 'columns'])
+def test_partial_results_not_cached(server, engine, mode):
+    from azure_api_clients.query_cache import QueryCache
+    engine.cache = QueryCache()
+    server.partial_next()
+    partial = engine.execute('ws', 'T', timedelta(1), mode)
+    complete = engine.execute('ws', 'T', timedelta(1), mode)
+    assert partial != complete
+    assert engine.execute('ws', 'T', timedelta(1), mode) == complete
+    assert server.requests == 2
+
+
+VALUES = [('Name', 'string'), ('Count', 'int')]
+
+
+@pytest.mark.parametrize('mode, expected', [
+    ('json', [{'Name': 'x', 'Count': 1}, {'Name': 'y', 'Count': 2}]),
+    ('records', [[{'Name': 'x', 'Count': 1}, {'Name': 'y', 'Count': 2}]]),
+    ('rows', [(['Name', 'Count'], [('x', 1), ('y', 2)])]),
+    ('columns', [{'Name': ['x', 'y'], 'Count': [1, 2]}])])
+def test_result_modes(server, engine, mode, expected):
+    server.put_query('Values', VALUES, [['x', 1], ['y', 2]])
+    assert engine.execute('ws', 'Values', timedelta(1), mode) == expected
+
+
+def test_dataframe_mode(server, engine):
+    server.put_query('Values', VALUES, [['x', 1], ['y', 2]])
+    frame, = engine.execute('ws', 'Values', timedelta(1), 'dataframe')
+    assert list(frame.columns) == ['Name', 'Count']
+    assert frame['Count'].tolist() == [1, 2]
+
+
+def test_arrow_mode(server, engine):
+    pytest.importorskip('pyarrow')
+    server.put_query('Values', VALUES, [['x', 1], ['y', 2]])
+    table, = engine.execute('ws', 'Values', timedelta(1), 'arrow')
+    assert table.column('Name').to_pylist() == ['x', 'y']
+
+
+def test_arrow_mode_missing(monkeypatch):
+    from types import SimpleNamespace
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    with pytest.raises(ImportError, match='arrow extra'):
+        law_query._convert_table(SimpleNamespace(columns=['A'], rows=[[1]]),
+                                 'arrow')
+
+
+def test_empty_table_columns(server, engine):
+    server.put_query('Values', VALUES, [])
+    assert engine.execute('ws', 'Values', timedelta(1), 'columns') == [
+        {'Name': [], 'Count': []}]
+
+
+def test_every_table_converted():
+    from types import SimpleNamespace
+    tables = [SimpleNamespace(columns=['A'], rows=[[1]]),
+              SimpleNamespace(columns=['B'], rows=[[2], [3]])]
+    assert [law_query._convert_table(t, 'columns') for t in tables] == [
+        {'A': [1]}, {'B': [2, 3]}]
+
+
+def test_unknown_mode(engine):
+    with pytest.raises(ValueError):
+        engine.execute('ws', 'Values', timedelta(1), 'xml')
+
+
+def test_batch_across_workspaces(server, engine):
+    server.put_query('Values', VALUES, [['x', 1]])
+    jobs = [(ws, 'Values', timedelta(1)) for ws in ('ws1', 'ws2', 'ws3')]
+    assert engine.execute_batch(jobs, 'records') == \
+        [[[{'Name': 'x', 'Count': 1}]]] * 3
+    assert server.requests == 1
+
+
+def test_batch_chunks(server, engine, monkeypatch):
+    monkeypatch.setattr(law_query, 'BATCH_LIMIT', 2)
+    results = engine.execute_batch([('ws', 'T', timedelta(1))] * 5, 'rows')
+    assert len(results) == 5 and all(results)
+    assert server.requests == 3
+
+
+def test_failed_batch_returns_none(server, engine):
+    server.fail_next('$batch', 400)
+    assert engine.execute_batch([('ws', 'T', timedelta(1))] * 2) == \
+        [None, None]
+
+
+def test_engine_reuses_credential(server):
+    pytest.importorskip('azure.monitor.query')
+    from benchmarks.mock_server import MockCredential
+
+    class Counting(MockCredential):
+        calls = 0
+
+        def get_token(self, *scopes, **kwargs):
+            Counting.calls += 1
+            return super().get_token(*scopes, **kwargs)
+
+    engine = law_query.QueryEngine(credential=Counting(),
+                                   endpoint=server.url + '/v1',
+                                   query_kwargs={'enforce_https': False})
+    for _ in range(3):
+        engine.execute('ws', 'T', timedelta(1), 'rows')
+    assert Counting.calls == 1
+
+
+def test_module_functions_use_shared_engine(server, engine, monkeypatch):
+    monkeypatch.setattr(law_query, '_engine', None)
+    law_query.set_engine(engine)
+    assert law_query.get_engine() is engine
+    server.put_query('Values', VALUES, [['x', 1]])
+    assert law_query.execute_query('ws', 'Values', timedelta(1)) == \
+        [{'Name': 'x', 'Count': 1}]
+    assert law_query.execute_batch([('ws', 'Values', timedelta(1))]) == \
+        [[{'Name': 'x', 'Count': 1}]]
+
+
+def _record_windows(engine, monkeypatch):
+    windows = []
+    query = engine._query
+
+    def recording(ws_id, text, timespan):
+        windows.append(timespan)
+        return query(ws_id, text, timespan)
+
+    monkeypatch.setattr(engine, '_query', recording)
+    return windows
+
+
+def test_sliced_windows_cover_timespan(server, engine, monkeypatch):
+    windows = _record_windows(engine, monkeypatch)
+    server.put_query('Values', VALUES, [['x', 1], ['y', 2]])
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = engine.execute('ws', 'Values', (start, timedelta(hours=3)),
+                          slice_size=timedelta(hours=1), concurrency=2)
+    assert list(rows) == [{'Name': 'x', 'Count': 1},
+                          {'Name': 'y', 'Count': 2}] * 3
+    assert sorted(windows) == [
+        (start + timedelta(hours=h), start + timedelta(hours=h + 1))
+        for h in range(3)]
+
+
+def test_partial_window_bisected(server, engine, monkeypatch):
+    windows = _record_windows(engine, monkeypatch)
+    server.put_query('Values', VALUES, [['x', 1], ['y', 2]])
+    server.partial_next()
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = list(engine.query_sliced('ws', 'Values',
+                                    (start, start + timedelta(hours=2)),
+                                    timedelta(hours=1), concurrency=1))
+    # The first window came back PARTIAL and was split in two halves
+    assert len(rows) == 6
+    assert windows[1:3] == [
+        (start, start + timedelta(minutes=30)),
+        (start + timedelta(minutes=30), start + timedelta(hours=1))]
+
+
+def test_partial_below_min_window_kept(server, engine):
+    server.put_query('Values', VALUES, [['x', 1], ['y', 2]])
+    server.partial_next()
+    rows = list(engine.query_sliced('ws', 'Values', timedelta(hours=1),
+                                    timedelta(hours=1), concurrency=1,
+                                    min_window=timedelta(hours=1)))
+    assert rows == [{'Name': 'x', 'Count': 1}]
+
+
+def test_sliced_failure_raises(server, engine):
+    from azure.core.exceptions import HttpResponseError
+    server.fail_next('/query', 400)
+    with pytest.raises(HttpResponseError):
+        list(engine.query_sliced('ws', 'T', timedelta(hours=2),
+                                 timedelta(hours=1), concurrency=1))
@@ -0,0 +1,52 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+import azure_api_clients
+from benchmarks import bench_import
+
+
+def _run(code):
+    return subprocess.run([sys.executable, '-c', code], capture_output=True,
+                          text=True, check=True).stdout.strip()
+
+
+def test_no_module_imports_heavy_dependencies(tmp_path):
+    path = tmp_path / 'imports.json'
+    assert bench_import.main(['--repeat', '1', '--json', str(path)]) == 0
+    results = json.loads(path.read_text())
+    assert [r['module'] for r in results] == list(bench_import.MODULES)
+    assert all(r['loaded'] == [] for r in results)
+
+
+def test_facade_imports_on_first_access():
+    assert _run(
+        'import sys, azure_api_clients\n'
+        'before = "azure_api_clients.sentinel_client" in sys.modules\n'
+        'azure_api_clients.SentinelClient\n'
+        'print(before, "azure_api_clients.sentinel_client" in sys.modules)'
+    ) == 'False True'
+
+
+def test_facade_names_resolve():
+    for name in azure_api_clients._LAZY:
+        assert getattr(azure_api_clients, name).__name__ == name
+    assert set(azure_api_clients._LAZY) <= set(dir(azure_api_clients))
+
+
+def test_unknown_name():
+    with pytest.raises(AttributeError):
+        azure_api_clients.NotAClient
+
+
+def test_compare_flags_regressions(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps([{'module': 'a', 'median_ms': 10.0},
+                                    {'module': 'b', 'median_ms': 10.0}]))
+    results = [{'module': 'a', 'median_ms': 14.0},
+               {'module': 'b', 'median_ms': 16.0},
+               {'module': 'c', 'median_ms': 99.0}]
+    regressions = bench_import.compare(results, str(baseline), 0.5)
+    assert len(regressions) == 1 and regressions[0].startswith('b:')
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from azure_api_clients import models
+
+
+def test_sentinel_incident_fields(sentinel):
+    data = sentinel.get_inc('4')
+    incident = models.SentinelIncident.from_dict(data)
+    assert incident.name == '4' and incident.number == 4
+    assert incident.severity == 'High' and incident.owner == 'analyst4'
+    assert incident.modified == data['properties']['lastModifiedTimeUtc']
+    # The full resource is decoded on access
+    assert incident['properties']['title'] == 'Incident 4'
+    assert incident.get('missing', 'x') == 'x'
+    assert incident.to_dict() == data
+    assert not hasattr(incident, '__dict__')
+
+
+def test_from_bytes_matches_from_dict(graph):
+    response = graph.get_inc('2')
+    raw = models.GraphIncident.from_bytes(response.content)
+    assert raw.id == '2'
+    assert raw.to_dict() == models.GraphIncident.from_dict(
+        response.json()).to_dict()
+
+
+def test_interned_values_shared():
+    first = models.GraphAlert.from_bytes(
+        json.dumps({'id': 'a', 'severity': 'medium'}).encode())
+    second = models.GraphAlert.from_bytes(
+        json.dumps({'id': 'b', 'severity': ''.join(['med', 'ium'])})
+        .encode())
+    assert first.severity is second.severity
+    assert first.title is None
+
+
+def test_equality_and_repr():
+    data = {'name': 'x', 'properties': {'alertDisplayName': 'Alert'}}
+    alert = models.SentinelAlert.from_dict(data)
+    assert alert == models.SentinelAlert.from_dict(data)
+    assert len({alert, models.SentinelAlert.from_dict(data)}) == 1
+    assert repr(alert) == \
+        "SentinelAlert(name='x', display_name='Alert', severity=None)"
+
+
+def test_column_store(sentinel):
+    store = models.ColumnStore.from_iter(models.SentinelIncident,
+                                         sentinel.iter_incs())
+    assert len(store) == 25
+    assert store.column('number') == list(range(25))
+    high = store.where(severity='High', status=('New', 'Active'))
+    assert [i.number for i in high] == [0, 4, 12, 16, 24]
+    assert high[1].to_dict()['properties']['incidentNumber'] == 4
+    assert isinstance(store[0], models.SentinelIncident)
+    assert store.where(owner='nobody').raw == []
+
+
+def test_column_store_accepts_models():
+    store = models.ColumnStore(models.GraphIncident)
+    store.append(models.GraphIncident.from_dict({'id': '1',
+                                                 'status': 'active'}))
+    store.append({'id': '2', 'status': 'resolved'})
+    assert store.column('status') == ['active', 'resolved']
+
+
+def test_column_store_dataframe(graph):
+    pytest.importorskip('pandas')
+    store = models.ColumnStore.from_iter(
+        models.GraphAlert, graph.get_alerts(['0-0', '0-1', '1-0']))
+    frame = store.to_dataframe()
+    assert list(frame.columns) == [name for name, _ in
+                                   models.GraphAlert.FIELDS]
+    assert list(frame['incident_id']) == ['0', '0', '1']
@@ -0,0 +1,65 @@
+import pytest
+
+from azure_api_clients import pagination
+from tests.conftest import RG, SUB, WS
+
+
+def _url(server):
+    return (f'{server.url}/subscriptions/{SUB}/resourceGroups/{RG}/'
+            'providers/Microsoft.OperationalInsights/workspaces/'
+            f'{WS}/providers/Microsoft.SecurityInsights/alertRules'
+            '?api-version=2023-02-01')
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_iter_values_follows_next_link(server, sentinel, session, prefetch):
+    items = list(pagination.iter_values(session, _url(server), dict,
+                                        prefetch))
+    assert len(items) == 25
+    assert len({item['name'] for item in items}) == 25
+
+
+def test_iter_pages_is_lazy(server, sentinel, session):
+    pages = pagination.iter_pages(session, _url(server), dict,
+                                  prefetch=False)
+    assert server.requests == 0
+    next(pages)
+    assert server.requests == 1
+
+
+def test_headers_requested_per_page(server, sentinel, session):
+    calls = []
+
+    def headers():
+        calls.append(1)
+        return {}
+
+    list(pagination.iter_pages(session, _url(server), headers))
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_failed_page_raises(server, sentinel, session, prefetch):
+    server.fail_next('skipToken=10', 403)
+    items = []
+    with pytest.raises(pagination.PageError) as raised:
+        for item in pagination.iter_values(session, _url(server), dict,
+                                           prefetch):
+            items.append(item)
+    assert len(items) == 10
+    assert raised.value.status_code == 403
+    assert raised.value.error['code'] == '403'
+    assert 'skipToken=10' in raised.value.url
+
+
+def test_client_iterators_raise(server, sentinel):
+    server.fail_next('/incidents', 500, count=10)
+    with pytest.raises(pagination.PageError):
+        list(sentinel.iter_incs())
+
+
+def test_rule_plan_never_uses_partial_rules(server, sentinel):
+    from azure_api_clients import rule_deploy
+    server.fail_next('skipToken=20', 500, count=10)
+    with pytest.raises(pagination.PageError):
+        rule_deploy.plan(sentinel, {}, prune=True)
@@ -0,0 +1,80 @@
+import os
+
+from azure_api_clients import photo_cache
+from benchmarks.mock_server import PHOTO
+
+
+def _photos(tmp_path):
+    return sorted(p.name for p in tmp_path.iterdir()
+                  if p.name.endswith('.photo'))
+
+
+def test_shared_photo_stored_once(server, graph, tmp_path):
+    cache = photo_cache.PhotoCache(str(tmp_path))
+    paths = cache.get_paths(graph, [f'user{i}' for i in range(5)] +
+                            ['user0'])
+    assert len(paths) == 5 and len(set(paths.values())) == 1
+    assert len(_photos(tmp_path)) == 1
+    # Metadata and binary for every user
+    assert server.requests == 10
+    assert cache.get_bytes(graph, 'user3') == PHOTO
+    assert server.requests == 10
+
+
+def test_unchanged_etag_skips_download(server, graph, tmp_path):
+    cache = photo_cache.PhotoCache(str(tmp_path), max_age=0)
+    path = cache.get_path(graph, 'user1')
+    assert cache.get_path(graph, 'user1') == path
+    # Only the metadata was fetched again
+    assert server.requests == 3
+
+
+def test_changed_photo_downloaded(server, graph, tmp_path):
+    cache = photo_cache.PhotoCache(str(tmp_path), max_age=0)
+    old = cache.get_path(graph, 'user1')
+    server.graph['photos']['user1'] = b'new photo'
+    assert cache.get_bytes(graph, 'user1') == b'new photo'
+    assert cache.get_path(graph, 'user2') == old
+    assert len(_photos(tmp_path)) == 2
+
+
+def test_missing_photo_remembered(server, graph, tmp_path):
+    cache = photo_cache.PhotoCache(str(tmp_path))
+    assert cache.get_path(graph, 'nobody') is None
+    assert cache.get_bytes(graph, 'nobody') is None
+    assert server.requests == 1
+
+
+def test_least_recently_served_evicted(server, graph, tmp_path):
+    for i in range(3):
+        server.graph['photos'][f'user{i}'] = bytes([i]) * 100
+    cache = photo_cache.PhotoCache(str(tmp_path), max_bytes=250)
+    first = cache.get_path(graph, 'user0')
+    cache.get_path(graph, 'user1')
+    cache.get_path(graph, 'user0')
+    cache.get_path(graph, 'user2')
+    assert os.path.exists(first)
+    assert len(_photos(tmp_path)) == 2
+    requests = server.requests
+    # user1 was evicted and is fetched again
+    assert cache.get_bytes(graph, 'user1') == bytes([1]) * 100
+    assert server.requests == requests + 2
+
+
+def test_index_survives_reopen(server, graph, tmp_path):
+    path = photo_cache.PhotoCache(str(tmp_path)).get_path(graph, 'user4')
+    cache = photo_cache.PhotoCache(str(tmp_path))
+    assert cache.get_path(graph, 'user4') == path
+    assert server.requests == 2
+    mapped = cache.open_mmap(graph, 'user4')
+    assert mapped[:] == PHOTO
+    mapped.close()
+
+
+def test_clear(server, graph, tmp_path):
+    cache = photo_cache.PhotoCache(str(tmp_path))
+    cache.get_path(graph, 'user0')
+    cache.clear()
+    assert _photos(tmp_path) == []
+    cache.get_path(graph, 'user0')
+    assert server.requests == 4
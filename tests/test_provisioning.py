@@ -0,0 +1,93 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from azure_api_clients import provisioning
+from tests.conftest import RG, SUB
+
+
+def _table(name, workspace):
+    return {'name': name, 'workspace': workspace,
+            'body': {'properties': {'schema': {'name': name, 'columns': [
+                {'name': 'TimeGenerated', 'type': 'datetime'}]}}}}
+
+
+def _dcr(name, table, workspaces=()):
+    return {'name': name, 'body': {'location': 'eastus', 'properties': {
+        'destinations': {'logAnalytics': [
+            {'name': ws, 'workspaceResourceId':
+             f'/subscriptions/{SUB}/resourceGroups/{RG}/providers/'
+             f'Microsoft.OperationalInsights/workspaces/{ws}'}
+            for ws in workspaces]},
+        'dataFlows': [{'streams': [f'Custom-{table}'],
+                       'destinations': list(workspaces),
+                       'outputStream': f'Custom-{table}'}]}}}
+
+
+def _run(monitor, manifest, **kwargs):
+    return provisioning.provision(monitor, manifest, poll_interval=0,
+                                  **kwargs)
+
+
+def test_same_table_in_two_workspaces(server, monitor):
+    reports = _run(monitor, {'tables': [_table('Events_CL', 'ws1'),
+                                        _table('Events_CL', 'ws2')]})
+    assert [(r['workspace'], r['status']) for r in reports] == \
+        [('ws1', 'created'), ('ws2', 'created')]
+    assert monitor.get_table('Events_CL', 'ws2')
+
+
+def test_duplicate_item_rejected():
+    with pytest.raises(ValueError, match='Duplicate'):
+        provisioning.plan({'tables': [_table('T_CL', 'ws1'),
+                                      _table('T_CL', 'WS1')]})
+
+
+def test_dcr_requires_tables_of_its_workspaces():
+    items = provisioning.plan({
+        'tables': [_table('T_CL', 'ws1'), _table('T_CL', 'ws2')],
+        'dcrs': [_dcr('one', 'T_CL', ['ws1']), _dcr('all', 'T_CL')]})
+    assert items[('dcr', None, 'one')]['requires'] == {
+        ('table', 'ws1', 'T_CL')}
+    assert items[('dcr', None, 'all')]['requires'] == {
+        ('table', 'ws1', 'T_CL'), ('table', 'ws2', 'T_CL')}
+
+
+def test_failed_table_skips_only_its_workspace(server, monitor):
+    server.fail_next('workspaces/ws2/tables/T_CL', 400, method='PUT')
+    reports = _run(monitor, {
+        'tables': [_table('T_CL', 'ws1'), _table('T_CL', 'ws2')],
+        'dcrs': [_dcr('one', 'T_CL', ['ws1']),
+                 _dcr('two', 'T_CL', ['ws2'])]})
+    status = {(r['kind'], r['workspace'], r['name']): r['status']
+              for r in reports}
+    assert status == {('table', 'ws1', 'T_CL'): 'created',
+                      ('table', 'ws2', 'T_CL'): 'failed',
+                      ('dcr', None, 'one'): 'created',
+                      ('dcr', None, 'two'): 'skipped'}
+
+
+def test_unchanged_items_skipped(server, monitor):
+    manifest = {'tables': [_table('T_CL', 'ws1')],
+                'dcrs': [_dcr('one', 'T_CL', ['ws1'])]}
+    _run(monitor, manifest)
+    reports = _run(monitor, manifest)
+    assert [r['status'] for r in reports] == ['unchanged', 'unchanged']
+
+
+def test_unknown_dependency_and_cycle():
+    with pytest.raises(ValueError, match='unknown'):
+        provisioning.plan({'dcrs': [{**_dcr('a', 'T_CL'),
+                                     'depends_on': ['missing']}]})
+    with pytest.raises(ValueError, match='cycle'):
+        provisioning.plan({'dcrs': [{**_dcr('a', 'X'), 'depends_on': ['b']},
+                                    {**_dcr('b', 'Y'), 'depends_on': ['a']}]})
+
+
+def test_poll_honors_http_date_retry_after(server, monitor):
+    server.fail_next('operationStatuses', 429, headers={
+        'Retry-After': formatdate(time.time() - 1, usegmt=True)})
+    reports = _run(monitor, {'tables': [_table('T_CL', 'ws1')]})
+    assert reports[0]['status'] == 'created'
+    assert server.faults[0][0] == 0
@@ -0,0 +1,74 @@
+import time
+from email.utils import formatdate
+
+from azure_api_clients import purge_manager
+from azure_api_clients.sentinel_client import SentinelClient
+from tests.conftest import API_VERSION, RG, SUB
+
+BODY = {'table': 'Heartbeat',
+        'filters': [{'column': 'Computer', 'operator': '==',
+                     'value': 'host1'}]}
+
+
+def _client(server, session, token, ws):
+    return SentinelClient(SUB, RG, ws, API_VERSION, session=session,
+                          resource=server.url, token_provider=token)
+
+
+def test_submit_and_poll(server, session, token):
+    client = _client(server, session, token, 'ws')
+    job = purge_manager.submit_purge(client, BODY)
+    assert job['status'] == 'pending'
+    assert job['operation_id'] in job['location']
+    while purge_manager.poll_purge(client, job) is not None:
+        pass
+    assert job['status'] == 'completed'
+    assert job['ok']
+
+
+def test_submit_retries_http_date_retry_after(server, session, token):
+    client = _client(server, session, token, 'ws')
+    server.fail_next('/purge', 429, headers={
+        'Retry-After': formatdate(time.time() - 1, usegmt=True)})
+    job = purge_manager.submit_purge(client, BODY)
+    assert job['status'] == 'pending'
+    assert job['attempts'] == 2
+
+
+def test_submit_failure_reports_error(server, session, token):
+    client = _client(server, session, token, 'ws')
+    server.fail_next('/purge', 400)
+    job = purge_manager.submit_purge(client, BODY)
+    assert job['status'] == 'failed'
+    assert job['error']['code'] == '400'
+
+
+def test_purge_many_across_workspaces(server, session, token):
+    updates = []
+    jobs = [(_client(server, session, token, ws), BODY)
+            for ws in ('ws1', 'ws2', 'ws3')]
+    server.fail_next('/operations/', 429, headers={'Retry-After': '0'})
+    reports = purge_manager.purge_many(jobs, poll_interval=0.01,
+                                       max_interval=0.05,
+                                       on_update=updates.append)
+    assert [r['workspace'] for r in reports] == ['ws1', 'ws2', 'ws3']
+    assert all(r['status'] == 'completed' for r in reports)
+    # One update on submission and one when finished
+    assert len(updates) == 6
+
+
+def test_purge_timeout(server, session, token):
+    client = _client(server, session, token, 'ws')
+    # The mock reports the operation pending on its first poll
+    reports = purge_manager.purge_many([(client, BODY)], poll_interval=0.01,
+                                       max_interval=0.01, timeout=0)
+    assert reports[0]['status'] == 'timeout'
+    assert not reports[0]['ok']
+
+
+def test_poll_failure_finishes_job(server, session, token):
+    client = _client(server, session, token, 'ws')
+    job = purge_manager.submit_purge(client, BODY)
+    server.fail_next('/operations/', 404)
+    assert purge_manager.poll_purge(client, job) is None
+    assert job['status'] == 'failed'
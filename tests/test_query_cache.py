@@ -0,0 +1,162 @@
+import os
+import pickle
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from azure_api_clients import query_cache
+from azure_api_clients.query_cache import QueryCache, make_key
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+RECORDS = [[{'TimeGenerated': NOW, 'Computer': 'host1', 'Count': 3,
+             'Elapsed': timedelta(seconds=90), 'Tags': {'a': [1, 2]}}]]
+ROWS = [(['TimeGenerated', 'Computer'], [(NOW, 'host1'), (NOW, None)])]
+
+
+def test_make_key_normalizes():
+    assert make_key('WS', 'T  |\n take 1', timedelta(1)) == \
+        make_key('ws', 'T | take 1', timedelta(1))
+    assert make_key('ws', 'T', timedelta(1), 'rows') != \
+        make_key('ws', 'T', timedelta(1), 'records')
+
+
+def test_hits_are_private_copies():
+    cache = QueryCache()
+    cache.set('k', RECORDS)
+    first = cache.get('k')
+    first[0][0]['Computer'] = 'changed'
+    assert cache.get('k') == RECORDS
+
+
+def test_ttl_expiry(monkeypatch):
+    cache = QueryCache(ttl=10)
+    cache.set('k', [1])
+    later = time.time() + 11
+    monkeypatch.setattr(query_cache.time, 'time', lambda: later)
+    assert cache.get('k') is None
+    assert cache.size == 0
+
+
+def test_memory_lru_budget():
+    blob = len(pickle.dumps(['x' * 100], protocol=pickle.HIGHEST_PROTOCOL))
+    cache = QueryCache(max_bytes=blob * 2)
+    cache.set('a', ['x' * 100])
+    cache.set('b', ['x' * 100])
+    cache.get('a')
+    cache.set('c', ['x' * 100])
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.size <= cache.max_bytes
+
+
+@pytest.mark.parametrize('value', [RECORDS, ROWS, {'columns': [1, None]}])
+def test_disk_round_trip_keeps_types(tmp_path, value):
+    key = make_key('ws', 'T', None, 'rows')
+    QueryCache(path=str(tmp_path)).set(key, value)
+    assert os.listdir(tmp_path) == [key + '.json']
+    assert QueryCache(path=str(tmp_path)).get(key) == value
+
+
+def test_disk_skips_values_json_cannot_hold(tmp_path):
+    cache = QueryCache(path=str(tmp_path))
+    key = make_key('ws', 'T', None, 'dataframe')
+    cache.set(key, [object()])
+    assert os.listdir(tmp_path) == []
+    assert cache.get(key) is not None
+
+
+def test_disk_never_unpickles(tmp_path):
+    key = make_key('ws', 'T', None, 'json')
+
+    class Boom:
+        def __reduce__(self):
+            return (os.remove, (str(tmp_path / 'canary'),))
+
+    (tmp_path / 'canary').write_text('alive')
+    with open(tmp_path / (key + '.pkl'), 'wb') as fd:
+        pickle.dump((time.time() + 300, pickle.dumps(Boom())), fd)
+    (tmp_path / 'notes.txt').write_text('not ours')
+    cache = QueryCache(path=str(tmp_path))
+    assert cache.get(key) is None
+    assert (tmp_path / 'canary').exists()
+    # The stale pickle is swept, unrelated files are left alone
+    assert sorted(os.listdir(tmp_path)) == ['canary', 'notes.txt']
+
+
+def test_disk_sweeps_expired_and_enforces_budget(tmp_path):
+    cache = QueryCache(path=str(tmp_path), max_bytes=1000)
+    keys = [make_key('ws', f'T{i}', None) for i in range(10)]
+    for key in keys:
+        cache.set(key, ['x' * 200])
+    files = os.listdir(tmp_path)
+    assert 0 < len(files) < 10
+    assert sum(os.path.getsize(tmp_path / name) for name in files) <= 1000
+    assert cache.disk_size <= 1000
+    # The newest entries are kept
+    assert keys[-1] + '.json' in files
+
+    expired = tmp_path / files[0]
+    os.utime(expired, (time.time() - 1, time.time() - 1))
+    QueryCache(path=str(tmp_path), max_bytes=1000)
+    assert not expired.exists()
+
+
+def test_disk_sweeps_only_past_budget(tmp_path, monkeypatch):
+    cache = QueryCache(path=str(tmp_path), max_bytes=1000)
+    sweeps = []
+    sweep = cache.sweep
+    monkeypatch.setattr(cache, 'sweep', lambda: sweeps.append(1) or sweep())
+    key = make_key('ws', 'T', None)
+    for _ in range(3):
+        cache.set(key, ['x' * 200])
+    cache.set(make_key('ws', 'U', None), ['x' * 200])
+    assert not sweeps
+    assert cache.disk_size == sum(os.path.getsize(tmp_path / name)
+                                  for name in os.listdir(tmp_path))
+    for i in range(5):
+        cache.set(make_key('ws', f'V{i}', None), ['x' * 200])
+    assert sweeps and cache.disk_size <= 1000
+
+
+def test_expired_file_removed_on_read(tmp_path, monkeypatch):
+    cache = QueryCache(path=str(tmp_path), ttl=10)
+    key = make_key('ws', 'T', None)
+    cache.set(key, [1])
+    fresh = QueryCache(path=str(tmp_path), ttl=10)
+    later = time.time() + 11
+    monkeypatch.setattr(query_cache.time, 'time', lambda: later)
+    assert fresh.get(key) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_clear(tmp_path):
+    cache = QueryCache(path=str(tmp_path))
+    cache.set(make_key('ws', 'T', None), [1])
+    (tmp_path / 'notes.txt').write_text('not ours')
+    cache.clear()
+    assert os.listdir(tmp_path) == ['notes.txt']
+    assert cache.get(make_key('ws', 'T', None)) is None
+
+
+def test_engine_serves_repeats_from_cache(server, tmp_path):
+    pytest.importorskip('azure.monitor.query')
+    from azure_api_clients.law_query import QueryEngine
+    from benchmarks.mock_server import MockCredential
+
+    cache = QueryCache(path=str(tmp_path))
+    engine = QueryEngine(credential=MockCredential(), cache=cache,
+                         endpoint=server.url + '/v1',
+                         query_kwargs={'enforce_https': False})
+    first = engine.execute('ws', 'T | take 5', timedelta(1), 'records')
+    assert engine.execute('ws', 'T  | take 5', timedelta(1),
+                          'records') == first
+    assert server.requests == 1
+    # A new process would read the file the first query left
+    fresh = QueryEngine(credential=MockCredential(),
+                        cache=QueryCache(path=str(tmp_path)),
+                        endpoint=server.url + '/v1',
+                        query_kwargs={'enforce_https': False})
+    assert fresh.execute('ws', 'T | take 5', timedelta(1),
+                         'records') == first
+    assert server.requests == 1
@@ -0,0 +1,131 @@
+import base64
+import json
+
+from requests.structures import CaseInsensitiveDict
+
+from azure_api_clients import api_auth
+from azure_api_clients import rate_governor
+from azure_api_clients import transport
+from azure_api_clients.graph_client import GraphClient
+from benchmarks.mock_server import ARM_BUDGET
+
+GRAPH = 'https://graph.microsoft.com/v1.0/security/incidents'
+ARM = ('https://management.azure.com/subscriptions/SUB/resourceGroups/rg'
+       '/providers/Microsoft.SecurityInsights/incidents')
+
+
+def _observe(governor, url, status=200, method='GET', tenant=None,
+             **headers):
+    governor.observe(method, url, status, CaseInsensitiveDict(headers),
+                     tenant)
+
+
+def _jwt(tenant):
+    claims = base64.urlsafe_b64encode(json.dumps({'tid': tenant}).encode())
+    return 'e30.' + claims.decode().rstrip('=') + '.sig'
+
+
+def test_key_for():
+    governor = rate_governor.RateGovernor()
+    assert governor.key_for('GET', ARM) == ('subscription/sub', 'reads')
+    assert governor.key_for('patch', GRAPH) == ('graph.microsoft.com',
+                                                'writes')
+
+
+def test_tenant_of():
+    assert rate_governor.tenant_of(
+        {'authorization': 'Bearer ' + _jwt('tenant-a')}) == 'tenant-a'
+    assert rate_governor.tenant_of({'Authorization': 'Bearer opaque'}) \
+        is None
+    assert rate_governor.tenant_of(None) is None
+
+
+def test_tenants_throttle_independently():
+    governor = rate_governor.RateGovernor()
+    _observe(governor, GRAPH, 429, tenant='A', **{'Retry-After': '30'})
+    assert governor.reserve_slot('GET', GRAPH, 'A') > 29
+    assert governor.reserve_slot('GET', GRAPH + '/1', 'B') == 0
+    assert governor.reserve_slot('GET', GRAPH) == 0
+    assert set(governor.budget()) == {'graph.microsoft.com/a/reads',
+                                      'graph.microsoft.com/b/reads',
+                                      'graph.microsoft.com/reads'}
+
+
+def test_session_keys_graph_by_token_tenant(server, graph):
+    governor = rate_governor.RateGovernor()
+    session = transport.ClientSession(governor=governor)
+    clients = {tenant: GraphClient(
+        None, None, None, session=session, resource=server.url,
+        token_provider=api_auth.StaticTokenProvider(_jwt(tenant)))
+        for tenant in ('tenant-a', 'tenant-b')}
+    server.fail_next('/security/incidents/1', 429)
+    clients['tenant-a'].get_inc('1')
+    clients['tenant-b'].get_inc('2')
+    session.close()
+    host = server.url.split('//')[1].split(':')[0]
+    budget = governor.budget()
+    assert budget[f'{host}/tenant-a/reads']['blocked_for'] > 0
+    assert budget[f'{host}/tenant-b/reads']['blocked_for'] == 0
+    assert budget[f'{host}/tenant-b/reads']['throttled'] == 0
+
+
+def test_graph_hint_paces_until_it_clears():
+    governor = rate_governor.RateGovernor(reserve=5,
+                                          refill_rates={'reads': 1000})
+    _observe(governor, GRAPH,
+             **{rate_governor.GRAPH_THROTTLE_HEADER: '1.2'})
+    assert governor.budget()['graph.microsoft.com/reads']['remaining'] == 5
+    governor.reserve_slot('GET', GRAPH)
+    assert governor.reserve_slot('GET', GRAPH) > 0
+
+    _observe(governor, GRAPH)
+    assert governor.budget()['graph.microsoft.com/reads']['remaining'] \
+        is None
+    assert governor.reserve_slot('GET', GRAPH) == 0
+
+
+def test_graph_429_clears():
+    governor = rate_governor.RateGovernor()
+    _observe(governor, GRAPH, 429, **{'Retry-After': '0'})
+    budget = governor.budget()['graph.microsoft.com/reads']
+    assert budget['remaining'] == 0 and budget['throttled'] == 1
+    _observe(governor, GRAPH)
+    assert governor.budget()['graph.microsoft.com/reads']['remaining'] \
+        is None
+
+
+def test_remaining_never_negative():
+    governor = rate_governor.RateGovernor(reserve=1,
+                                          refill_rates={'writes': 1e6})
+    _observe(governor, GRAPH, method='POST',
+             **{rate_governor.GRAPH_THROTTLE_HEADER: '1.5'})
+    for _ in range(5):
+        governor.reserve_slot('POST', GRAPH)
+    assert governor.budget()['graph.microsoft.com/writes']['remaining'] == 0
+
+
+def test_arm_count_kept_without_header():
+    governor = rate_governor.RateGovernor()
+    _observe(governor, ARM, **{rate_governor.REMAINING_HEADERS['reads']:
+                               '10'})
+    _observe(governor, ARM)
+    assert governor.budget()['subscription/sub/reads']['remaining'] == 10
+
+
+def test_429_blocks_budget():
+    governor = rate_governor.RateGovernor()
+    _observe(governor, ARM, 429, **{'Retry-After': '30'})
+    assert governor.budget()['subscription/sub/reads']['blocked_for'] > 29
+    assert governor.reserve_slot('GET', ARM) > 29
+    # Writes are a separate bucket
+    assert governor.reserve_slot('PUT', ARM) == 0
+
+
+def test_session_observes_mock_arm(server, sentinel):
+    governor = rate_governor.RateGovernor()
+    session = transport.ClientSession(governor=governor)
+    sentinel.session = session
+    sentinel.get_alertrules()
+    session.close()
+    budget = governor.budget()['subscription/sub/reads']
+    assert budget['remaining'] == ARM_BUDGET
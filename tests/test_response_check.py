@@ -0,0 +1,39 @@
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from azure_api_clients import response_check
+
+
+def test_retry_after_seconds():
+    assert response_check.retry_after({'Retry-After': '7'}) == 7.0
+    assert response_check.retry_after({'Retry-After': '-3'}) == 0.0
+
+
+def test_retry_after_http_date():
+    headers = {'Retry-After': formatdate(time.time() + 30, usegmt=True)}
+    assert 25 <= response_check.retry_after(headers) <= 30
+    past = {'Retry-After': formatdate(time.time() - 30, usegmt=True)}
+    assert response_check.retry_after(past) == 0.0
+
+
+def test_retry_after_any_header_case():
+    assert response_check.retry_after({'retry-after': '4'}) == 4.0
+    assert response_check.retry_after(
+        CaseInsensitiveDict({'RETRY-AFTER': '5'})) == 5.0
+
+
+@pytest.mark.parametrize('headers', [{}, {'Retry-After': 'soon'}])
+def test_retry_after_falls_back(headers):
+    assert response_check.retry_after(headers, default=1.5) == 1.5
+    assert response_check.retry_after(headers, attempt=3) == 8
+    assert response_check.retry_after(headers, attempt=10) == \
+        response_check.MAX_BACKOFF
+
+
+def test_error_detail_from_mock(server):
+    response = requests.get(server.url + '/v1.0/security/incidents/none')
+    assert response_check.error_detail(response)['code'] == 'NotFound'
@@ -0,0 +1,106 @@
+import requests
+
+from azure_api_clients import rule_deploy
+from tests.conftest import RG, SUB, WS
+
+BASE = (f'/subscriptions/{SUB}/resourceGroups/{RG}/providers/'
+        'Microsoft.OperationalInsights/workspaces/'
+        f'{WS}/providers/Microsoft.SecurityInsights')
+
+
+def _rule(**properties):
+    return {'kind': 'Scheduled', 'properties': {
+        'displayName': 'Managed', 'enabled': True, 'severity': 'High',
+        'query': 'SecurityEvent | take 1', **properties}}
+
+
+def _actions(sentinel, desired):
+    return {action['name']: action['action']
+            for action in rule_deploy.plan(sentinel, desired)}
+
+
+def test_deploy_then_unchanged(server, sentinel):
+    reports = rule_deploy.deploy(sentinel, {'managed': _rule()})
+    assert [(r['action'], r['ok']) for r in reports] == [('create', True)]
+    assert _actions(sentinel, {'managed': _rule()}) == {
+        'managed': 'unchanged'}
+
+
+def test_query_whitespace_is_unchanged(server, sentinel):
+    rule_deploy.deploy(sentinel, {'managed': _rule()})
+    changed = _rule(query='SecurityEvent | take 1  \r\n')
+    assert _actions(sentinel, {'managed': changed}) == {
+        'managed': 'unchanged'}
+
+
+def test_removed_property_is_deployed(server, sentinel):
+    mappings = [{'entityType': 'Host', 'fieldMappings': [
+        {'identifier': 'HostName', 'columnName': 'Computer'}]}]
+    rule_deploy.deploy(sentinel, {'managed': _rule(entityMappings=mappings)})
+    assert _actions(sentinel, {'managed': _rule()}) == {'managed': 'update'}
+
+
+def test_service_defaults_are_unchanged(server, sentinel):
+    server.put_arm(f'{BASE}/alertRules/managed', _rule(
+        suppressionDuration='PT5H', suppressionEnabled=False,
+        alertDetailsOverride=None,
+        incidentConfiguration={'createIncident': True,
+                               'groupingConfiguration': {'enabled': False}}))
+    desired = _rule(incidentConfiguration={'createIncident': True})
+    assert _actions(sentinel, {'managed': desired}) == {
+        'managed': 'unchanged'}
+    desired = _rule(suppressionDuration='PT1H')
+    assert _actions(sentinel, {'managed': desired}) == {'managed': 'update'}
+
+
+def test_rule_from_template(server, sentinel):
+    reports = rule_deploy.deploy(sentinel, [
+        {'name': 'from-template', 'template': 'template-2',
+         'properties': {'severity': 'Low'}}])
+    assert reports[0]['ok']
+    rule = server.arm[f'{BASE}/alertRules'.lower()]['from-template']
+    assert rule['properties']['alertRuleTemplateName'] == 'template-2'
+    assert rule['properties']['severity'] == 'Low'
+
+
+def test_prune_managed(server, sentinel):
+    actions = rule_deploy.plan(
+        sentinel, {'managed': _rule()}, prune=True,
+        managed=lambda rule: rule['name'] in ('rule-1', 'rule-2'))
+    assert sorted(a['name'] for a in actions
+                  if a['action'] == 'delete') == ['rule-1', 'rule-2']
+
+
+def test_throttled_write_retried(server, sentinel, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rule_deploy.time, 'sleep', sleeps.append)
+    # Without Retry-After the transport leaves the 429 to apply
+    server.fail_next('alertRules/managed', 429, method='PUT')
+    report, = rule_deploy.deploy(sentinel, {'managed': _rule()})
+    assert report['ok'] and report['attempts'] == 2
+    assert sleeps == [2]
+
+
+def test_exception_fails_only_its_action(server, sentinel, monkeypatch):
+    create = sentinel.create_alertrule
+
+    def flaky(name, body):
+        if name == 'broken':
+            raise requests.ConnectionError('connection reset')
+        return create(name, body)
+
+    monkeypatch.setattr(sentinel, 'create_alertrule', flaky)
+    reports = rule_deploy.deploy(sentinel, {'broken': _rule(),
+                                            'managed': _rule()})
+    by_name = {r['name']: r for r in reports}
+    assert not by_name['broken']['ok']
+    assert by_name['broken']['error'] == \
+        'ConnectionError: connection reset'
+    assert by_name['managed']['ok']
+
+
+def test_dry_run_writes_nothing(server, sentinel):
+    reports = rule_deploy.deploy(sentinel, {'managed': _rule()},
+                                 dry_run=True)
+    assert reports[0]['action'] == 'create'
+    assert 'managed' not in server.arm[f'{BASE}/alertRules'.lower()]
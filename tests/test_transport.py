@@ -0,0 +1,72 @@
+import json
+
+import pytest
+import requests
+
+from azure_api_clients import rate_governor
+from azure_api_clients import transport
+from tests.conftest import RG, SUB, WS
+
+
+def _url(server, name='alertRules'):
+    return (f'{server.url}/subscriptions/{SUB}/resourceGroups/{RG}/'
+            'providers/Microsoft.OperationalInsights/workspaces/'
+            f'{WS}/providers/Microsoft.SecurityInsights/{name}'
+            '?api-version=2023-02-01')
+
+
+def test_connections_are_reused(server, sentinel, session):
+    for _ in range(5):
+        assert session.get(_url(server)).status_code == 200
+    pools = session.get_adapter(server.url).poolmanager.pools
+    assert [pools[key].num_connections for key in pools.keys()] == [1]
+
+
+def test_5xx_retried(server, sentinel, session, events):
+    server.fail_next('alertRules', 503, count=2)
+    response = session.get(_url(server))
+    assert response.status_code == 200
+    assert events[-1]['retries'] == 2
+    assert server.requests == 3
+
+
+def test_retries_exhausted_returns_last_response(server, sentinel):
+    session = transport.ClientSession(retries=2, backoff_factor=0,
+                                      backoff_jitter=0)
+    server.fail_next('alertRules', 502, count=5)
+    assert session.get(_url(server)).status_code == 502
+    assert server.requests == 3
+    session.close()
+
+
+def test_4xx_not_retried(server, sentinel, session):
+    server.fail_next('alertRules', 400, count=2)
+    assert session.get(_url(server)).status_code == 400
+    assert server.requests == 1
+
+
+def test_json_body_encoded(server, sentinel, session):
+    response = session.put(_url(server, 'alertRules/new'),
+                           json={'kind': 'Scheduled',
+                                 'properties': {'displayName': 'New'}},
+                           headers={'Authorization': 'Bearer x'})
+    assert response.status_code == 201
+    assert response.request.headers['Content-Type'] == 'application/json'
+    assert json.loads(response.request.body)['properties'] == {
+        'displayName': 'New'}
+
+
+def test_connection_error_recorded(events):
+    session = transport.ClientSession(retries=0)
+    with pytest.raises(requests.ConnectionError):
+        session.get('http://127.0.0.1:9/subscriptions/sub/x')
+    assert events[-1]['status'] == 'error'
+    session.close()
+
+
+def test_shared_session(monkeypatch):
+    monkeypatch.setattr(transport, '_session', None)
+    session = transport.get_session()
+    assert transport.get_session() is session
+    assert session.governor is rate_governor.get_governor()
+    session.close()